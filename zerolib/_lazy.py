@@ -0,0 +1,34 @@
+"""Lazy loading of the public names of a package (PEP 562).
+Heavy dependencies, like cryptography for TLS certificates or coincurve for
+signatures, are then only imported when the names that need them are used."""
+import sys
+from importlib import import_module
+
+
+def attach(package, exports):
+    """[exports] maps the name of each submodule of [package] to the names it exports.
+    Returns (__getattr__, __dir__, __all__) for the __init__ of [package].
+    Before Python 3.7, a module cannot define __getattr__, so every submodule
+    is imported at once. Submodules must then import on every supported
+    version, so anything newer than Python 3.5 needs a fallback."""
+    where = {name: submodule for (submodule, names) in exports.items() for name in names}
+    names = sorted(where)
+
+    def __getattr__(name):
+        submodule = where.get(name)
+        if submodule is None:
+            if name in exports:
+                return import_module('.' + name, package)
+            raise AttributeError('module %r has no attribute %r' % (package, name))
+        value = getattr(import_module('.' + submodule, package), name)
+        # Cache it, so that __getattr__ is not called again
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(names) | set(exports))
+
+    if sys.version_info < (3, 7):
+        for name in names:
+            __getattr__(name)
+    return (__getattr__, __dir__, names)
@@ -0,0 +1,74 @@
+"""Benchmarks for the hot paths of zerolib.
+Each module can be run on its own, e.g. python3 -m zerolib.bench.manifest,
+or all together with python3 -m zerolib.bench, which compares the results
+with a stored baseline."""
+import gc
+import time
+import tracemalloc
+
+# Modules run by python3 -m zerolib.bench, in order
+modules = (
+    'packets', 'integrity', 'sequencing', 'server', 'capture', 'admission', 'routing', 'locks', 'conn', 'manifest',
+    'hashfield', 'hashindex', 'store', 'tls', 'imports',
+)
+# Every (name, value, unit, informational) reported so far
+results = []
+
+
+def measure(func, repeat=5, number=1):
+    """Call [func] [number] times in a row, [repeat] times.
+    If [number] is None, it is chosen so that each round takes about 20 ms.
+    Returns the best time per call, in seconds."""
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if number is None:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            number = max(1, min(10000, int(0.02 / max(elapsed, 1e-7))))
+        for i in range(repeat):
+            start = time.perf_counter()
+            for j in range(number):
+                func()
+            elapsed = (time.perf_counter() - start) / number
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+def footprint(func):
+    """Call [func] and measure the memory held by its return value.
+    Returns (return_value, bytes)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (result, after - before)
+
+def calibration_loop():
+    counts = {}
+    for i in range(1000):
+        key = i % 31
+        counts[key] = counts.get(key, 0) + i
+    return sorted(counts.items())
+
+def calibrate():
+    """Time a fixed pure-Python loop, in seconds. Timings are compared with
+    the baseline relative to it, so that a machine that is busy, or faster
+    or slower than the baseline one, is not mistaken for a regression."""
+    return measure(calibration_loop, repeat=10, number=None)
+
+def report(name, value, unit, informational=False):
+    """Record a result. [informational] results, like the standard library
+    code that zerolib is compared with, are shown but never gated."""
+    results.append((name, value, unit, informational))
+    print('%-40s %14.3f %s%s' % (name, value, unit, ' (informational)' if informational else ''))
@@ -0,0 +1,186 @@
+"""Run the benchmarks and compare them with a baseline.
+Exits with status 1 if a result is worse than the baseline by more than
+the threshold, so that the suite can gate changes to the hot paths.
+Timings are scaled by the calibration loop measured with each run, so that a
+baseline recorded on another machine still applies. With --raw, they are
+compared as they are, which only makes sense with a baseline recorded on this
+machine."""
+import argparse
+import importlib
+import json
+import os
+import sys
+from statistics import median
+from . import calibrate, modules, results
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+calibration = 'calibration loop'
+time_units = frozenset(('s', 'ms', 'us', 'ns'))
+
+
+def higher_is_better(unit):
+    """Rates like '/s' or 'MiB/s' grow when things get faster. Times and sizes shrink."""
+    return unit.endswith('/s')
+
+def unit_scale(unit, scale):
+    """Return what a baseline value in [unit] is multiplied by on a machine
+    [scale] times as slow as the baseline one. Sizes do not change."""
+    if higher_is_better(unit):
+        return 1 / scale
+    if unit.split('/')[0] in time_units:
+        return scale
+    return 1.0
+
+def run(names):
+    """Run the benchmark modules [names]. Returns (entries, failed, owners), where
+    [entries] maps each benchmark name to {'value': ..., 'unit': ...}, plus
+    'informational': True for results that are not gated, [failed] lists the
+    modules whose main() returned False, and [owners] maps each benchmark name
+    to its module. The calibration loop is timed before each module and after
+    the last one, and the median time is reported, so that it reflects the speed
+    of the machine over the whole run."""
+    del results[:]
+    failed = []
+    owners = {}
+    samples = []
+    for name in names:
+        module = importlib.import_module('%s.%s' % (__package__, name))
+        samples.append(calibrate())
+        print('## %s' % name)
+        start = len(results)
+        if module.main() is False:
+            failed.append(name)
+        owners.update((result[0], name) for result in results[start:])
+    entries = {name: {'value': value, 'unit': unit} for (name, value, unit, informational) in results}
+    for (name, value, unit, informational) in results:
+        if informational:
+            entries[name]['informational'] = True
+    samples.append(calibrate())
+    entries[calibration] = {'value': median(samples) * 1e6, 'unit': 'us', 'informational': True}
+    return (entries, failed, owners)
+
+def keep_best(entries, again):
+    """Update [entries] with the results of [again] that are better."""
+    for (name, entry) in again.items():
+        old = entries.get(name)
+        if old is None or old['unit'] != entry['unit']:
+            continue
+        better = max if higher_is_better(entry['unit']) else min
+        old['value'] = better(old['value'], entry['value'])
+
+def machine_scale(entries, baseline):
+    """Return how many times as slow as the baseline machine this one is,
+    going by the calibration loop, or 1.0 if either lacks it."""
+    if calibration not in entries or calibration not in baseline or baseline[calibration]['value'] <= 0:
+        return 1.0
+    return entries[calibration]['value'] / baseline[calibration]['value']
+
+def compare(entries, baseline, threshold, raw=False):
+    """Compare [entries] with [baseline], both as returned by run(). Baseline
+    timings are first scaled by machine_scale(), unless [raw] is true.
+    Informational results are skipped.
+    Returns a list of (name, expected_value, value, unit) for the regressions."""
+    scale = 1.0 if raw else machine_scale(entries, baseline)
+    regressions = []
+    for (name, entry) in sorted(entries.items()):
+        base = baseline.get(name)
+        if base is None or base['unit'] != entry['unit'] or base['value'] <= 0:
+            continue
+        if entry.get('informational') or base.get('informational'):
+            continue
+        expected = base['value'] * unit_scale(entry['unit'], scale)
+        if higher_is_better(entry['unit']):
+            worse = entry['value'] * (1 + threshold) < expected
+        else:
+            worse = entry['value'] > expected * (1 + threshold)
+        if worse:
+            regressions.append((name, expected, entry['value'], entry['unit']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m zerolib.bench', description=__doc__)
+    parser.add_argument('--only', action='append', choices=modules, metavar='MODULE',
+        help='Run only this module. May be repeated.')
+    parser.add_argument('--list', action='store_true', help='List the modules and exit')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to PATH')
+    parser.add_argument('--baseline', metavar='PATH', default=default_baseline,
+        help='Baseline to compare with (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true',
+        help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.25,
+        help='Tolerated slowdown, as a fraction of the baseline (default: %(default)s)')
+    parser.add_argument('--raw', action='store_true',
+        help='Compare timings without scaling them by the calibration loop. '
+            'Only use this with a baseline recorded on this machine')
+    parser.add_argument('--retries', type=int, default=2,
+        help='How many times the modules of regressed results are run again, '
+            'or the extra runs that the baseline is the median of (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print('\n'.join(modules))
+        return 0
+
+    entries, failed, owners = run(args.only or modules)
+    if args.update_baseline:
+        # The baseline is the median of several runs, so that neither a slow
+        # nor a lucky run sets the bar
+        runs = [entries] + [run(args.only or modules)[0] for i in range(args.retries)]
+        for (name, entry) in entries.items():
+            entry['value'] = median(r[name]['value'] for r in runs if name in r)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # Other processes slow benchmarks down, never up, so regressions are
+        # only reported if they persist when their modules are run again
+        for i in range(args.retries):
+            regressions = compare(entries, baseline, args.threshold, args.raw)
+            if not regressions:
+                break
+            names = sorted(set(owners[regression[0]] for regression in regressions), key=modules.index)
+            print('Running again: %s' % ', '.join(names))
+            again, _, _ = run(names)
+            # The scale stays that of the first run
+            del again[calibration]
+            keep_best(entries, again)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+
+    if args.update_baseline:
+        baseline = {}
+        if args.only and os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(entries)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+            f.write('\n')
+        return 0
+
+    status = 1 if failed else 0
+    if os.path.exists(args.baseline):
+        if args.raw:
+            print('Timings compared as they are, with a baseline recorded on this machine')
+        elif calibration not in baseline:
+            # Unscaled timings from an unknown machine would gate on noise
+            print('The baseline at %s has no calibration loop. Record it again with '
+                '--update-baseline, or compare with --raw if it was recorded on this machine' % args.baseline)
+            status = 1
+        else:
+            print('Timings scaled by %.2f, the calibration loop time relative to the baseline' %
+                machine_scale(entries, baseline))
+        regressions = compare(entries, baseline, args.threshold, args.raw)
+        for (name, expected, value, unit) in regressions:
+            print('Regression: %s: %.3f -> %.3f %s' % (name, expected, value, unit))
+        if regressions:
+            status = 1
+    else:
+        print('No baseline at %s' % args.baseline)
+    if failed:
+        print('Failed: %s' % ', '.join(failed))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+from random import Random
+from . import measure, report
+from ..nettools.admission import Admission
+from ..protocol.packets import GetFile, Ping
+
+
+def make_packets(num_peers, count, rng):
+    packets = []
+    for i in range(count):
+        packet = GetFile() if rng.random() < 0.3 else Ping()
+        packet.req_id = i
+        packet.sender = rng.randrange(num_peers)
+        if isinstance(packet, GetFile):
+            packet.offset = 0
+            packet.total_size = rng.randrange(1 << 20)
+        packets.append(packet)
+    return packets
+
+def main(count=20000):
+    rng = Random(0)
+    for num_peers in (1000, 50000):
+        packets = make_packets(num_peers, count, rng)
+        admission = Admission(capacity=num_peers * 2)
+        for packet in packets:
+            admission.push(packet)
+        while admission.pop() is not None:
+            pass
+
+        def run():
+            for packet in packets:
+                admission.push(packet)
+            while admission.pop() is not None:
+                pass
+        report('Admission push+pop (%d peers)' % num_peers, measure(run, repeat=3) * 1e6 / count, 'us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+from io import BytesIO
+from ipaddress import IPv4Address
+import msgpack
+from . import measure, report
+from .corpus import make_packets
+from ..nettools.capture import CaptureWriter, read_capture, replay
+from ..protocol.packets import AddrPort
+
+
+def main(num_frames=2000):
+    packets = make_packets()
+    # Requests only: responses would find no request to answer in a new server
+    requests = [msgpack.packb(packet, use_bin_type=True) for packet in packets.values() if packet['cmd'] != 'response']
+    sender = AddrPort(IPv4Address('10.0.0.1'), 15441)
+
+    writer = CaptureWriter(BytesIO())
+    data = requests[0]
+    report('CaptureWriter.write', measure(lambda: writer.write(data, sender), number=None) * 1e6, 'us')
+
+    f = BytesIO()
+    with CaptureWriter(f) as writer:
+        for i in range(num_frames):
+            writer.write(requests[i % len(requests)], sender, timestamp=i * 0.001)
+    frames = list(read_capture(BytesIO(f.getvalue())))
+    report('read_capture (%d frames)' % num_frames, measure(lambda: list(read_capture(BytesIO(f.getvalue()))), repeat=3) * 1e3, 'ms')
+
+    result = replay(frames)
+    report('replay throughput', result.throughput, '/s')
+    report('replay latency p50', result.latency.percentile(50) / 1e3, 'us', informational=True)
+    report('replay latency p99', result.latency.percentile(99) / 1e3, 'us', informational=True)
+
+
+if __name__ == '__main__':
+    main()
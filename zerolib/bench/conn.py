@@ -0,0 +1,30 @@
+from random import Random
+from . import measure, report
+from ..nettools.conn import Connections
+
+
+def churn(capacity, rounds):
+    """Fill a pool, then keep registering new destinations while using random ones."""
+    rng = Random(capacity)
+    pool = Connections(capacity=capacity)
+    for i in range(capacity):
+        pool.register(i, None)
+
+    dests = list(range(capacity, capacity + rounds))
+    def run():
+        for dest in dests:
+            pool.register(dest, None)
+            key = dest - rng.randint(0, capacity // 2)
+            if key in pool:
+                pool[key]
+    return run
+
+def main():
+    rounds = 20000
+    for capacity in (100, 1000, 10000, 100000):
+        seconds = measure(churn(capacity, rounds), repeat=1)
+        report('Connections.register (capacity %d)' % capacity, seconds * 1e6 / rounds, 'us')
+
+
+if __name__ == '__main__':
+    main()
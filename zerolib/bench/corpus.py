@@ -0,0 +1,77 @@
+"""Deterministic synthetic data for the benchmarks."""
+from random import Random
+
+dir_names = ('css', 'js', 'img', 'data', 'data/users', 'languages', 'media', 'media/video')
+ext_names = ('.json', '.js', '.css', '.png', '.jpg', '.html', '.mp4')
+
+
+def make_content(num_files, seed=0, optional_ratio=0.2):
+    """Make a content.json dictionary with [num_files] files,
+    a fraction of which are listed in "files_optional"."""
+    rng = Random(seed)
+    files = {}
+    files_optional = {}
+    for i in range(num_files):
+        path = '%s/%x/%d%s' % (rng.choice(dir_names), i % 256, i, rng.choice(ext_names))
+        entry = {
+            'sha512': '%064x' % rng.getrandbits(256),
+            'size': rng.randint(0, 1 << 24),
+        }
+        if rng.random() < optional_ratio:
+            files_optional[path] = entry
+        else:
+            files[path] = entry
+
+    return {
+        'address': '1TaLkFrMwvbNsooF4ioKAY9EuxTBTjipT',
+        'files': files,
+        'files_optional': files_optional,
+        'includes': {'data/users/content.json': {'signers': [], 'signers_required': 1}},
+        'modified': 1500000000 + seed,
+        'signs_required': 1,
+    }
+
+
+site = '1TaLkFrMwvbNsooF4ioKAY9EuxTBTjipT'
+
+def make_packets(seed=0):
+    """Make one packet of each parsed type, as the dictionaries that msgpack.packb
+    would send. Returns a dictionary mapping packet names to packets."""
+    from ipaddress import IPv4Address
+    from ..protocol.packets import AddrPort, OnionAddress, pack_dest
+
+    rng = Random(seed)
+    def ip_peers(count):
+        return [pack_dest(AddrPort(IPv4Address(rng.getrandbits(32)), rng.randint(1, 65535))) for i in range(count)]
+    def onion_peers(count):
+        return [pack_dest(AddrPort(OnionAddress(bytes(rng.getrandbits(8) for j in range(10))), rng.randint(1, 65535)))
+            for i in range(count)]
+    def hashfield_raw(count):
+        return b''.join(rng.getrandbits(16).to_bytes(2, byteorder='big') for i in range(count))
+    def request(cmd, **params):
+        return {'cmd': cmd, 'req_id': rng.getrandbits(31), 'params': params}
+    def response(**body):
+        return dict(body, cmd='response', to=rng.getrandbits(31))
+
+    body = bytes(rng.getrandbits(8) for i in range(512 * 1024))
+    user_content = '{"files": {%s}}' % ', '.join('"%d.json": {"sha512": "%064x", "size": %d}' % (
+        i, rng.getrandbits(256), rng.randint(0, 1 << 20)) for i in range(100))
+    return {
+        'ping': request('ping'),
+        'getFile': request('getFile', site=site, inner_path='data/users/content.json', location=0, file_size=len(body)),
+        'pex': request('pex', site=site, need=10, peers=ip_peers(50), peers_onion=onion_peers(10)),
+        'update': request('update', site=site, inner_path='data/users/content.json', body=user_content.encode()),
+        'listModified': request('listModified', site=site, since=1500000000),
+        'getHashfield': request('getHashfield', site=site),
+        'setHashfield': request('setHashfield', site=site, hashfield_raw=hashfield_raw(2000)),
+        'findHashIds': request('findHashIds', site=site, hash_ids=[rng.getrandbits(16) for i in range(100)]),
+        'checkport': request('actionCheckport', port=15441),
+        'RespFile': response(body=body, location=len(body) - 1, size=len(body)),
+        'RespPEX': response(peers=ip_peers(50), peers_onion=onion_peers(10)),
+        'RespMod': response(modified_files={'data/users/%d/content.json' % i: 1500000000 + i for i in range(100)}),
+        'RespHashSet': response(hashfield_raw=hashfield_raw(2000)),
+        'RespHashDict': response(peers={rng.getrandbits(16): ip_peers(5) for i in range(100)}),
+        'RespPort': response(status='open', ip_external='1.2.3.4'),
+        'Predicate': response(ok='Updated'),
+        'Pong': response(body=b'Pong!'),
+    }
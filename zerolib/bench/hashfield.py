@@ -0,0 +1,35 @@
+from random import Random
+from . import measure, footprint, report
+from ..protocol.hashfield import HashField
+from ..protocol.packets import hash_set
+
+
+def make_raw(rng, count=2000):
+    return b''.join(rng.getrandbits(16).to_bytes(2, byteorder='big') for i in range(count))
+
+def main(num_peers=1000):
+    rng = Random(0)
+    raws = [make_raw(rng) for i in range(num_peers)]
+
+    sets, set_size = footprint(lambda: [hash_set(raw) for raw in raws])
+    fields, field_size = footprint(lambda: [HashField.from_raw(raw) for raw in raws])
+    report('hash_set footprint per peer', set_size / num_peers / 1024, 'KiB', informational=True)
+    report('HashField footprint per peer', field_size / num_peers / 1024, 'KiB')
+
+    report('hash_set parse', measure(lambda: hash_set(raws[0]), number=100) * 1e6, 'us', informational=True)
+    report('HashField.from_raw', measure(lambda: HashField.from_raw(raws[0]), number=100) * 1e6, 'us')
+    report('HashField.to_raw', measure(lambda: fields[0].to_raw(), number=100) * 1e6, 'us')
+
+    report('frozenset union (%d peers)' % num_peers, measure(lambda: frozenset().union(*sets)) * 1000, 'ms',
+        informational=True)
+    report('HashField.union (%d peers)' % num_peers, measure(lambda: HashField.union(*fields)) * 1000, 'ms')
+
+    wanted = sets[0]
+    report('frozenset & (%d peers)' % num_peers, measure(lambda: [wanted & s for s in sets]) * 1000, 'ms',
+        informational=True)
+    wanted = fields[0]
+    report('HashField & (%d peers)' % num_peers, measure(lambda: [wanted & f for f in fields]) * 1000, 'ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+from ipaddress import IPv4Address
+from random import Random
+from . import measure, report
+from ..protocol.hashfield import HashField
+from ..protocol.hashindex import HashIndex
+from ..protocol.packets import AddrPort
+
+
+def main(num_peers=2000, num_ids=500):
+    rng = Random(0)
+    peers = [AddrPort(IPv4Address(0x0A000000 + i), 15441) for i in range(num_peers)]
+    fields = [HashField(rng.getrandbits(16) for j in range(num_ids)) for i in range(num_peers)]
+
+    index = HashIndex()
+    report('HashIndex build (%d peers)' % num_peers,
+        measure(lambda: [index.update(p, f) for (p, f) in zip(peers, fields)], repeat=1), 's')
+
+    changed = fields[0].copy()
+    for j in range(10):
+        changed.add(rng.getrandbits(16))
+    report('HashIndex.update (10 new IDs)',
+        measure(lambda: (index.update(peers[0], changed), index.update(peers[0], fields[0])), number=100) * 1e6 / 2, 'us')
+
+    query = [rng.getrandbits(16) for j in range(100)]
+    report('HashIndex.find (100 IDs)', measure(lambda: index.find(query), number=100) * 1e6, 'us')
+    report('scan of every peer (100 IDs)',
+        measure(lambda: {h: [p for (p, f) in zip(peers, fields) if h in f] for h in query}, repeat=1) * 1e6, 'us',
+        informational=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import re
+import subprocess
+import sys
+from . import report
+
+# Cumulative import time budgets, in milliseconds
+budgets = {
+    'zerolib.protocol': 15,
+    'zerolib.integrity': 15,
+    'zerolib.nettools': 15,
+    'zerolib.storage': 15,
+    'zerolib.protocol.packets': 60,
+}
+_line = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\S.*)$')
+
+
+def import_time(module):
+    """Import [module] in a new interpreter with -X importtime.
+    Returns the cumulative import time of [module] in seconds."""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    for line in process.stderr.splitlines():
+        match = _line.match(line)
+        if match and match.group(2).strip() == module:
+            return int(match.group(1)) / 1e6
+    raise ValueError('%s not found in the output of -X importtime' % module)
+
+def main(repeat=5):
+    over = []
+    for (module, budget) in budgets.items():
+        seconds = min(import_time(module) for i in range(repeat))
+        # Gated by its budget rather than by the baseline
+        report('import %s' % module, seconds * 1e3, 'ms', informational=True)
+        if seconds * 1e3 > budget:
+            over.append(module)
+    if over:
+        print('Over budget: %s' % ', '.join(over))
+    return not over
+
+
+if __name__ == '__main__':
+    sys.exit(not main())
@@ -0,0 +1,25 @@
+from io import BytesIO
+from random import Random
+from coincurve import PrivateKey
+from . import measure, report
+from ..integrity.bitcoin import sign_data, verify_data, public_digest
+from ..integrity.hashing import digest_stream, digest_bytes
+
+
+def main(stream_size=16 * 1024 * 1024):
+    rng = Random(0)
+    secretkey = PrivateKey(bytes(rng.getrandbits(8) for i in range(32)))
+    key_digest = public_digest(secretkey.public_key)
+    message = bytes(rng.getrandbits(8) for i in range(10000))
+    signature = sign_data(secretkey, message)
+
+    report('sign_data', measure(lambda: sign_data(secretkey, message), number=20) * 1e6, 'us')
+    report('verify_data', measure(lambda: verify_data(key_digest, signature, message), number=20) * 1e6, 'us')
+
+    data = bytes(rng.getrandbits(8) for i in range(stream_size))
+    report('digest_bytes (%d MiB)' % (stream_size >> 20), measure(lambda: digest_bytes(data)) * 1e3, 'ms')
+    report('digest_stream (%d MiB)' % (stream_size >> 20), measure(lambda: digest_stream(BytesIO(data))) * 1e3, 'ms')
+
+
+if __name__ == '__main__':
+    main()
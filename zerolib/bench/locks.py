@@ -0,0 +1,50 @@
+import threading
+from random import Random
+from time import perf_counter
+from . import report
+from ..storage.locks import RWLock
+
+
+def contend(num_threads, ops, write_ratio):
+    """Run [num_threads] threads doing [ops] lock operations each, a [write_ratio]
+    of which are writes. Returns (seconds, worst writer wait in seconds)."""
+    lock = RWLock()
+    shared = [0]
+    waits = []
+    start_barrier = threading.Barrier(num_threads + 1)
+
+    def work(seed):
+        rng = Random(seed)
+        worst = 0.0
+        start_barrier.wait()
+        for i in range(ops):
+            if rng.random() < write_ratio:
+                begin = perf_counter()
+                with lock.write():
+                    worst = max(worst, perf_counter() - begin)
+                    shared[0] += 1
+            else:
+                with lock.read():
+                    shared[0]
+        waits.append(worst)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    begin = perf_counter()
+    for thread in threads:
+        thread.join()
+    return (perf_counter() - begin, max(waits))
+
+def main():
+    num_threads, ops = 32, 2000
+    for write_ratio in (0.01, 0.05, 0.2):
+        seconds, worst = contend(num_threads, ops, write_ratio)
+        name = 'RWLock %d threads, %d%% writes' % (num_threads, write_ratio * 100)
+        report(name, seconds * 1e6 / (num_threads * ops), 'us/op')
+        report(name + ', worst wait', worst * 1e3, 'ms', informational=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+from . import measure, footprint, report
+from .corpus import make_content
+from ..protocol.content import Manifest
+
+
+def main(num_files=100000):
+    content = make_content(num_files)
+    paths = list(content['files'])[0:1000]
+
+    _, raw_size = footprint(lambda: make_content(num_files))
+    manifest, manifest_size = footprint(lambda: Manifest(content))
+    report('raw dict footprint (%d files)' % num_files, raw_size / 1024 / 1024, 'MiB', informational=True)
+    report('Manifest footprint (%d files)' % num_files, manifest_size / 1024 / 1024, 'MiB')
+
+    report('Manifest parse', measure(lambda: Manifest(content), repeat=3) * 1000, 'ms')
+    report('Manifest.lookup', measure(lambda: [manifest.lookup(p) for p in paths]) * 1e6 / len(paths), 'us')
+    report('Manifest.listdir', measure(lambda: manifest.listdir('data/users')) * 1e6, 'us')
+    report('Manifest.find_hash', measure(lambda: manifest.find_hash(b'\x12\x34'), number=1000) * 1e6, 'us')
+
+    # 1% of the files change, 0.5% are added and 0.5% are removed
+    changed = make_content(num_files)
+    files = changed['files']
+    for (i, path) in enumerate(list(files)):
+        if i % 100 == 0:
+            files[path] = dict(files[path], size=files[path]['size'] + 1)
+        elif i % 200 == 1:
+            del files[path]
+            files['new/' + path] = {'sha512': '00' * 32, 'size': i}
+    new_manifest = Manifest(changed)
+    report('Manifest.diff (%d files)' % num_files, measure(lambda: new_manifest.diff(manifest), repeat=3) * 1000, 'ms')
+    report('raw dict diff (%d files)' % num_files, measure(lambda: raw_diff(content, changed), repeat=3) * 1000, 'ms',
+        informational=True)
+
+def raw_diff(old, new):
+    old_files = dict(old['files'], **old['files_optional'])
+    new_files = dict(new['files'], **new['files_optional'])
+    added = sorted(p for p in new_files if p not in old_files)
+    removed = sorted(p for p in old_files if p not in new_files)
+    changed = sorted(p for (p, d) in new_files.items() if p in old_files and old_files[p] != d)
+    return (added, removed, changed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+from io import BytesIO
+import msgpack
+from . import measure, report
+from .corpus import make_packets
+from ..protocol.packets import unpack, unpack_stream, unpack_dict, hash_set
+
+
+def main(stream_len=200):
+    packets = make_packets()
+    wire = {name: msgpack.packb(packet, use_bin_type=True) for (name, packet) in packets.items()}
+    # What the decoder hands to unpack_dict: bytes keys and values
+    decoded = {name: msgpack.unpackb(data, raw=True, strict_map_key=False) for (name, data) in wire.items()}
+
+    for (name, data) in wire.items():
+        report('unpack %s' % name, measure(lambda: unpack(data), repeat=3, number=None) * 1e6, 'us')
+    for (name, packet) in decoded.items():
+        report('parse %s' % name, measure(lambda: unpack_dict(packet), number=None) * 1e6, 'us')
+
+    # Small packets only, as large ones are timed above
+    names = sorted(name for name in wire if len(wire[name]) < 8192)
+    data = b''.join(wire[names[i % len(names)]] for i in range(stream_len))
+    def read_all():
+        stream = BytesIO(data)
+        for i in range(stream_len):
+            unpack_stream(stream)
+    report('unpack_stream (%d packets)' % stream_len, measure(read_all, repeat=3) * 1e3, 'ms')
+
+    raw = packets['setHashfield']['params']['hashfield_raw']
+    report('hash_set (%d IDs)' % (len(raw) // 2), measure(lambda: hash_set(raw), number=None) * 1e6, 'us',
+        informational=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+from ipaddress import IPv4Address
+from random import Random
+from . import measure, report
+from ..protocol.packets import AddrPort
+from ..protocol.routing import Peer, Router
+
+
+def make_router(count, rng):
+    sites = ['1Site%d' % i for i in range(200)]
+    router = Router()
+    for i in range(count):
+        dest = AddrPort(IPv4Address(rng.getrandbits(32)), rng.randrange(1, 65536))
+        router.put(Peer(dest, 1.7e9 + i, set(rng.sample(sites, 2))))
+    return router
+
+def main(count=200000):
+    rng = Random(0)
+    dirname = tempfile.mkdtemp()
+    try:
+        path = os.path.join(dirname, 'peers')
+        router = make_router(count, rng)
+        paths = iter(range(10))
+        def save():
+            router.save(os.path.join(dirname, 'full%d' % next(paths)))
+        report('Router.save (%d peers)' % count, measure(save, repeat=3), 's')
+        router.save(path)
+        addresses = rng.sample(list(router), 1000)
+
+        report('Router.load (%d peers)' % count, measure(lambda: Router.load(path), number=None) * 1e3, 'ms')
+        def lookup():
+            loaded = Router.load(path)
+            for address in addresses:
+                loaded.get(address)
+        report('Router.get from a loaded file', measure(lookup, repeat=3) * 1e6 / len(addresses), 'us')
+
+        loaded = Router.load(path)
+
+        def save_changes():
+            for address in addresses[0:100]:
+                loaded[address].last_seen += 1
+            loaded.save(path)
+        report('Router.save, 100 changed peers', measure(save_changes, repeat=3) * 1e3, 'ms')
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    main()
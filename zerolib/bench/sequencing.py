@@ -0,0 +1,29 @@
+import msgpack
+from . import measure, report
+from .corpus import make_packets
+from ..protocol.packets import unpack_dict
+from ..protocol.sequencing import PacketInterp
+
+
+def main(rounds=1000):
+    packets = make_packets()
+    def decode(name):
+        return msgpack.unpackb(msgpack.packb(packets[name], use_bin_type=True), raw=True)
+
+    # A getFile request and its response, as seen by the requesting side
+    request = unpack_dict(decode('getFile'), 'peer')
+    response_dict = decode('RespFile')
+    response_dict[b'to'] = request.req_id
+    response_dict[b'location'] = request.total_size - 1
+    response = unpack_dict(response_dict, 'peer')
+
+    interp = PacketInterp()
+    def exchange():
+        for i in range(rounds):
+            interp.register(request)
+            interp.interpret(response)
+    report('PacketInterp register+interpret', measure(exchange) * 1e6 / rounds, 'us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import msgpack
+from . import measure, report
+from .corpus import make_packets
+from ..nettools.server import BaseServer
+from ..protocol.packets import unpack
+
+
+def main(rounds=1000):
+    data = msgpack.packb(make_packets()['ping'], use_bin_type=True)
+    ping = unpack(data)
+
+    results = {}
+    for metrics in (False, True):
+        server = BaseServer(metrics=metrics)
+        def handle():
+            for i in range(rounds):
+                server.handle(ping)
+        def handle_bytes():
+            for i in range(rounds):
+                server.handle_bytes(data)
+        results[metrics] = (measure(handle) / rounds, measure(handle_bytes) / rounds)
+
+    for (i, name) in enumerate(('handle', 'handle_bytes')):
+        report('BaseServer.%s' % name, results[False][i] * 1e6, 'us')
+        report('BaseServer.%s, metrics overhead' % name, (results[True][i] - results[False][i]) * 1e6, 'us',
+            informational=True)
+
+
+if __name__ == '__main__':
+    main()
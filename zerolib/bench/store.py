@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import threading
+from random import Random
+from time import perf_counter
+from . import report
+from ..storage.store import SiteStore
+
+site = '1HeLLo4uzjaLetFx6NH3PMwFP3qbRbTf3D'
+
+
+def random_reads(store, num_threads, reads, size, file_size):
+    """Read [reads] random ranges of [size] bytes in each of [num_threads] threads.
+    Returns the seconds taken."""
+    def work(seed):
+        rng = Random(seed)
+        for i in range(reads):
+            store.read_range(site, 'big.bin', rng.randrange(0, file_size - size), size)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(num_threads)]
+    begin = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return perf_counter() - begin
+
+def main(file_size=64 * 1024 * 1024):
+    root = tempfile.mkdtemp()
+    try:
+        store = SiteStore(root)
+        chunk = store.chunk_size
+        begin = perf_counter()
+        store.begin(site, 'big.bin', file_size)
+        data = os.urandom(chunk)
+        for offset in range(0, file_size, chunk):
+            store.write_chunk(site, 'big.bin', offset, data)
+        store.finish(site, 'big.bin')
+        report('SiteStore write %d MiB' % (file_size >> 20), (perf_counter() - begin) * 1e3, 'ms')
+
+        num_threads, reads = 8, 2000
+        for size in (4096, chunk):
+            for (name, threshold) in (('pread', file_size + 1), ('mmap', 0)):
+                store = SiteStore(root, mmap_threshold=threshold)
+                seconds = random_reads(store, num_threads, reads, size, file_size)
+                report('SiteStore %s %d threads, %d B' % (name, num_threads, size),
+                    seconds * 1e6 / (num_threads * reads), 'us/read')
+                store.close()
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
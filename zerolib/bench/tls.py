@@ -0,0 +1,69 @@
+import socket
+import ssl
+import threading
+import time
+from . import measure, report
+from ..protocol.packets import AddrPort
+from ..protocol.tls import make_cert, CertPool, ContextFactory
+
+
+def handshake_server(context):
+    """Start a loopback server which sends one byte over each TLS connection.
+    Returns the listening socket."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(64)
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                with context.wrap_socket(conn, server_side=True) as ssl_sock:
+                    ssl_sock.sendall(b'!')
+                    ssl_sock.recv(1)
+            except (OSError, ssl.SSLError):
+                pass
+    threading.Thread(target=serve, daemon=True).start()
+    return listener
+
+def handshakes(factory, port, count, resume):
+    dest = AddrPort('127.0.0.1', port)
+    for i in range(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with factory.wrap_client(sock, dest) as ssl_sock:
+            ssl_sock.recv(1)
+            if resume:
+                factory.save_session(dest, ssl_sock)
+            ssl_sock.sendall(b'!')
+
+
+def main():
+    for key_type in ('rsa', 'ec'):
+        report('make_cert(%r)' % key_type, measure(lambda: make_cert(key_type), repeat=5) * 1e3, 'ms')
+
+    size = 8
+    with CertPool(size=size, key_type='rsa') as pool:
+        while len(pool.ready) < size:
+            time.sleep(0.01)
+        # Take at most [size] certificates, so that the pool is never empty
+        report('CertPool.take', measure(pool.take, repeat=size) * 1e3, 'ms')
+
+    count = 200
+    for key_type in ('rsa', 'ec'):
+        factory = ContextFactory()
+        listener = handshake_server(factory.server_context(make_cert(key_type)))
+        port = listener.getsockname()[1]
+        for resume in (False, True):
+            seconds = measure(lambda: handshakes(factory, port, count, resume), repeat=3)
+            name = 'TLS handshakes (%s, %s)' % (key_type, 'resumed' if resume else 'full')
+            report(name, count / seconds, '/s')
+        listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,15 @@
 """Provides APIs used to make and verify recoverable Bitcoin signatures, addresses, digests and proof of space."""
-from .bitcoin import *
-from .hashing import *
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'bitcoin': [
+        'SignatureError', 'bitcoin_address', 'key_pair', 'decode_secret_key',
+        'compute_public_address', 'compute_secret_address', 'public_digest', 'address_public_digest',
+        'sign_data', 'verify_data', 'recover_public_key',
+    ],
+    'hashing': [
+        'DigestError', 'digest_bytes', 'digest_stream', 'digest_file', 'dumps',
+        'verify_digest_bytes', 'verify_digest_stream', 'verify_digest_file',
+    ],
+    'canonical': ['CanonicalEncoder'],
+})
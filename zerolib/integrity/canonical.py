@@ -0,0 +1,161 @@
+import json
+from collections import OrderedDict
+from json.encoder import encode_basestring_ascii
+from .hashing import hasher_dict
+
+# Types whose values are equal only if they serialize the same way, given their type
+scalar_types = frozenset((str, int, bool, type(None)))
+
+
+class CanonicalEncoder(object):
+    """Serialize dictionaries exactly like dumps(json_dict, compact=False),
+    reusing the serialized text of subtrees that have been seen before.
+
+    Containers found at [cache_depth] levels below the root, e.g. the entries
+    of the "files" dict of a content.json file, are looked up in a bounded
+    cache keyed by their items, or by their compact serialization computed by
+    the C accelerated encoder. Only new or changed subtrees go through the
+    slow pretty printer.
+    """
+    __slots__ = ['cache', 'capacity', 'cache_depth', 'hits', 'misses']
+    indent = ' '
+    buffer_size = 64 * 1024
+
+    _pretty = json.JSONEncoder(sort_keys=True, indent=1)
+    _compact = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+    def __init__(self, capacity=65536, cache_depth=2):
+        self.cache = OrderedDict()
+        self.capacity = capacity
+        self.cache_depth = cache_depth
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<%s object cache_len=%d out of %d>' % (self.__class__.__name__, len(self.cache), self.capacity)
+
+    def encode(self, json_dict):
+        """Return the serialized JSON string."""
+        return ''.join(self.iterencode(json_dict))
+
+    def iterencode(self, json_dict):
+        """Serialize the given object, yielding string chunks."""
+        return self._iterencode(json_dict, 0)
+
+    def write_to(self, json_dict, sink):
+        """Stream the serialized JSON into [sink] as ASCII bytes.
+        [sink] can be a binary file (has a write method) or a hasher (has an update method).
+        Returns the number of bytes written."""
+        write = getattr(sink, 'write', None) or sink.update
+        size = 0
+        buf = []
+        buf_len = 0
+        for chunk in self.iterencode(json_dict):
+            buf.append(chunk)
+            buf_len += len(chunk)
+            if buf_len >= self.buffer_size:
+                write(''.join(buf).encode('ascii'))
+                size += buf_len
+                buf, buf_len = [], 0
+        if buf:
+            write(''.join(buf).encode('ascii'))
+            size += buf_len
+        return size
+
+    def digest(self, json_dict, algo='sha512'):
+        """Compute the digest of the serialized JSON. Returns (digest, data_length)"""
+        hasher = hasher_dict[algo]()
+        size = self.write_to(json_dict, hasher)
+        return (hasher.digest(), size)
+
+    def clear(self):
+        self.cache.clear()
+
+    def _iterencode(self, value, depth):
+        if depth >= self.cache_depth or not isinstance(value, (dict, list, tuple)) or not value:
+            yield self._encode_value(value, depth)
+        elif isinstance(value, dict):
+            yield from self._iterencode_dict(value, depth)
+        else:
+            yield from self._iterencode_list(value, depth)
+
+    def _iterencode_dict(self, dct, depth):
+        newline_indent = '\n' + self.indent * (depth + 1)
+        buf = '{' + newline_indent
+        if depth + 1 >= self.cache_depth:
+            # Hot path: every value is a leaf or a cached subtree
+            encode_value = self._encode_value
+            for (key, value) in sorted(dct.items()):
+                yield buf + encode_basestring_ascii(self._key_str(key)) + ': ' + encode_value(value, depth + 1)
+                buf = ',' + newline_indent
+        else:
+            for (key, value) in sorted(dct.items()):
+                yield buf + encode_basestring_ascii(self._key_str(key)) + ': '
+                yield from self._iterencode(value, depth + 1)
+                buf = ',' + newline_indent
+        yield '\n' + self.indent * depth + '}'
+
+    def _iterencode_list(self, lst, depth):
+        newline_indent = '\n' + self.indent * (depth + 1)
+        buf = '[' + newline_indent
+        for value in lst:
+            yield buf
+            yield from self._iterencode(value, depth + 1)
+            buf = ',' + newline_indent
+        yield '\n' + self.indent * depth + ']'
+
+    def _encode_value(self, value, depth):
+        if isinstance(value, str):
+            return encode_basestring_ascii(value)
+        if not isinstance(value, (dict, list, tuple)):
+            return self._compact.encode(value)
+
+        key = self._cache_key(value, depth)
+        try:
+            text = self.cache[key]
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return text
+        except KeyError:
+            pass
+
+        # JSON strings never contain a raw newline, so re-indenting
+        # the subtree is a plain string replacement.
+        text = self._pretty.encode(value)
+        if depth:
+            text = text.replace('\n', '\n' + self.indent * depth)
+
+        self.misses += 1
+        self.cache[key] = text
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+        return text
+
+    def _cache_key(self, value, depth):
+        # Flat dicts, like the entries of "files", are keyed by their items.
+        # Types are part of the key because 1 == 1.0 == True. Only the types
+        # of the items themselves are in the key, so values must be scalars:
+        # (1,) == (True,). Floats are excluded too, because 0.0 == -0.0 but
+        # they serialize differently.
+        if isinstance(value, dict):
+            key_types = tuple(map(type, value))
+            value_types = tuple(map(type, value.values()))
+            if scalar_types.issuperset(value_types) and scalar_types.issuperset(key_types):
+                return (depth, tuple(value.items()), key_types, value_types)
+        return (depth, self._compact.encode(value))
+
+    def _key_str(self, key):
+        if isinstance(key, str):
+            return key
+        if key is True:
+            return 'true'
+        if key is False:
+            return 'false'
+        if key is None:
+            return 'null'
+        if isinstance(key, (int, float)):
+            return self._compact.encode(key)
+        raise TypeError('keys must be str, int, float, bool or None, not %s' % key.__class__.__name__)
+
+
+__all__ = ['CanonicalEncoder']
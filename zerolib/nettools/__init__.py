@@ -1,2 +1,13 @@
-from .server import *
-from .conn import *
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'server': ['BaseServer'],
+    'conn': ['Connections'],
+    'metrics': ['Histogram', 'ServerMetrics', 'serve_prometheus'],
+    'capture': ['CaptureWriter', 'read_capture', 'replay'],
+    'admission': ['Admission', 'FairQueue', 'TokenBuckets', 'packet_cost'],
+    'handshakes': ['HandshakeCache', 'HandshakeInfo'],
+    'pool': ['ConnectionPool', 'ping_check'],
+    'asyncpool': ['AsyncConnectionPool'],
+    'downloader': ['DownloadScheduler', 'DownloadError', 'download'],
+})
@@ -0,0 +1,207 @@
+from collections import OrderedDict, deque
+from time import monotonic
+from ..protocol.packets import GetFile, ListMod, FindHash, GetHash, PEX, Update, Predicate, request_dict
+
+request_classes = frozenset(request_dict.values())
+
+# Cost of a request, in the same unit as the rates of Admission. GetFile
+# requests also cost one per [cost_bytes] bytes they ask for, a whole
+# chunk of [chunk_size] bytes if the size of the file is not given.
+command_weights = {
+    ListMod: 4,
+    FindHash: 2,
+    GetHash: 2,
+    PEX: 2,
+    Update: 2,
+}
+cost_bytes = 64 * 1024
+chunk_size = 512 * 1024
+
+def packet_cost(packet):
+    """Return the cost of serving a request packet."""
+    weight = command_weights.get(packet.__class__, 1)
+    if packet.__class__ is GetFile:
+        size = chunk_size
+        if packet.total_size is not None:
+            size = max(0, min(size, packet.total_size - packet.offset))
+        return weight + size / cost_bytes
+    return weight
+
+
+class TokenBuckets(object):
+    """Token buckets keyed by sender or by (sender, command), each refilled at
+    [rate] tokens per second up to [burst] tokens. A bucket is only refilled
+    when used, so each operation takes constant time. At most [capacity]
+    buckets are kept. The least recently used one is dropped first, which
+    only refills it, as an unused bucket fills up anyway."""
+    __slots__ = ['rate', 'burst', 'capacity', 'buckets']
+
+    def __init__(self, rate, burst, capacity=100000):
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self.buckets = OrderedDict()
+
+    def __repr__(self):
+        return '<%s rate=%g burst=%g buckets=%d>' % (self.__class__.__name__, self.rate, self.burst, len(self.buckets))
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def available(self, key, now):
+        """Return the tokens in the bucket of [key]."""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.burst
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def take(self, key, cost, now):
+        """Take [cost] tokens from the bucket of [key], which may go negative."""
+        buckets = self.buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [self.burst - cost, now]
+            if len(buckets) > self.capacity:
+                buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate) - cost
+            bucket[1] = now
+            buckets.move_to_end(key)
+
+
+class FairQueue(object):
+    """Deficit round-robin queue across senders. Senders with items waiting
+    take turns. A sender is served while its credits cover the cost of its
+    next item. It then receives [quantum] more credits and goes to the back
+    of the line. Credits are forgotten when it has nothing left to send.
+    Each sender may have at most [max_queue] items waiting."""
+    __slots__ = ['quantum', 'max_queue', 'queues', 'active', 'deficits', 'size']
+
+    def __init__(self, quantum=10, max_queue=64):
+        self.quantum = quantum
+        self.max_queue = max_queue
+        self.queues = {}
+        self.active = deque()
+        self.deficits = {}
+        self.size = 0
+
+    def __repr__(self):
+        return '<%s senders=%d size=%d>' % (self.__class__.__name__, len(self.active), self.size)
+
+    def __len__(self):
+        return self.size
+
+    def full(self, sender):
+        queue = self.queues.get(sender)
+        return queue is not None and len(queue) >= self.max_queue
+
+    def push(self, sender, item, cost):
+        """Queue [item], even if [sender] already has [max_queue] items waiting."""
+        queue = self.queues.get(sender)
+        if queue is None:
+            queue = self.queues[sender] = deque()
+            self.active.append(sender)
+            self.deficits[sender] = 0
+        queue.append((item, cost))
+        self.size += 1
+
+    def pop(self):
+        """Remove and return the next item, or None if the queue is empty."""
+        active = self.active
+        while active:
+            sender = active[0]
+            queue = self.queues[sender]
+            item, cost = queue[0]
+            if self.deficits[sender] < cost:
+                # Turn over. Credits for its next turn.
+                self.deficits[sender] += self.quantum
+                active.rotate(-1)
+                continue
+            queue.popleft()
+            self.size -= 1
+            if queue:
+                self.deficits[sender] -= cost
+            else:
+                del self.queues[sender]
+                del self.deficits[sender]
+                active.popleft()
+            return item
+        return None
+
+
+class Admission(object):
+    """Admission control and fair scheduling of incoming requests.
+    Each sender has a token bucket refilled at [peer_rate] per second, up to
+    [peer_burst], and every request takes [cost_func(request)] tokens from it.
+    [command_limits] maps request classes to (rate, burst), for buckets per
+    sender and command class which a request must also pass.
+    Admitted requests wait in a FairQueue. Responses to our own requests
+    are queued too, at [response_cost], and are not rate limited, but they
+    count against [max_queue] like requests.
+    Every operation takes constant time, whatever the number of senders."""
+    __slots__ = ['peer_buckets', 'command_buckets', 'queue', 'cost_func', 'clock', 'response_cost']
+    default_command_limits = {
+        ListMod: (1, 5),
+        FindHash: (5, 20),
+        PEX: (1, 5),
+    }
+
+    def __init__(self, peer_rate=50, peer_burst=100, command_limits=None, quantum=10, max_queue=64,
+            capacity=100000, cost_func=packet_cost, clock=monotonic, response_cost=1):
+        if command_limits is None:
+            command_limits = self.default_command_limits
+        self.peer_buckets = TokenBuckets(peer_rate, peer_burst, capacity)
+        self.command_buckets = {cls: TokenBuckets(rate, burst, capacity)
+            for (cls, (rate, burst)) in command_limits.items()}
+        self.queue = FairQueue(quantum, max_queue)
+        self.cost_func = cost_func
+        self.clock = clock
+        self.response_cost = response_cost
+
+    def __repr__(self):
+        return '<%s peers=%d queued=%d>' % (self.__class__.__name__, len(self.peer_buckets), len(self.queue))
+
+    def admit(self, packet, cost):
+        """Take [cost] tokens from the buckets of [packet]. Returns None if
+        it is admitted, or the reason why it is refused."""
+        now = self.clock()
+        sender = packet.sender
+        if self.peer_buckets.available(sender, now) < cost:
+            return 'Rate limit exceeded'
+        buckets = self.command_buckets.get(packet.__class__)
+        if buckets is not None:
+            if buckets.available(sender, now) < cost:
+                return 'Rate limit exceeded for %s' % packet.__class__.__name__
+            buckets.take(sender, cost, now)
+        self.peer_buckets.take(sender, cost, now)
+        return None
+
+    def push(self, packet):
+        """Admit and queue [packet]. Returns None if it has been queued,
+        False if it is a response and has been dropped, or a Predicate
+        error response to send back."""
+        sender = packet.sender
+        if packet.__class__ not in request_classes:
+            if self.queue.full(sender):
+                return False
+            self.queue.push(sender, packet, self.response_cost)
+            return None
+
+        if self.queue.full(sender):
+            error = 'Too many pending requests'
+        else:
+            cost = self.cost_func(packet)
+            error = self.admit(packet, cost)
+        if error is None:
+            self.queue.push(sender, packet, cost)
+            return None
+        response = Predicate(error)
+        response.req_id = packet.req_id
+        response.sender = sender
+        return response
+
+    def pop(self):
+        return self.queue.pop()
+
+
+__all__ = ['Admission', 'FairQueue', 'TokenBuckets', 'packet_cost']
@@ -0,0 +1,98 @@
+"""The asyncio counterpart of pool.ConnectionPool. It lives in its own module,
+so that the thread-safe pool does not import asyncio."""
+import asyncio
+from .pool import BasePool
+try:
+    from asyncio import get_running_loop
+except ImportError:
+    # Python < 3.7, where get_event_loop() returns the running loop in a coroutine
+    from asyncio import get_event_loop as get_running_loop
+
+
+class AsyncConnectionPool(BasePool):
+    """The asyncio counterpart of ConnectionPool. [connect_func] and
+    [health_check] are coroutine functions. Waiters are served in order,
+    and a cancelled checkout never leaks a connection."""
+
+    async def checkout(self, dest, timeout=None):
+        ok, item = self._take(dest)
+        if not ok:
+            waiter = get_running_loop().create_future()
+            self.dests[dest].waiters.append(waiter)
+            item = await self._wait(dest, waiter, timeout)
+
+        if item is not None:
+            conn, last_used = item
+            try:
+                healthy = not self._stale(last_used) or await self.health_check(conn)
+            except BaseException:
+                # Cancelled or failed. The connection is in an unknown state.
+                self.close_func(conn)
+                self._give(dest, None)
+                raise
+            if healthy:
+                return conn
+            self.close_func(conn)
+        try:
+            return await self.connect_func(dest)
+        except BaseException:
+            self._give(dest, None)
+            raise
+
+    async def _wait(self, dest, waiter, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # Handed over at the last moment. Pass it on.
+                item = waiter.result()
+                self._give(dest, item[0] if item is not None else None)
+            else:
+                waiter.cancel()
+                state = self.dests.get(dest)
+                if state is not None and waiter in state.waiters:
+                    state.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise TimeoutError('No connection to %r is available' % (dest,)) from e
+            raise
+
+    @staticmethod
+    def _hand_over(waiter, item):
+        if waiter.done():
+            return False
+        waiter.set_result(item)
+        return True
+
+    def checkin(self, dest, conn, reuse=True):
+        if not reuse:
+            self.close_func(conn)
+            conn = None
+        self._give(dest, conn)
+
+    def connection(self, dest, timeout=None):
+        return AsyncConnection(self, dest, timeout)
+
+    def close(self):
+        for conn in self._take_idle():
+            self.close_func(conn)
+
+
+class AsyncConnection(object):
+    """Returned by AsyncConnectionPool.connection(), for use with [async with]."""
+    __slots__ = ['pool', 'dest', 'timeout', 'conn']
+
+    def __init__(self, pool, dest, timeout):
+        self.pool = pool
+        self.dest = dest
+        self.timeout = timeout
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.pool.checkout(self.dest, self.timeout)
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool.checkin(self.dest, self.conn, reuse=(exc_type is None))
+
+
+__all__ = ['AsyncConnectionPool']
@@ -0,0 +1,223 @@
+"""Capture of received packets, and replay of captures through a BaseServer.
+A capture file starts with [magic], followed by one frame per packet:
+    timestamp   float64, seconds since the epoch
+    sender_type uint8: 0 for None, 1 for IP, 2 for onion, 3 for I2P, 4 for str
+    sender_len  uint16
+    data_len    uint32
+    sender      the sender, packed by pack_dest, or encoded in UTF-8 for str.
+                Any other sender is captured as its repr().
+    data        the raw msgpack bytes of the packet
+All integers are big endian. Run python3 -m zerolib.nettools.capture FILE
+to replay a capture."""
+import struct
+import sys
+import time
+from collections import Counter, namedtuple
+from ipaddress import ip_address
+from threading import Lock
+from time import perf_counter
+from ..protocol.packets import AddrPort, OnionAddress, I2PAddress, pack_dest, unpack_ip, unpack_onion, unpack_i2p
+from .metrics import Histogram, perf_counter_ns
+from .server import BaseServer
+
+magic = b'ZNCAP\x01'
+frame_header = struct.Struct('>dBHI')
+max_sender_len = 0xffff
+
+Frame = namedtuple('Frame', ['timestamp', 'sender', 'data'])
+
+
+def pack_sender(sender):
+    """Returns (sender_type, packed_sender). A (host, port, ...) tuple, as
+    returned by socket.getpeername(), is captured as an IP AddrPort if host
+    is an IP address. Any other sender is captured as its repr(), so that
+    capturing never fails. Text senders are cut to [max_sender_len] bytes."""
+    if sender is None:
+        return (0, b'')
+    if isinstance(sender, str):
+        return (4, pack_text(sender))
+    if isinstance(sender, tuple) and not isinstance(sender, AddrPort) and len(sender) >= 2:
+        try:
+            sender = AddrPort(ip_address(sender[0]), sender[1])
+        except ValueError:
+            pass
+    if isinstance(sender, AddrPort):
+        try:
+            if isinstance(sender.address, OnionAddress):
+                return (2, pack_dest(sender))
+            if isinstance(sender.address, I2PAddress):
+                return (3, pack_dest(sender))
+            return (1, pack_dest(sender))
+        except (AttributeError, TypeError, struct.error):
+            pass
+    return (4, pack_text(repr(sender)))
+
+def pack_text(text):
+    packed = text.encode('utf-8', 'backslashreplace')
+    if len(packed) > max_sender_len:
+        # Cut on a character boundary, so that it still decodes
+        packed = packed[:max_sender_len].decode('utf-8', 'ignore').encode('utf-8')
+    return packed
+
+def unpack_sender(sender_type, packed):
+    if sender_type == 0:
+        return None
+    if sender_type == 1:
+        return unpack_ip(packed)
+    if sender_type == 2:
+        return unpack_onion(packed)
+    if sender_type == 3:
+        return unpack_i2p(packed)
+    if sender_type == 4:
+        return packed.decode('utf-8')
+    raise ValueError('Unknown sender type %d' % sender_type)
+
+
+class CaptureWriter(object):
+    """Appends frames to [file], a path or a binary file object.
+    It is thread-safe. Frames are buffered, so call flush() or close()
+    to make sure they are written."""
+    __slots__ = ['file', 'own_file', 'lock', 'count']
+
+    def __init__(self, file, buffer_size=1024 * 1024):
+        self.own_file = isinstance(file, str)
+        self.file = open(file, 'wb', buffering=buffer_size) if self.own_file else file
+        self.lock = Lock()
+        self.count = 0
+        self.file.write(magic)
+
+    def __repr__(self):
+        return '<%s count=%d>' % (self.__class__.__name__, self.count)
+
+    def write(self, data, sender=None, timestamp=None):
+        """Capture the raw bytes [data] of a packet received from [sender]."""
+        sender_type, packed = pack_sender(sender)
+        header = frame_header.pack(time.time() if timestamp is None else timestamp,
+            sender_type, len(packed), len(data))
+        with self.lock:
+            self.file.write(header + packed)
+            self.file.write(data)
+            self.count += 1
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.own_file:
+                self.file.close()
+            else:
+                self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_capture(file):
+    """Yield the Frames of [file], a path or a binary file object.
+    Raises: ValueError if the file is not a capture, IOError if it is truncated"""
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            yield from read_capture(f)
+        return
+
+    if file.read(len(magic)) != magic:
+        raise ValueError('Not a capture file')
+    while True:
+        header = file.read(frame_header.size)
+        if not header:
+            return
+        if len(header) < frame_header.size:
+            raise IOError('Capture ended in the middle of a frame')
+        timestamp, sender_type, sender_len, data_len = frame_header.unpack(header)
+        packed = file.read(sender_len)
+        data = file.read(data_len)
+        if len(packed) < sender_len or len(data) < data_len:
+            raise IOError('Capture ended in the middle of a frame')
+        yield Frame(timestamp, unpack_sender(sender_type, packed), data)
+
+
+class ReplayResult(object):
+    """What replay() measured. [latency] is a Histogram of the time taken
+    by each packet, in nanoseconds, and [errors] counts exceptions by class name."""
+    __slots__ = ['count', 'elapsed', 'latency', 'errors']
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0
+        self.latency = Histogram()
+        self.errors = Counter()
+
+    def __repr__(self):
+        return '<%s count=%d errors=%d>' % (self.__class__.__name__, self.count, sum(self.errors.values()))
+
+    @property
+    def throughput(self):
+        """Packets per second."""
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        lines = ['%d packets in %.3f s, %.0f packets/s' % (self.count, self.elapsed, self.throughput)]
+        if self.count:
+            summary = self.latency.summary()
+            lines.append('latency: mean %.1f us, p50 %.1f us, p90 %.1f us, p99 %.1f us, max %.1f us' % tuple(
+                summary[key] * 1e6 for key in ('mean', 'p50', 'p90', 'p99', 'p100')))
+        for (name, count) in self.errors.most_common():
+            lines.append('%s: %d' % (name, count))
+        return '\n'.join(lines)
+
+
+def replay(frames, server=None, paced=False, speed=1.0):
+    """Feed [frames], for example from read_capture(), to [server].handle_bytes,
+    which runs them through unpack_dict and BaseServer.handle.
+    [server] defaults to a new BaseServer. Frames are replayed as fast as
+    possible, or if [paced] is True, with their original spacing divided by [speed].
+    Exceptions are counted, not raised. Returns a ReplayResult."""
+    server = server if server is not None else BaseServer()
+    result = ReplayResult()
+    latency = result.latency
+    first = None
+    begin = perf_counter()
+    for (timestamp, sender, data) in frames:
+        if paced:
+            if first is None:
+                first = timestamp
+            delay = begin + (timestamp - first) / speed - perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        start = perf_counter_ns()
+        try:
+            server.handle_bytes(data, sender)
+        except Exception as e:
+            result.errors[e.__class__.__name__] += 1
+        latency.record(perf_counter_ns() - start)
+        result.count += 1
+    result.elapsed = perf_counter() - begin
+    return result
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python3 -m zerolib.nettools.capture',
+        description='Replay a capture through a BaseServer and report its throughput and latency.')
+    parser.add_argument('file')
+    parser.add_argument('--paced', action='store_true', help='Keep the original spacing of packets')
+    parser.add_argument('--speed', type=float, default=1.0, help='Speed up paced replays by this factor')
+    parser.add_argument('--repeat', type=int, default=1, help='Replay the capture this many times')
+    args = parser.parse_args(argv)
+
+    frames = list(read_capture(args.file))
+    server = BaseServer()
+    for i in range(args.repeat):
+        print(replay(frames, server, args.paced, args.speed).report())
+
+
+__all__ = ['CaptureWriter', 'read_capture', 'replay']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
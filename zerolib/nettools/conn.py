@@ -1,11 +1,13 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from time import monotonic
 
 class Conn(object):
-    __slots__ = ['socket', 'freq']
+    __slots__ = ['socket', 'freq', 'last_used']
 
-    def __init__(self, socket, freq=0):
+    def __init__(self, socket, freq=0, last_used=None):
         self.socket = socket
         self.freq = freq
+        self.last_used = last_used if last_used is not None else monotonic()
 
     def __iter__(self):
         yield self.socket
@@ -16,41 +18,155 @@ class Conn(object):
 
 
 class Connections(object):
-    __slots__ = ['capacity', 'clean_func', 'sessions']
-
-    def __init__(self, capacity=200, clean_func = None):
+    """Connection pool with least-frequently-used eviction.
+    Sessions are kept in frequency buckets, linked in increasing order of
+    frequency, so that finding the least used session takes constant time,
+    even after sessions are removed. Within a bucket, the least recently used
+    session is evicted first."""
+    __slots__ = [
+        'capacity', 'clean_func', 'sessions', 'buckets', 'min_freq', 'higher', 'lower',
+        'idle_timeout', 'recent', 'aging_interval', 'accesses',
+    ]
+
+    def __init__(self, capacity=200, clean_func = None, idle_timeout = None, aging_interval = None):
         self.sessions = {}
+        self.buckets = {}
+        # The lowest frequency with a bucket, or None, then the links between
+        # the frequencies with a bucket: freq -> next higher and next lower ones
+        self.min_freq = None
+        self.higher = {}
+        self.lower = {}
+        self.recent = OrderedDict()
         self.capacity = capacity
+        self.clean_func = clean_func
+        self.idle_timeout = idle_timeout
+        self.aging_interval = aging_interval
+        self.accesses = 0
 
     def register(self, dest, socket):
         self.remove_unused()
         if dest not in self.sessions:
-            self.sessions[dest] = Conn(socket)
+            conn = Conn(socket)
+            self.sessions[dest] = conn
+            bucket = self.buckets.get(0)
+            if bucket is None:
+                bucket = self._link(0, None)
+            bucket[dest] = None
+            self.recent[dest] = None
 
     def remove_unused(self):
         if len(self.sessions) >= self.capacity:
             if self.clean_func:
                 blacklist = self.clean_func(self.sessions.keys())
-                self.remove_peers(blacklist)
+                self.remove_peers(list(blacklist or ()))
 
             real_len, new_len = len(self.sessions), int(self.capacity * 0.8)
-            if real_len > new_len:
-                bottom_line = real_len - new_len
-                items = sorted(self.sessions.items(), key=lambda x: x[1].freq)
-                for (k, v) in items[0:bottom_line]:
-                    del self.sessions[k]
+            for i in range(real_len - new_len):
+                self.evict()
+
+    def evict(self):
+        """Remove the least frequently used session. Returns (dest, conn)
+        Raises: KeyError if there is no session"""
+        if self.min_freq is None:
+            raise KeyError('No session to evict')
+        dest, _ = self.buckets[self.min_freq].popitem(last=False)
+        return (dest, self._remove(dest, False))
+
+    def reap(self, now=None):
+        """Remove the sessions idle for more than [idle_timeout] seconds.
+        Returns a list of (dest, conn) so that the sockets can be closed."""
+        if self.idle_timeout is None:
+            return []
+        deadline = (now if now is not None else monotonic()) - self.idle_timeout
+        reaped = []
+        for dest in self.recent:
+            if self.sessions[dest].last_used > deadline:
+                break
+            reaped.append(dest)
+        return [(dest, self._remove(dest)) for dest in reaped]
+
+    def age(self):
+        """Halve the frequency of every session, so that old popularity fades away."""
+        buckets, higher, freq = self.buckets, self.higher, self.min_freq
+        self.buckets, self.higher, self.lower, self.min_freq = {}, {}, {}, None
+        new_freq = None
+        while freq is not None:
+            if freq >> 1 != new_freq:
+                new_bucket = self._link(freq >> 1, new_freq)
+                new_freq = freq >> 1
+            for dest in buckets[freq]:
+                self.sessions[dest].freq = new_freq
+                new_bucket[dest] = None
+            freq = higher[freq]
 
     def remove_peers(self, blacklist):
         for key in blacklist:
-            del self.sessions[key]
+            if key in self.sessions:
+                self._remove(key)
+
+    def _link(self, freq, lower):
+        """Create the bucket of [freq], right above the bucket of [lower],
+        or below every other bucket if [lower] is None. Returns the bucket."""
+        higher = self.min_freq if lower is None else self.higher[lower]
+        self.lower[freq] = lower
+        self.higher[freq] = higher
+        if lower is None:
+            self.min_freq = freq
+        else:
+            self.higher[lower] = freq
+        if higher is not None:
+            self.lower[higher] = freq
+        bucket = self.buckets[freq] = OrderedDict()
+        return bucket
+
+    def _unlink(self, freq):
+        """Drop the empty bucket of [freq]."""
+        del self.buckets[freq]
+        lower = self.lower.pop(freq)
+        higher = self.higher.pop(freq)
+        if lower is None:
+            self.min_freq = higher
+        else:
+            self.higher[lower] = higher
+        if higher is not None:
+            self.lower[higher] = lower
+
+    def _remove(self, dest, from_bucket=True):
+        conn = self.sessions.pop(dest)
+        del self.recent[dest]
+        bucket = self.buckets[conn.freq]
+        if from_bucket:
+            del bucket[dest]
+        if not bucket:
+            self._unlink(conn.freq)
+        return conn
 
     def __getitem__(self, key):
         item = self.sessions[key]
+
+        freq = item.freq
+        new_bucket = self.buckets.get(freq + 1)
+        if new_bucket is None:
+            new_bucket = self._link(freq + 1, freq)
+        bucket = self.buckets[freq]
+        del bucket[key]
+        if not bucket:
+            self._unlink(freq)
         item.freq += 1
+        new_bucket[key] = None
+
+        item.last_used = monotonic()
+        self.recent.move_to_end(key)
+
+        if self.aging_interval:
+            self.accesses += 1
+            if self.accesses >= self.aging_interval:
+                self.accesses = 0
+                self.age()
         return item
 
     def __delitem__(self, key):
-        return self.sessions.__delitem__(key)
+        self._remove(key)
 
     def __iter__(self):
         return iter(self.sessions)
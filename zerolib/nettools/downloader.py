@@ -0,0 +1,214 @@
+from threading import Condition, Thread
+from time import monotonic
+from ..integrity.hashing import verify_digest_bytes
+
+class DownloadError(IOError):
+    pass
+
+
+class Chunk(object):
+    """A byte range of a file, fetched as a whole from one peer."""
+    __slots__ = ['offset', 'size', 'peers', 'started', 'attempts', 'failed_peers', 'state']
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+        self.peers = set()
+        self.started = None
+        self.attempts = 0
+        self.failed_peers = set()
+        # pending, running, writing or done
+        self.state = 'pending'
+
+    def __repr__(self):
+        return '<%s %d+%d %s peers=%d attempts=%d>' % (
+            self.__class__.__name__, self.offset, self.size, self.state, len(self.peers), self.attempts)
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+
+class DownloadScheduler(object):
+    """Splits a file of [total_size] bytes into chunks of [chunk_size] bytes and
+    hands them out to peers. A chunk that fails is handed to another peer, at most
+    [max_attempts] times. When no chunk is left, an idle peer steals the chunk
+    that has been running the longest, if it started more than [steal_after]
+    seconds ago and has not been stolen yet; whichever peer finishes first
+    gets to write it.
+    Thread-safe: every method may be called from the worker of any peer."""
+    __slots__ = ['chunks', 'chunk_size', 'max_attempts', 'steal_after', 'cond', 'error']
+
+    def __init__(self, total_size, chunk_size=512 * 1024, max_attempts=3, steal_after=10):
+        self.chunk_size = chunk_size
+        self.chunks = [Chunk(offset, min(chunk_size, total_size - offset))
+            for offset in range(0, total_size, chunk_size)]
+        self.max_attempts = max_attempts
+        self.steal_after = steal_after
+        self.cond = Condition()
+        self.error = None
+
+    def __repr__(self):
+        return '<%s chunks=%d done=%d>' % (
+            self.__class__.__name__, len(self.chunks), sum(c.state == 'done' for c in self.chunks))
+
+    @property
+    def done(self):
+        return all(c.state == 'done' for c in self.chunks)
+
+    def assign(self, peer, now=None):
+        """Return the next Chunk [peer] should fetch, or None if there is nothing
+        left for it to do."""
+        now = monotonic() if now is None else now
+        with self.cond:
+            if self.error is not None:
+                return None
+            for chunk in self.chunks:
+                if chunk.state == 'pending' and peer not in chunk.failed_peers:
+                    return self._start(chunk, peer, now)
+
+            # Nothing pending. Steal the slowest running chunk.
+            victim = None
+            for chunk in self.chunks:
+                if chunk.state != 'running' or len(chunk.peers) > 1 or peer in chunk.peers or peer in chunk.failed_peers:
+                    continue
+                if now - chunk.started >= self.steal_after and (victim is None or chunk.started < victim.started):
+                    victim = chunk
+            if victim is not None:
+                victim.peers.add(peer)
+            return victim
+
+    def wait_assign(self, peer):
+        """Like assign, but when no chunk is available yet, wait until one
+        fails or can be stolen. Returns None once [peer] cannot help anymore."""
+        with self.cond:
+            while True:
+                now = monotonic()
+                chunk = self.assign(peer, now)
+                if chunk is not None or self.error is not None:
+                    return chunk
+                waiting = [c for c in self.chunks if c.state != 'done'
+                    and peer not in c.peers and peer not in c.failed_peers]
+                if not waiting:
+                    return None
+                # Only chunks [peer] may still steal. Any other change to the
+                # chunks is notified.
+                deadlines = [c.started + self.steal_after for c in waiting
+                    if c.state == 'running' and len(c.peers) == 1 and c.started + self.steal_after > now]
+                self.cond.wait(max(min(deadlines) - monotonic(), 0) if deadlines else None)
+
+    def _start(self, chunk, peer, now):
+        chunk.state = 'running'
+        chunk.started = now
+        chunk.peers.add(peer)
+        return chunk
+
+    def claim(self, peer, chunk):
+        """Called when [peer] has fetched [chunk]. Returns True if [peer] should
+        write it, or False if another peer was faster."""
+        with self.cond:
+            chunk.peers.discard(peer)
+            if chunk.state != 'running' or self.error is not None:
+                return False
+            chunk.state = 'writing'
+            return True
+
+    def complete(self, peer, chunk):
+        """Called when [peer] has written [chunk]."""
+        with self.cond:
+            chunk.state = 'done'
+            self.cond.notify_all()
+
+    def fail(self, peer, chunk, error=None):
+        """Called when [peer] could not fetch or write [chunk]. The chunk is given
+        to another peer, unless it has failed [max_attempts] times."""
+        with self.cond:
+            chunk.peers.discard(peer)
+            chunk.failed_peers.add(peer)
+            chunk.attempts += 1
+            if chunk.state in ('running', 'writing') and not chunk.peers:
+                chunk.state = 'pending'
+            elif chunk.state == 'writing':
+                # A stolen copy is still running, let it finish
+                chunk.state = 'running'
+            if chunk.attempts >= self.max_attempts and chunk.state == 'pending':
+                self.error = DownloadError('Range %d+%d failed %d times: %r' % (
+                    chunk.offset, chunk.size, chunk.attempts, error))
+            self.cond.notify_all()
+
+    def abort(self, error):
+        with self.cond:
+            if self.error is None:
+                self.error = error
+            self.cond.notify_all()
+
+
+def download(store, site, inner_path, total_size, peers, fetch,
+        expect_digest=None, piece_digests=None, algo='sha512', scorer=None, **kwargs):
+    """Download a file from several [peers] at once into [store], a SiteStore.
+    [fetch(peer, site, inner_path, offset, size)] returns [size] bytes of the file,
+    for example by sending as many [getFile] requests as needed, and raises an
+    exception on failure or timeout. Each peer fetches one chunk at a time.
+    If [piece_digests] is given, chunk i is verified against piece_digests[i]
+    as soon as it arrives; the whole file is verified against [expect_digest]
+    before it replaces the old one.
+    If [scorer] is a PeerScorer, it is told how fast each chunk arrived,
+    and which peers failed.
+    Other keyword arguments are passed to DownloadScheduler.
+    Returns the path of the file.
+    Raises: DownloadError, DigestError"""
+    scheduler = DownloadScheduler(total_size, **kwargs)
+    if piece_digests is not None and len(piece_digests) != len(scheduler.chunks):
+        raise ValueError('Expected %d piece digests, not %d' % (len(scheduler.chunks), len(piece_digests)))
+    store.begin(site, inner_path, total_size)
+    workers = [0]
+
+    def work(peer):
+        try:
+            chunk = scheduler.wait_assign(peer)
+            while chunk is not None:
+                try:
+                    start = monotonic()
+                    data = fetch(peer, site, inner_path, chunk.offset, chunk.size)
+                    elapsed = monotonic() - start
+                    if len(data) != chunk.size:
+                        raise DownloadError('Expected %d bytes, received %d' % (chunk.size, len(data)))
+                    if piece_digests is not None:
+                        verify_digest_bytes(data, piece_digests[chunk.offset // scheduler.chunk_size], chunk.size, algo)
+                    if scorer is not None:
+                        scorer.transfer(peer, chunk.size, elapsed)
+                    if scheduler.claim(peer, chunk):
+                        store.write_chunk(site, inner_path, chunk.offset, data)
+                        scheduler.complete(peer, chunk)
+                except Exception as e:
+                    if scorer is not None:
+                        scorer.failure(peer)
+                    scheduler.fail(peer, chunk, e)
+                chunk = scheduler.wait_assign(peer)
+        except BaseException as e:
+            scheduler.abort(e)
+            raise
+        finally:
+            with scheduler.cond:
+                workers[0] -= 1
+                scheduler.cond.notify_all()
+
+    with scheduler.cond:
+        for peer in peers:
+            workers[0] += 1
+            Thread(target=work, args=(peer,), daemon=True).start()
+        # Workers stuck on a stolen chunk are not waited for
+        scheduler.cond.wait_for(lambda: scheduler.done or scheduler.error is not None or not workers[0])
+        error = scheduler.error
+        if error is None and not scheduler.done:
+            error = DownloadError('No peer left to download %s' % inner_path)
+        if error is not None:
+            scheduler.error = error
+
+    if error is not None:
+        store.abort(site, inner_path)
+        raise error
+    return store.finish(site, inner_path, expect_digest, algo)
+
+
+__all__ = ['DownloadScheduler', 'DownloadError', 'download']
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class HandshakeInfo(object):
+    """What a Handshake or ACK packet told about a peer. [preferred_crypto]
+    is the crypto negotiated with the peer, or None if none was."""
+    __slots__ = ['peer_id', 'crypto_set', 'preferred_crypto', 'protocol', 'version', 'rev',
+        'port', 'open', 'onion_address', 'expires']
+
+    def __init__(self, packet, preferred_crypto=None, expires=None):
+        self.peer_id = packet.peer_id
+        self.crypto_set = frozenset(packet.crypto_set)
+        self.preferred_crypto = getattr(packet, 'preferred_crypto', None) if preferred_crypto is None else preferred_crypto
+        self.protocol = packet.protocol
+        self.version = packet.version
+        self.rev = packet.rev
+        self.port = packet.port
+        self.open = packet.open
+        self.onion_address = packet.onion_address
+        self.expires = expires
+
+    def __repr__(self):
+        return '<%s peer_id=%r crypto=%r version=%r rev=%d>' % (
+            self.__class__.__name__, self.peer_id, self.preferred_crypto, self.version, self.rev)
+
+
+class HandshakeCache(object):
+    """Remembers the handshakes of peers, so that a reconnecting client can
+    pick its crypto up front instead of probing for it. Entries are keyed by
+    (dest, peer_id), as a peer that restarts or another one behind the same
+    address gets a new peer ID. Peers in Tor mode send no peer ID and are
+    kept under (dest, None).
+    Entries expire [ttl] seconds after they were put, and at most [capacity]
+    of them are kept, the oldest one being dropped first. Only put() refreshes
+    an entry, so entries stay ordered by expiry and every operation takes
+    constant time. It is thread-safe."""
+    __slots__ = ['ttl', 'capacity', 'entries', 'latest', 'clock', 'lock']
+
+    def __init__(self, ttl=3600, capacity=10000, clock=monotonic):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        # dest -> peer_id of the last handshake with dest
+        self.latest = {}
+        self.clock = clock
+        self.lock = Lock()
+
+    def __repr__(self):
+        return '<%s entries=%d>' % (self.__class__.__name__, len(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, dest, packet, preferred_crypto=None):
+        """Remember the Handshake or ACK [packet] received from [dest].
+        [preferred_crypto] overrides the one of an ACK, for example with the
+        crypto chosen in answer to a Handshake. Returns the HandshakeInfo."""
+        key = (dest, packet.peer_id)
+        info = HandshakeInfo(packet, preferred_crypto, self.clock() + self.ttl)
+        with self.lock:
+            self.entries[key] = info
+            self.entries.move_to_end(key)
+            self.latest[dest] = packet.peer_id
+            while len(self.entries) > self.capacity:
+                self._pop_oldest()
+        return info
+
+    def get(self, dest, peer_id):
+        """Return the HandshakeInfo of ([dest], [peer_id]), or None if there
+        is none or it has expired."""
+        with self.lock:
+            info = self.entries.get((dest, peer_id))
+            if info is None:
+                return None
+            if info.expires <= self.clock():
+                self._remove(dest, peer_id)
+                return None
+            return info
+
+    def lookup(self, dest):
+        """Return the HandshakeInfo of the last handshake with [dest] whatever
+        its peer ID, for a client that does not know who it is connecting to yet."""
+        with self.lock:
+            if dest not in self.latest:
+                return None
+            peer_id = self.latest[dest]
+        return self.get(dest, peer_id)
+
+    def choose_crypto(self, dest, supported, peer_id=None):
+        """Return the crypto to use with [dest] before its handshake arrives,
+        out of [supported], the cryptos we support in order of preference.
+        That is the crypto negotiated last time if we still support it, or else
+        the first one of [supported] that the peer supports. Returns None if
+        nothing is known or nothing is supported by both, in which case the
+        handshake has to be done first."""
+        info = self.lookup(dest) if peer_id is None else self.get(dest, peer_id)
+        if info is None:
+            return None
+        if info.preferred_crypto is not None and info.preferred_crypto in supported:
+            return info.preferred_crypto
+        for crypto in supported:
+            if crypto in info.crypto_set:
+                return crypto
+        return None
+
+    def forget(self, dest, peer_id=None):
+        """Forget the handshake of ([dest], [peer_id]), or the last one with [dest],
+        for example when the crypto it gave failed."""
+        with self.lock:
+            if peer_id is None:
+                peer_id = self.latest.get(dest)
+            if (dest, peer_id) in self.entries:
+                self._remove(dest, peer_id)
+
+    def reap(self, now=None):
+        """Remove the expired entries. Returns how many were removed."""
+        now = now if now is not None else self.clock()
+        count = 0
+        with self.lock:
+            while self.entries:
+                info = next(iter(self.entries.values()))
+                if info.expires > now:
+                    break
+                self._pop_oldest()
+                count += 1
+        return count
+
+    def _pop_oldest(self):
+        (dest, peer_id), _ = self.entries.popitem(last=False)
+        if dest in self.latest and self.latest[dest] == peer_id:
+            del self.latest[dest]
+
+    def _remove(self, dest, peer_id):
+        del self.entries[(dest, peer_id)]
+        if dest in self.latest and self.latest[dest] == peer_id:
+            del self.latest[dest]
+
+
+__all__ = ['HandshakeCache', 'HandshakeInfo']
@@ -0,0 +1,262 @@
+from collections import Counter
+from threading import Lock, Thread, local
+try:
+    from time import perf_counter_ns
+except ImportError:
+    # Python < 3.7
+    from time import perf_counter
+
+    def perf_counter_ns():
+        return int(perf_counter() * 1e9)
+
+
+class Histogram(object):
+    """Latency histogram of integer nanoseconds, in the style of HdrHistogram.
+    Buckets grow exponentially, and each power of two is split into
+    2 ** sub_bits linear sub-buckets, so a value is known within 1/8 of itself.
+    Values below 2 ** (sub_bits + 1) ns get a bucket each."""
+    __slots__ = ['counts', 'total']
+    sub_bits = 3
+    # Enough buckets for any 64 bit value, so that record() needs no bounds check
+    max_bits = 64
+
+    def __init__(self):
+        self.counts = [0] * (self.bucket((1 << self.max_bits) - 1) + 1)
+        self.total = 0
+
+    def __repr__(self):
+        return '<%s count=%d>' % (self.__class__.__name__, self.count)
+
+    @classmethod
+    def bucket(cls, ns):
+        """Return the index of the bucket holding [ns]."""
+        shift = ns.bit_length() - cls.sub_bits - 1
+        if shift <= 0:
+            return ns
+        return (shift << cls.sub_bits) + (ns >> shift)
+
+    @classmethod
+    def lower_bound(cls, index):
+        """Return the smallest value of the bucket at [index]."""
+        shift = max((index >> cls.sub_bits) - 1, 0)
+        return (index - (shift << cls.sub_bits)) << shift
+
+    def record(self, ns):
+        # bucket() inlined, with sub_bits = 3
+        shift = ns.bit_length() - 4
+        self.counts[ns if shift <= 0 else (shift << 3) + (ns >> shift)] += 1
+        self.total += ns
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def add(self, other):
+        """Add the values of [other] to this histogram."""
+        for (index, count) in enumerate(other.counts[:]):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+
+    def buckets(self):
+        """Yield (upper_bound, cumulative_count) for every non-empty bucket,
+        [upper_bound] being the first value of the next bucket, in nanoseconds."""
+        cumulative = 0
+        for (index, count) in enumerate(self.counts):
+            if count:
+                cumulative += count
+                yield (self.lower_bound(index + 1), cumulative)
+
+    def percentile(self, percent):
+        """Return an upper bound of the [percent]th percentile in nanoseconds,
+        or None if the histogram is empty."""
+        count = self.count
+        if not count:
+            return None
+        rank = max(1, -(-count * percent // 100))
+        for (upper_bound, cumulative) in self.buckets():
+            if cumulative >= rank:
+                return upper_bound
+
+    def summary(self):
+        """Return a dict with the count, the mean and a few percentiles, in seconds."""
+        count = self.count
+        if not count:
+            return {'count': 0}
+        result = {'count': count, 'mean': self.total / count / 1e9}
+        for percent in (50, 90, 99, 100):
+            result['p%d' % percent] = self.percentile(percent) / 1e9
+        return result
+
+
+class Shard(object):
+    """The metrics recorded by one thread, which alone writes to them."""
+    __slots__ = ['handling', 'errors', 'decode', 'validation', 'handler']
+
+    def __init__(self):
+        self.handling = 0
+        self.errors = Counter()
+        self.decode = Histogram()
+        self.validation = Histogram()
+        self.handler = {}
+
+    def end(self, name, decode_ns, validation_ns, handler_ns):
+        """Record a packet handled by the handler [name]. [decode_ns] and
+        [validation_ns] are both None if the packet was handed over parsed."""
+        # Histogram.record() inlined, as this runs for every packet
+        self.handling -= 1
+        if decode_ns is not None:
+            histogram = self.decode
+            shift = decode_ns.bit_length() - 4
+            histogram.counts[decode_ns if shift <= 0 else (shift << 3) + (decode_ns >> shift)] += 1
+            histogram.total += decode_ns
+            histogram = self.validation
+            shift = validation_ns.bit_length() - 4
+            histogram.counts[validation_ns if shift <= 0 else (shift << 3) + (validation_ns >> shift)] += 1
+            histogram.total += validation_ns
+        histogram = self.handler.get(name)
+        if histogram is None:
+            histogram = self.handler[name] = Histogram()
+        shift = handler_ns.bit_length() - 4
+        histogram.counts[handler_ns if shift <= 0 else (shift << 3) + (handler_ns >> shift)] += 1
+        histogram.total += handler_ns
+
+    def error(self, exc):
+        self.errors[exc.__class__.__name__] += 1
+
+
+class ServerMetrics(object):
+    """Counters, gauges and latency histograms of a BaseServer.
+    Packets are counted per handler name of func_routing. The time spent
+    decoding msgpack, validating the packet (unpack_dict) and running its handler
+    are kept in Histograms, the latter per handler. Errors are counted per
+    exception class name. Requests awaiting a response are read from [interpreter],
+    a PacketInterp guarded by [interp_lock], when a snapshot is taken.
+    Each thread records into its own Shard, so that recording takes no lock.
+    Snapshots add the shards up."""
+    __slots__ = ['local', 'shards', 'shards_lock', 'interpreter', 'interp_lock']
+
+    def __init__(self, interpreter=None, interp_lock=None):
+        self.local = local()
+        self.shards = []
+        self.shards_lock = Lock()
+        self.interpreter = interpreter
+        self.interp_lock = interp_lock
+
+    def __repr__(self):
+        return '<%s shards=%d>' % (self.__class__.__name__, len(self.shards))
+
+    def shard(self):
+        """Return the Shard of the current thread."""
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = Shard()
+            with self.shards_lock:
+                self.shards.append(shard)
+            return shard
+
+    def error(self, exc):
+        self.shard().error(exc)
+
+    def awaiting(self):
+        """Count the requests awaiting a response, per response class name."""
+        if self.interpreter is None:
+            return {}
+        if self.interp_lock is None:
+            return dict(Counter(info.cls.__name__ for info in self.interpreter.sequence.values()))
+        with self.interp_lock:
+            return dict(Counter(info.cls.__name__ for info in self.interpreter.sequence.values()))
+
+    def snapshot(self):
+        """Return the sum of the shards, as a dict:
+        'packets' and 'errors' map names to counts, 'handling' is the number of
+        handlers running, 'awaiting' maps response class names to the number of
+        requests waiting for them, 'decode' and 'validation' are Histograms, and
+        'handler' maps handler names to Histograms.
+        Packets being recorded while the snapshot is taken may be left out."""
+        with self.shards_lock:
+            shards = self.shards[:]
+        decode, validation, handler = Histogram(), Histogram(), {}
+        errors = Counter()
+        handling = 0
+        for shard in shards:
+            handling += shard.handling
+            errors.update(shard.errors.copy())
+            decode.add(shard.decode)
+            validation.add(shard.validation)
+            for (name, histogram) in list(shard.handler.items()):
+                total = handler.get(name)
+                if total is None:
+                    total = handler[name] = Histogram()
+                total.add(histogram)
+        return {
+            'packets': {name: histogram.count for (name, histogram) in handler.items()},
+            'errors': dict(errors),
+            'handling': handling,
+            'awaiting': self.awaiting(),
+            'decode': decode,
+            'validation': validation,
+            'handler': handler,
+        }
+
+    def prometheus(self, prefix='zerolib'):
+        """Return the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        def family(name, kind, samples, label):
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            for (key, value) in sorted(samples.items()):
+                lines.append('%s_%s{%s="%s"} %s' % (prefix, name, label, key, value))
+
+        family('packets_total', 'counter', snapshot['packets'], 'handler')
+        family('errors_total', 'counter', snapshot['errors'], 'type')
+        lines.append('# TYPE %s_handling gauge' % prefix)
+        lines.append('%s_handling %d' % (prefix, snapshot['handling']))
+        family('awaiting_responses', 'gauge', snapshot['awaiting'], 'response')
+
+        def histogram(name, histogram, labels=''):
+            for (upper_bound, cumulative) in histogram.buckets():
+                lines.append('%s_%s_bucket{%sle="%r"} %d' % (prefix, name, labels, upper_bound / 1e9, cumulative))
+            lines.append('%s_%s_bucket{%sle="+Inf"} %d' % (prefix, name, labels, histogram.count))
+            labels = '{%s}' % labels.rstrip(',') if labels else ''
+            lines.append('%s_%s_sum%s %r' % (prefix, name, labels, histogram.total / 1e9))
+            lines.append('%s_%s_count%s %d' % (prefix, name, labels, histogram.count))
+
+        for name in ('decode', 'validation'):
+            lines.append('# TYPE %s_%s_seconds histogram' % (prefix, name))
+            histogram(name + '_seconds', snapshot[name])
+        lines.append('# TYPE %s_handler_seconds histogram' % prefix)
+        for (name, handler) in sorted(snapshot['handler'].items()):
+            histogram('handler_seconds', handler, 'handler="%s",' % name)
+        return '\n'.join(lines) + '\n'
+
+
+def serve_prometheus(metrics, port, host='127.0.0.1', prefix='zerolib'):
+    """Serve [metrics].prometheus() over HTTP from a daemon thread.
+    Returns the HTTPServer. Call its shutdown() method to stop it."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    # http.server.ThreadingHTTPServer is only there since Python 3.7
+    class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus(prefix).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+__all__ = ['Histogram', 'ServerMetrics', 'serve_prometheus']
@@ -0,0 +1,209 @@
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, Event
+from time import monotonic
+from ..protocol.packets import Ping, Pong, unpack_stream
+from ..protocol.sequencing import PacketInterp
+
+
+def ping_check(socket, timeout=5):
+    """Send a [ping] packet through [socket] and check if a [pong] comes back."""
+    ping = Ping()
+    ping.req_id = PacketInterp.new_id()
+    ping.sender = None
+
+    old_timeout = socket.gettimeout()
+    socket.settimeout(timeout)
+    try:
+        socket.sendall(bytes(ping))
+        with socket.makefile('rb') as stream:
+            pong = unpack_stream(stream)
+        return isinstance(pong, Pong) and pong.req_id == ping.req_id
+    except (OSError, EOFError, KeyError, TypeError, ValueError):
+        return False
+    finally:
+        try:
+            socket.settimeout(old_timeout)
+        except OSError:
+            pass
+
+def close_conn(conn):
+    try:
+        conn.close()
+    except OSError:
+        pass
+
+
+class DestPool(object):
+    """Connections to one destination. [total] counts the idle connections,
+    the checked out ones and the ones being opened."""
+    __slots__ = ['idle', 'total', 'waiters']
+
+    def __init__(self):
+        self.idle = deque()
+        self.total = 0
+        self.waiters = deque()
+
+    def __repr__(self):
+        return '<%s idle=%d total=%d waiters=%d>' % (
+            self.__class__.__name__, len(self.idle), self.total, len(self.waiters))
+
+
+class BasePool(object):
+    """Bookkeeping shared by ConnectionPool and AsyncConnectionPool.
+    When a connection is given back and someone is waiting for the destination,
+    the connection is handed over to the first waiter."""
+
+    def __init__(self, connect_func, max_per_dest=4, health_check=None, check_after=30, close_func=close_conn):
+        self.connect_func = connect_func
+        self.health_check = health_check
+        self.close_func = close_func
+        self.max_per_dest = max_per_dest
+        self.check_after = check_after
+        self.dests = {}
+
+    def __repr__(self):
+        return '<%s dests=%d>' % (self.__class__.__name__, len(self.dests))
+
+    def _take(self, dest):
+        """Returns (True, conn) for an idle connection, (True, None) for
+        the permission to open a new one, or (False, None) if the caller must wait."""
+        state = self.dests.get(dest)
+        if state is None:
+            state = self.dests[dest] = DestPool()
+        if state.idle:
+            conn, last_used = state.idle.pop()
+            return (True, (conn, last_used))
+        if state.total < self.max_per_dest:
+            state.total += 1
+            return (True, None)
+        return (False, None)
+
+    def _give(self, dest, conn):
+        """Give back a connection, or a slot if [conn] is None.
+        Returns the waiter that has been handed the connection, if any."""
+        state = self.dests[dest]
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if self._hand_over(waiter, (conn, monotonic()) if conn is not None else None):
+                return waiter
+        if conn is not None:
+            state.idle.append((conn, monotonic()))
+        else:
+            state.total -= 1
+            if state.total == 0:
+                del self.dests[dest]
+        return None
+
+    def _stale(self, last_used):
+        return self.health_check is not None and monotonic() - last_used >= self.check_after
+
+    def _take_idle(self):
+        """Remove every idle connection. Returns the connections to close."""
+        conns = []
+        for (dest, state) in list(self.dests.items()):
+            while state.idle:
+                conns.append(state.idle.pop()[0])
+                state.total -= 1
+            if state.total == 0 and not state.waiters:
+                del self.dests[dest]
+        return conns
+
+
+class Waiter(object):
+    __slots__ = ['event', 'item']
+
+    def __init__(self):
+        self.event = Event()
+        self.item = None
+
+
+class ConnectionPool(BasePool):
+    """Thread-safe pool of live connections, with at most [max_per_dest] connections
+    per destination. [connect_func(dest)] opens a new connection. Before an idle
+    connection older than [check_after] seconds is reused, [health_check(conn)]
+    must return True, otherwise the connection is closed and replaced."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = Lock()
+
+    def checkout(self, dest, timeout=None):
+        """Check out a connection to [dest], waiting at most [timeout] seconds
+        if all connections to [dest] are in use.
+        Raises: TimeoutError, and whatever connect_func or health_check raises."""
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.lock:
+            ok, item = self._take(dest)
+            if not ok:
+                waiter = Waiter()
+                self.dests[dest].waiters.append(waiter)
+        if not ok:
+            item = self._wait(dest, waiter, deadline)
+
+        if item is not None:
+            conn, last_used = item
+            try:
+                healthy = not self._stale(last_used) or self.health_check(conn)
+            except BaseException:
+                self.close_func(conn)
+                self._release_slot(dest)
+                raise
+            if healthy:
+                return conn
+            self.close_func(conn)
+        try:
+            return self.connect_func(dest)
+        except BaseException:
+            self._release_slot(dest)
+            raise
+
+    def _wait(self, dest, waiter, deadline):
+        remaining = None if deadline is None else max(0, deadline - monotonic())
+        if not waiter.event.wait(remaining):
+            with self.lock:
+                state = self.dests.get(dest)
+                if state is not None and waiter in state.waiters:
+                    state.waiters.remove(waiter)
+                    raise TimeoutError('No connection to %r is available' % (dest,))
+        return waiter.item
+
+    @staticmethod
+    def _hand_over(waiter, item):
+        waiter.item = item
+        waiter.event.set()
+        return True
+
+    def _release_slot(self, dest):
+        with self.lock:
+            self._give(dest, None)
+
+    def checkin(self, dest, conn, reuse=True):
+        """Give back a connection. If [reuse] is False, the connection is closed."""
+        if not reuse:
+            self.close_func(conn)
+            conn = None
+        with self.lock:
+            self._give(dest, conn)
+
+    @contextmanager
+    def connection(self, dest, timeout=None):
+        """Check out a connection, and check it in when done.
+        The connection is closed if the block raises an exception."""
+        conn = self.checkout(dest, timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.checkin(dest, conn, reuse=False)
+            raise
+        self.checkin(dest, conn)
+
+    def close(self):
+        """Close every idle connection."""
+        with self.lock:
+            conns = self._take_idle()
+        for conn in conns:
+            self.close_func(conn)
+
+
+__all__ = ['ConnectionPool', 'ping_check']
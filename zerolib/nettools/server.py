@@ -1,5 +1,7 @@
 from ..protocol.packets import *
 from ..protocol import PacketInterp
+from ..protocol import hooks
+from .metrics import ServerMetrics, perf_counter_ns
 from threading import Lock
 
 func_routing = {
@@ -28,18 +30,107 @@ func_routing = {
 }
 
 class BaseServer(object):
+    """Dispatches packets to the method named in func_routing.
+    If [metrics] is True, packets are counted and timed in [self.metrics],
+    a ServerMetrics. Otherwise [self.metrics] is None.
+    If [capture] is a CaptureWriter, the bytes given to handle_bytes are written to it.
+    If [admission] is an Admission, packets may be given to submit() instead
+    of handle(), to be rate limited and served fairly by handle_next().
+    If [handshakes] is a HandshakeCache, the Handshake and ACK packets handled
+    are put in it, keyed by the address of their sender and the port it listens on.
+    If [scorer] is a PeerScorer, it scores the peers from how long they take
+    to answer the requests registered with send_to()."""
     __default_funcs = frozenset(func_routing.values())
 
-    def __init__(self):
-        self.interpreter = PacketInterp()
+    def __init__(self, metrics=False, capture=None, admission=None, handshakes=None, scorer=None):
+        self.interpreter = PacketInterp(scorer)
         self.lock_interp = Lock()
+        self.metrics = ServerMetrics(self.interpreter, self.lock_interp) if metrics else None
+        self.capture = capture
+        self.admission = admission
+        self.lock_admission = Lock()
+        self.handshakes = handshakes
 
     def handle(self, packet):
-        func = getattr(self, func_routing[packet.__class__])
+        if self.metrics is not None:
+            return self._handle_measured(packet, None, None)
+        name = func_routing[packet.__class__]
+        func = getattr(self, name)
         with self.lock_interp:
             self.interpreter.interpret(packet)
+        if hooks.installed:
+            return hooks.dispatch(func, packet, name)
         return func(packet)
 
+    def handle_bytes(self, data, sender=None):
+        """Unpack one packet from [data], then handle it.
+        Returns what the handler returns."""
+        if self.capture is not None:
+            self.capture.write(data, sender)
+        metrics = self.metrics
+        if metrics is None:
+            return self.handle(unpack(data, sender))
+        start = perf_counter_ns()
+        try:
+            payload = decode_dict(data, sender)
+            decoded = perf_counter_ns()
+            packet = unpack_dict(payload, sender)
+        except Exception as e:
+            metrics.error(e)
+            raise
+        validated = perf_counter_ns()
+        return self._handle_measured(packet, decoded - start, validated - decoded, validated)
+
+    def submit(self, packet):
+        """Queue [packet] for handle_next(). Returns None if it has been queued,
+        the Predicate error response to send back if [packet] is a refused request,
+        or False if it is a dropped response. Responses to requests that were
+        not registered with send_to() are dropped."""
+        if packet.__class__ in response_packets:
+            with self.lock_interp:
+                awaited = (packet.sender, packet.req_id) in self.interpreter.sequence
+            if not awaited:
+                if self.metrics is not None:
+                    self.metrics.shard().errors['Dropped'] += 1
+                return False
+        with self.lock_admission:
+            response = self.admission.push(packet)
+        if response is not None and self.metrics is not None:
+            self.metrics.shard().errors['Refused' if response is not False else 'Dropped'] += 1
+        return response
+
+    def handle_next(self):
+        """Handle the next queued packet, taking turns between senders.
+        Returns (packet, what the handler returns), or None if no packet is queued."""
+        with self.lock_admission:
+            packet = self.admission.pop()
+        if packet is None:
+            return None
+        return (packet, self.handle(packet))
+
+    def _handle_measured(self, packet, decode_ns, validation_ns, start=None):
+        shard = self.metrics.shard()
+        try:
+            name = func_routing[packet.__class__]
+        except KeyError as e:
+            shard.error(e)
+            raise
+        func = getattr(self, name)
+        shard.handling += 1
+        if start is None:
+            start = perf_counter_ns()
+        try:
+            with self.lock_interp:
+                self.interpreter.interpret(packet)
+            if hooks.installed:
+                return hooks.dispatch(func, packet, name)
+            return func(packet)
+        except Exception as e:
+            shard.error(e)
+            raise
+        finally:
+            shard.end(name, decode_ns, validation_ns, perf_counter_ns() - start)
+
     def send_to(self, packet, dest):
         with self.lock_interp:
             self.interpreter.register(packet)
@@ -56,5 +147,18 @@ class BaseServer(object):
     def ping(self, packet):
         return Pong()
 
+    def handshake(self, packet):
+        if self.handshakes is None or packet.sender is None:
+            return
+        dest = packet.sender
+        if isinstance(dest, AddrPort):
+            # The sender port of an incoming connection is ephemeral. Clients
+            # reconnect to the port the peer listens on.
+            dest = AddrPort(dest.address, packet.port)
+        self.handshakes.put(dest, packet)
+
+    def ack(self, packet):
+        self.handshake(packet)
+
 
 __all__ = ['BaseServer']
@@ -1,7 +1,24 @@
 """APIs for handling ZeroNet network protocol, metadata and site manifests."""
-from .tls import *
-from .packets import *
-from .sequencing import *
-from .routing import *
-from .content import *
-from .sanitizer import *
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'tls': ['make_cert', 'CertPool', 'ContextFactory', 'ciphers', 'tweak_context_options'],
+    'packets': [
+        'unpack', 'unpack_stream', 'unpack_dict', 'decode_dict', 'dict_unpacker', 'packet_unpacker', 'response_packets',
+        'Packet', 'Ping', 'GetFile', 'Handshake', 'PEX', 'Update', 'ListMod',
+        'GetHash', 'SetHash', 'FindHash', 'CheckPort', 'GetPieceStatus', 'SetPieceStatus',
+        'RespFile', 'RespPEX', 'Predicate', 'Pong', 'ACK', 'RespMod',
+        'RespHashSet', 'RespHashDict', 'RespPort', 'RespPieceDict',
+        'PrefixIter', 'AddrPort', 'OnionAddress', 'I2PAddress',
+    ],
+    'sequencing': ['PacketInterp'],
+    'hooks': ['PacketHooks', 'SamplingProfiler', 'install_hooks', 'remove_hooks'],
+    'routing': ['Peer', 'PeerScorer', 'Router'],
+    'peertable': [],
+    'content': ['FileInfo', 'Include', 'Manifest', 'ManifestDiff', 'recover_cert'],
+    'patching': ['make_diff', 'check_diff', 'apply_diff'],
+    'hashfield': ['HashField'],
+    'hashindex': ['HashIndex'],
+    'sanitizer': [],
+    'certdb': [],
+})
@@ -1,60 +1,58 @@
+import json
 from collections import namedtuple
 from random import SystemRandom
 from pathlib import Path
+from threading import Lock
 
 Fields = namedtuple('Fields', ['country', 'state', 'locality', 'org', 'unit', 'common', 'delta', 'dns_names'])
+Catalog = namedtuple('Catalog', ['country', 'state', 'locality', 'org', 'common', 'dns', 'defaults'])
 
+data_dir = Path(__file__).parent.absolute() / 'data'
+catalog_path = data_dir / 'catalog.json'
+list_names = ('country', 'state', 'locality', 'org', 'common', 'dns')
 
-def make_fields():
-    dirname = str(Path(__file__).parent.absolute())
-    variables = ('country', 'state','locality', 'org', 'common', 'dns')
 
-    for var in variables:
-        var_name = 'list_' + var
-        if not globals()[var_name]:
-            with open(dirname + '/data/' + var + '.list', 'r', encoding='utf-8') as f:
-                globals()[var_name] = [line.strip() for line in f]
+def make_fields(rng=None):
+    """Return random Fields for a certificate."""
+    return real_make_fields(load_catalog(), rng or SystemRandom())
 
-    global default_fields
-    if not default_fields:
-        with open(dirname + '/data/default.yaml', 'r', encoding='utf-8') as f:
-            parser = yaml_parser(f)
-            default_fields = list(parser)
+def make_fields_bulk(count, rng=None):
+    """Return a list of [count] random Fields. The catalog is only looked up once."""
+    catalog = load_catalog()
+    rng = rng or SystemRandom()
+    return [real_make_fields(catalog, rng) for i in range(count)]
 
-    return real_make_fields()
-
-def real_make_fields():
-    rng = SystemRandom()
-
-    field_id = rng.randint(-len(default_fields), len(default_fields) - 1)
+def real_make_fields(catalog, rng):
+    defaults = catalog.defaults
+    field_id = rng.randint(-len(defaults), len(defaults) - 1)
     if field_id >= 0:
-        return default_fields[field_id]
+        return defaults[field_id]
 
-    country = rng.choice(list_country)
-    state = rng.choice(list_state)
-    locality = rng.choice(list_locality)
+    country = rng.choice(catalog.country)
+    state = rng.choice(catalog.state)
+    locality = rng.choice(catalog.locality)
     org = ''
     unit = ''
 
     org_cond = rng.randint(0, 3)
     if org_cond == 1:
-        org = rng.choice(list_org)
+        org = rng.choice(catalog.org)
     elif org_cond == 2:
-        unit = rng.choice(list_org)
+        unit = rng.choice(catalog.org)
     elif org_cond == 3:
-        org = rng.choice(list_org)
-        unit = rng.choice(list_org)
+        org = rng.choice(catalog.org)
+        unit = rng.choice(catalog.org)
 
-    common = rng.choice(list_common)
+    common = rng.choice(catalog.common)
     delta = rng.choice(list_delta)
 
     dns_set = set()
     dns_count = max(0, rng.randint(-7, 7))
     for i in range(dns_count):
-        dns_set.add(rng.choice(list_dns))
+        dns_set.add(rng.choice(catalog.dns))
     if (not dns_set) or rng.randint(0, 5):
         dns_set.add('localhost')
-    dns_names = sorted(dns_set)
+    dns_names = tuple(sorted(dns_set))
 
     return Fields(
         country=country,
@@ -69,10 +67,39 @@ def real_make_fields():
 
 ##############################################################################
 
+def load_catalog():
+    """Return the Catalog, loading it from catalog.json on first use.
+    The catalog is shared and must not be modified."""
+    global catalog
+    if catalog is None:
+        with catalog_lock:
+            if catalog is None:
+                with catalog_path.open('r', encoding='utf-8') as f:
+                    catalog = catalog_from_json(json.load(f))
+    return catalog
+
+def catalog_from_json(d):
+    return Catalog(
+        defaults=tuple(Fields(**dict(fields, dns_names=tuple(fields['dns_names']))) for fields in d['defaults']),
+        **{name: tuple(d[name]) for name in list_names}
+    )
+
+def compile_catalog(dirname=data_dir):
+    """Read the .list files and default.yaml in [dirname].
+    Returns a JSON-compatible dictionary, as stored in catalog.json."""
+    dirname = Path(dirname)
+    d = {}
+    for name in list_names:
+        with (dirname / (name + '.list')).open('r', encoding='utf-8') as f:
+            d[name] = [line.strip() for line in f]
+    with (dirname / 'default.yaml').open('r', encoding='utf-8') as f:
+        d['defaults'] = [fields._asdict() for fields in yaml_parser(f)]
+    return d
+
 def field_parser(d):
     if d:
         delta = int(d['delta'])
-        dns_names = sorted((n for n in d['dns_names'].split(' ') if n))
+        dns_names = tuple(sorted((n for n in d['dns_names'].split(' ') if n)))
         yield Fields(
             country=d['country'],
             state=d['state'],
@@ -98,16 +125,20 @@ def yaml_parser(f):
 
     yield from field_parser(yaml_dict)
 
-default_fields = None
-
-list_country = None
-list_state = None
-list_locality = None
-list_org = None
-list_common = None
-list_dns = None
+catalog = None
+catalog_lock = Lock()
 
 list_delta = (
     10, 15, 28, 29, 30, 31, 60, 90, 100, 120,
     360, 365, 365*2, 365*3, 3600, 3650,
 )
+
+
+def main():
+    """Compile the .list files and default.yaml into catalog.json."""
+    with catalog_path.open('w', encoding='utf-8') as f:
+        json.dump(compile_catalog(), f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+        f.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
+from array import array
+from bisect import bisect_left
 from collections import namedtuple
+from heapq import merge
 from .sanitizer import check_regex, regex_btc, regex_handle
+from .sanitizer import check_path, check_range, check_types, range_size
 
 FileInfo = namedtuple('FileInfo', ['algo', 'digest', 'proof', 'size', 'optional'])
+Include = namedtuple('Include', ['signers', 'signers_required', 'max_size', 'files_allowed'])
 
 
 def recover_cert(user_btc, portal, name):
@@ -19,4 +24,218 @@ def recover_cert(user_btc, portal, name):
     return user_btc + b'#' + portal + b'/' + name
 
 
-__all__ = ['FileInfo', 'recover_cert']
+class Manifest(object):
+    """The file list of a parsed content.json dictionary.
+    File records are stored column by column: one list of paths, one bytearray
+    of 32-byte digests, one array of sizes and one bytearray of flags."""
+    __slots__ = [
+        'modified', 'paths', 'index', 'digests', 'sizes', 'flags', 'includes',
+        '_sorted_paths', '_hash_index',
+    ]
+    algo = 'sha512'
+    digest_len = 32
+
+    def __init__(self, content):
+        check_types(content, dict)
+        self.modified = content.get('modified', 0)
+        self.paths = []
+        self.index = {}
+        self.digests = bytearray()
+        self.sizes = array('Q')
+        self.flags = bytearray()
+        self.includes = {}
+        self._sorted_paths = None
+        self._hash_index = None
+
+        self.parse_files(content.get('files') or {}, False)
+        self.parse_files(content.get('files_optional') or {}, True)
+        self.parse_includes(content.get('includes') or {})
+
+    def parse_files(self, files_dict, optional):
+        check_types(files_dict, dict)
+        for (path, entry) in files_dict.items():
+            try:
+                path, digest, size = self.parse_item(path, entry)
+            except (TypeError, ValueError):
+                continue
+            if path in self.index:
+                continue
+            self.index[path] = len(self.paths)
+            self.paths.append(path)
+            self.digests += digest
+            self.sizes.append(size)
+            self.flags.append(optional)
+
+    def parse_item(self, path, entry):
+        path = check_path(bytes(check_types(path, str), encoding='utf-8'))
+        digest = bytes.fromhex(check_types(entry[self.algo], str))
+        if len(digest) != self.digest_len:
+            raise ValueError('Digest should be %d bytes long, not %d' % (self.digest_len, len(digest)))
+        size = check_range(check_types(entry['size'], int), range_size)
+        return (path, digest, size)
+
+    def parse_includes(self, includes_dict):
+        check_types(includes_dict, dict)
+        for (path, rules) in includes_dict.items():
+            try:
+                path = check_path(bytes(check_types(path, str), encoding='utf-8'))
+                check_types(rules, dict)
+                signers = tuple(check_regex(s, regex_btc) for s in rules.get('signers', ()))
+                self.includes[path] = Include(
+                    signers=signers,
+                    signers_required=check_range(rules.get('signers_required', 1), (0, len(signers) or 1)),
+                    max_size=rules.get('max_size'),
+                    files_allowed=rules.get('files_allowed'),
+                )
+            except (TypeError, ValueError):
+                pass
+
+    def row(self, i):
+        """Build the FileInfo record at row [i]."""
+        start = i * self.digest_len
+        return FileInfo(
+            algo=self.algo,
+            digest=bytes(self.digests[start : start + self.digest_len]),
+            proof=None,
+            size=self.sizes[i],
+            optional=bool(self.flags[i]),
+        )
+
+    def lookup(self, inner_path, default=None):
+        """Return the FileInfo record of [inner_path], or [default] if the file is not listed."""
+        i = self.index.get(inner_path)
+        if i is None:
+            return default
+        return self.row(i)
+
+    def __getitem__(self, inner_path):
+        return self.row(self.index[inner_path])
+
+    def __contains__(self, inner_path):
+        return (inner_path in self.index)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __repr__(self):
+        return '<%s files=%d includes=%d>' % (self.__class__.__name__, len(self.paths), len(self.includes))
+
+    def items(self):
+        for (i, path) in enumerate(self.paths):
+            yield (path, self.row(i))
+
+    #################### prefix index ####################
+
+    @property
+    def sorted_paths(self):
+        if self._sorted_paths is None:
+            self._sorted_paths = sorted(self.paths)
+        return self._sorted_paths
+
+    def walk(self, prefix=''):
+        """Yield every inner path starting with [prefix], in sorted order."""
+        paths = self.sorted_paths
+        i = bisect_left(paths, prefix)
+        while i < len(paths) and paths[i].startswith(prefix):
+            yield paths[i]
+            i += 1
+
+    def listdir(self, directory=''):
+        """Return the sorted names of the files and subdirectories in [directory].
+        Names of subdirectories end with a slash."""
+        prefix = directory.strip('/')
+        if prefix:
+            prefix += '/'
+        paths = self.sorted_paths
+        names = []
+        i = bisect_left(paths, prefix)
+        while i < len(paths) and paths[i].startswith(prefix):
+            name = paths[i][len(prefix):]
+            sep = name.find('/')
+            if sep < 0:
+                names.append(name)
+                i += 1
+            else:
+                # Skip the whole subdirectory. '0' sorts right after '/'.
+                names.append(name[0:sep + 1])
+                i = bisect_left(paths, prefix + name[0:sep] + '0', i)
+        return names
+
+    #################### hash ID index ####################
+
+    @property
+    def hash_index(self):
+        if self._hash_index is None:
+            index = {}
+            for (i, optional) in enumerate(self.flags):
+                if optional:
+                    start = i * self.digest_len
+                    index.setdefault(bytes(self.digests[start : start + 2]), []).append(i)
+            self._hash_index = index
+        return self._hash_index
+
+    def find_hash(self, prefix):
+        """Return the inner paths of the optional files whose
+        digests start with the 2-byte [prefix]."""
+        return [self.paths[i] for i in self.hash_index.get(prefix, ())]
+
+    def hash_ids(self):
+        """Return the set of 2-byte prefixes of all optional files."""
+        return frozenset(self.hash_index)
+
+    #################### diff ####################
+
+    def diff(self, old):
+        """Compare this manifest with an [old] one by digest and size."""
+        return ManifestDiff(old, self)
+
+
+class ManifestDiff(object):
+    """Files added, removed and changed between two manifests, each as a sorted list of inner paths."""
+    __slots__ = ['added', 'removed', 'changed', 'new']
+
+    def __init__(self, old, new):
+        self.new = new
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+        # Walk the rows in storage order and only sort the results
+        n = new.digest_len
+        old_sizes, old_digests, old_get = old.sizes, old.digests, old.index.get
+        new_sizes, new_digests = new.sizes, new.digests
+        for (path, i) in new.index.items():
+            j = old_get(path)
+            if j is None:
+                self.added.append(path)
+            elif new_sizes[i] != old_sizes[j] or new_digests[i*n : i*n + n] != old_digests[j*n : j*n + n]:
+                self.changed.append(path)
+
+        new_index = new.index
+        self.removed = [path for path in old.index if path not in new_index]
+
+        self.added.sort()
+        self.removed.sort()
+        self.changed.sort()
+
+    def __repr__(self):
+        return '<%s added=%d removed=%d changed=%d>' % (
+            self.__class__.__name__, len(self.added), len(self.removed), len(self.changed))
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def downloads(self, optional=False):
+        """Yield (inner_path, FileInfo) for every added or changed file, in sorted order.
+        Optional files are skipped unless [optional] is True."""
+        new = self.new
+        for path in merge(self.added, self.changed):
+            i = new.index[path]
+            if optional or not new.flags[i]:
+                yield (path, new.row(i))
+
+
+__all__ = ['FileInfo', 'Include', 'Manifest', 'ManifestDiff', 'recover_cert']
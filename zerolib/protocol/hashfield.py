@@ -0,0 +1,140 @@
+import re
+import struct
+from functools import reduce
+
+_nonzero = re.compile(b'[^\x00]')
+
+if hasattr(int, 'bit_count'):
+    def _popcount(n):
+        return n.bit_count()
+else:
+    def _popcount(n):
+        return bin(n).count('1')
+
+
+class HashField(object):
+    """A set of 16-bit hash IDs stored as a 65536-bit bitmap (8 KiB).
+    Hash ID [i] is bit (i & 7) of byte (i >> 3).
+    Hash IDs can be given as ints or as 2-byte prefixes."""
+    __slots__ = ['bits']
+    num_ids = 0x10000
+
+    def __init__(self, hash_ids=()):
+        self.bits = bytearray(self.num_ids // 8)
+        for i in hash_ids:
+            self.add(i)
+
+    @classmethod
+    def from_int(cls, n):
+        instance = cls()
+        instance.bits[:] = n.to_bytes(cls.num_ids // 8, byteorder='little')
+        return instance
+
+    @classmethod
+    def from_raw(cls, hashfield_raw):
+        """Build a hash field from a packed [hashfield_raw] byte string."""
+        if len(hashfield_raw) % 2 != 0:
+            raise ValueError('Hash ID string length should be multiples of 2, not %d' % len(hashfield_raw))
+        instance = cls()
+        bits = instance.bits
+        for i in struct.unpack('>%dH' % (len(hashfield_raw) // 2), hashfield_raw):
+            bits[i >> 3] |= 1 << (i & 7)
+        return instance
+
+    @classmethod
+    def from_prefixes(cls, prefixes):
+        """Build a hash field from 2-byte prefixes, as returned by hash_set."""
+        return cls.from_raw(b''.join(prefixes))
+
+    def to_int(self):
+        return int.from_bytes(self.bits, byteorder='little')
+
+    def to_raw(self):
+        """Pack the hash IDs into a sorted [hashfield_raw] byte string."""
+        ids = list(self)
+        return struct.pack('>%dH' % len(ids), *ids)
+
+    def prefixes(self):
+        """Return the hash IDs as a set of 2-byte prefixes, like hash_set does."""
+        return frozenset(struct.pack('>H', i) for i in self)
+
+    @staticmethod
+    def hash_id(item):
+        if isinstance(item, bytes):
+            if len(item) != 2:
+                raise ValueError('A hash ID prefix should be 2 bytes long, not %d' % len(item))
+            return (item[0] << 8) | item[1]
+        if not (0 <= item < 0x10000):
+            raise ValueError('Hash ID out of range(0, 0xFFFF)')
+        return item
+
+    def add(self, item):
+        i = self.hash_id(item)
+        self.bits[i >> 3] |= 1 << (i & 7)
+
+    def discard(self, item):
+        i = self.hash_id(item)
+        self.bits[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+    def __contains__(self, item):
+        try:
+            i = self.hash_id(item)
+        except (TypeError, ValueError):
+            return False
+        return bool(self.bits[i >> 3] & (1 << (i & 7)))
+
+    def __iter__(self):
+        """Yield the hash IDs in ascending order."""
+        # Bit i of the int is character i of the reversed binary string
+        digits = bin(self.to_int())[:1:-1]
+        find = digits.find
+        i = find('1')
+        while i >= 0:
+            yield i
+            i = find('1', i + 1)
+
+    def __len__(self):
+        return _popcount(self.to_int())
+
+    def __bool__(self):
+        return _nonzero.search(self.bits) is not None
+
+    def __eq__(self, other):
+        if not isinstance(other, HashField):
+            return NotImplemented
+        return self.bits == other.bits
+
+    def __repr__(self):
+        return '<%s len=%d>' % (self.__class__.__name__, len(self))
+
+    def copy(self):
+        instance = self.__class__()
+        instance.bits[:] = self.bits
+        return instance
+
+    def __or__(self, other):
+        return self.from_int(self.to_int() | other.to_int())
+
+    def __and__(self, other):
+        return self.from_int(self.to_int() & other.to_int())
+
+    def __sub__(self, other):
+        return self.from_int(self.to_int() & ~other.to_int())
+
+    def __xor__(self, other):
+        return self.from_int(self.to_int() ^ other.to_int())
+
+    @classmethod
+    def union(cls, *fields):
+        """Return the hash IDs advertised by any of the given hash fields."""
+        return cls.from_int(reduce(lambda a, b: a | b, (f.to_int() for f in fields), 0))
+
+    @classmethod
+    def intersection(cls, *fields):
+        """Return the hash IDs advertised by all of the given hash fields."""
+        if not fields:
+            return cls()
+        return cls.from_int(reduce(lambda a, b: a & b, (f.to_int() for f in fields)))
+
+
+__all__ = ['HashField']
@@ -0,0 +1,111 @@
+from itertools import islice
+from .hashfield import HashField
+from .packets import RespHashDict, SetHash, dest_key
+
+
+class HashIndex(object):
+    """Maps each hash ID to the set of peers advertising it. Use one index per site.
+    Feed it with the hash fields found in [setHashfield] packets and in the responses
+    of [getHashfield], then answer [findHashIds] requests with it."""
+    __slots__ = ['fields', 'peers_of']
+    max_peers = 20
+
+    def __init__(self):
+        self.fields = {}
+        self.peers_of = {}
+
+    def __repr__(self):
+        return '<%s peers=%d hash_ids=%d>' % (self.__class__.__name__, len(self.fields), len(self.peers_of))
+
+    def update(self, peer, hashfield):
+        """Replace the hash field of [peer]. Only the hash IDs that changed are touched."""
+        old = self.fields.get(peer)
+        if old is None:
+            added, removed = hashfield, ()
+        else:
+            changed = old ^ hashfield
+            added = changed & hashfield
+            removed = changed & old
+
+        peers_of = self.peers_of
+        for hash_id in added:
+            peers = peers_of.get(hash_id)
+            if peers is None:
+                peers_of[hash_id] = {peer}
+            else:
+                peers.add(peer)
+        for hash_id in removed:
+            self._discard(hash_id, peer)
+
+        if hashfield:
+            self.fields[peer] = hashfield.copy()
+        else:
+            self.fields.pop(peer, None)
+
+    def update_packet(self, packet, peer=None):
+        """Update the index with a SetHash or RespHashSet packet. A RespHashSet is
+        indexed under its sender, the peer that was asked. A SetHash arrives on a
+        connection the peer opened, from an ephemeral port, so [peer] must be the
+        AddrPort it listens on, e.g. the address of the sender and the port of its
+        handshake. Raises ValueError for a SetHash without [peer]."""
+        if peer is None:
+            if isinstance(packet, SetHash):
+                raise ValueError('The listening address of the SetHash sender is required')
+            peer = packet.sender
+        self.update(peer, packet.hashfield)
+
+    def remove(self, peer):
+        """Forget everything [peer] has advertised."""
+        hashfield = self.fields.pop(peer, None)
+        if hashfield is not None:
+            for hash_id in hashfield:
+                self._discard(hash_id, peer)
+
+    def _discard(self, hash_id, peer):
+        peers = self.peers_of.get(hash_id)
+        if peers is not None:
+            peers.discard(peer)
+            if not peers:
+                del self.peers_of[hash_id]
+
+    def __getitem__(self, hash_id):
+        return self.peers_of.get(HashField.hash_id(hash_id), frozenset())
+
+    def __contains__(self, peer):
+        return (peer in self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def find(self, hash_ids, limit=None, exclude=None):
+        """Return a dictionary mapping each of [hash_ids] that is known to a list of
+        at most [limit] peers other than [exclude]."""
+        limit = limit or self.max_peers
+        found = {}
+        for item in hash_ids:
+            hash_id = HashField.hash_id(item)
+            peers = self.peers_of.get(hash_id)
+            if peers and exclude in peers:
+                peers = (peer for peer in peers if peer != exclude)
+            if peers:
+                found_peers = list(islice(peers, limit))
+                if found_peers:
+                    found[hash_id] = found_peers
+        return found
+
+    def respond(self, request, limit=None):
+        """Build the RespHashDict response of a FindHash [request]."""
+        response = RespHashDict()
+        response.req_id = request.req_id
+        response.sender = request.sender
+        response.site = request.site
+        response.peers, response.onions, response.garlics = {}, {}, {}
+        dicts = {'peers': response.peers, 'peers_onion': response.onions, 'peers_i2p': response.garlics}
+
+        for (hash_id, peers) in self.find(request, limit, request.sender).items():
+            for peer in peers:
+                dicts[dest_key(peer)].setdefault(hash_id, set()).add(peer)
+        return response
+
+
+__all__ = ['HashIndex']
@@ -0,0 +1,249 @@
+"""Hooks around the stages of packet processing: decoding msgpack,
+validating the decoded dict into a packet, and dispatching the packet to
+a BaseServer handler. While no hook is installed, each stage only pays
+for a truth test of [installed].
+Decode hooks run for byte strings (unpack, decode_dict) but not for
+unpack_stream, whose decoding time is mostly spent waiting for data."""
+from collections import Counter
+from threading import Event, Lock, Thread, get_ident
+from time import perf_counter
+
+# The installed PacketHooks. Replaced, never changed in place, so that it can
+# be iterated while hooks are being installed or removed.
+installed = ()
+_install_lock = Lock()
+
+
+class PacketHooks(object):
+    """Base class of hooks. Every method does nothing, so subclasses only
+    override what they need. The hooks of a stage are called by the thread
+    doing the work, before and after it, even if it fails."""
+    __slots__ = ()
+
+    def on_decode_start(self, sender):
+        pass
+
+    def on_decode_end(self, sender, payload):
+        """[payload] is the decoded dict, or None if decoding failed."""
+        pass
+
+    def on_parse(self, payload, sender):
+        pass
+
+    def on_parse_end(self, packet, sender):
+        """[packet] is the unpacked packet, or None if validation failed."""
+        pass
+
+    def on_dispatch(self, packet, name):
+        """[name] is the name of the BaseServer method handling [packet]."""
+        pass
+
+    def on_dispatch_end(self, packet, name):
+        pass
+
+
+def install_hooks(hooks):
+    global installed
+    with _install_lock:
+        if hooks not in installed:
+            installed = installed + (hooks,)
+
+def remove_hooks(hooks):
+    global installed
+    with _install_lock:
+        installed = tuple(h for h in installed if h is not hooks)
+
+
+def decode(func, data, sender):
+    """Run [func(data)] between the on_decode hooks. Returns the payload."""
+    current = installed
+    for hooks in current:
+        hooks.on_decode_start(sender)
+    payload = None
+    try:
+        payload = func(data)
+    finally:
+        for hooks in current:
+            hooks.on_decode_end(sender, payload)
+    return payload
+
+def parse(func, payload, sender):
+    """Run [func(payload, sender)] between the on_parse hooks. Returns the packet."""
+    current = installed
+    for hooks in current:
+        hooks.on_parse(payload, sender)
+    packet = None
+    try:
+        packet = func(payload, sender)
+    finally:
+        for hooks in current:
+            hooks.on_parse_end(packet, sender)
+    return packet
+
+def dispatch(func, packet, name):
+    """Run the handler [func(packet)] between the on_dispatch hooks.
+    Returns what the handler returns."""
+    current = installed
+    for hooks in current:
+        hooks.on_dispatch(packet, name)
+    try:
+        return func(packet)
+    finally:
+        for hooks in current:
+            hooks.on_dispatch_end(packet, name)
+
+
+class ThreadState(object):
+    __slots__ = ['stage', 'command', 'sender', 'pending']
+
+    def __init__(self):
+        self.stage = None
+        self.command = None
+        self.sender = None
+        self.pending = Counter()
+
+
+class SamplingProfiler(PacketHooks):
+    """Attributes the time spent on packets to (stage, command, sender),
+    [stage] being 'decode', 'parse' or 'dispatch' and [command] the name of
+    the packet class. Every [interval] seconds, a thread looks at what each
+    thread is doing, and charges the time elapsed since the last look.
+    The command of a packet is only known once it has been validated, so
+    the time spent before is kept aside and charged then. Packets which cannot
+    be decoded or validated are charged to 'undecodable' and 'invalid'.
+    Use start() and stop(), or a with statement."""
+    __slots__ = ['interval', 'samples', 'threads', 'lock', 'stopped', 'thread']
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self.threads = {}
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+
+    def __repr__(self):
+        return '<%s samples=%d>' % (self.__class__.__name__, len(self.samples))
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self.thread.start()
+        install_hooks(self)
+
+    def stop(self):
+        remove_hooks(self)
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _run(self):
+        last = perf_counter()
+        while not self.stopped.wait(self.interval):
+            now = perf_counter()
+            self.sample(now - last)
+            last = now
+
+    def sample(self, elapsed):
+        """Charge [elapsed] seconds to what each thread is doing."""
+        with self.lock:
+            for state in list(self.threads.values()):
+                stage = state.stage
+                if stage is None:
+                    continue
+                if state.command is None:
+                    state.pending[stage] += elapsed
+                else:
+                    self.samples[(stage, state.command, state.sender)] += elapsed
+
+    def _state(self):
+        ident = get_ident()
+        state = self.threads.get(ident)
+        if state is None:
+            with self.lock:
+                state = self.threads[ident] = ThreadState()
+        return state
+
+    def _charge(self, state, command):
+        # Called with the lock held
+        for (stage, elapsed) in state.pending.items():
+            self.samples[(stage, command, state.sender)] += elapsed
+        state.pending.clear()
+
+    def on_decode_start(self, sender):
+        state = self._state()
+        with self.lock:
+            if state.pending:
+                self._charge(state, 'unknown')
+            state.command = None
+            state.sender = sender
+            state.stage = 'decode'
+
+    def on_decode_end(self, sender, payload):
+        state = self._state()
+        with self.lock:
+            if payload is None:
+                self._charge(state, 'undecodable')
+            state.stage = None
+
+    def on_parse(self, payload, sender):
+        state = self._state()
+        state.command = None
+        state.sender = sender
+        state.stage = 'parse'
+
+    def on_parse_end(self, packet, sender):
+        state = self._state()
+        with self.lock:
+            self._charge(state, 'invalid' if packet is None else packet.__class__.__name__)
+            state.stage = None
+
+    def on_dispatch(self, packet, name):
+        state = self._state()
+        state.command = packet.__class__.__name__
+        state.sender = packet.sender
+        state.stage = 'dispatch'
+
+    def on_dispatch_end(self, packet, name):
+        state = self._state()
+        state.stage = None
+        state.command = None
+
+    def by_command(self):
+        """Return a Counter of seconds per command."""
+        return self._sum(1)
+
+    def by_sender(self):
+        """Return a Counter of seconds per sender."""
+        return self._sum(2)
+
+    def by_stage(self):
+        """Return a Counter of seconds per stage."""
+        return self._sum(0)
+
+    def _sum(self, index):
+        totals = Counter()
+        with self.lock:
+            for (key, elapsed) in self.samples.items():
+                totals[key[index]] += elapsed
+        return totals
+
+    def report(self, top=20):
+        """Return the [top] (stage, command, sender) with the most time, as text."""
+        with self.lock:
+            samples = self.samples.most_common(top)
+        lines = ['%-10s %-16s %-28s %10s' % ('stage', 'command', 'sender', 'ms')]
+        for ((stage, command, sender), elapsed) in samples:
+            lines.append('%-10s %-16s %-28s %10.3f' % (stage, command, sender, elapsed * 1e3))
+        return '\n'.join(lines)
+
+
+__all__ = ['PacketHooks', 'SamplingProfiler', 'install_hooks', 'remove_hooks']
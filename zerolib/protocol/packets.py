@@ -4,71 +4,101 @@ from msgpack.exceptions import OutOfData
 import re
 import struct
 from io import BytesIO
+from ipaddress import IPv4Address, IPv6Address
 from collections import namedtuple
 from base64 import b32encode, b32decode
 
 from .sanitizer import Condition, opt, val_types
 from . import sanitizer
+from . import patching
+from . import hooks
+from .hashfield import HashField
 
 def unpack(data, sender = None):
     """Unpack a byte string, and indicate that it was sent from a network address.
     Only unpacks one packet at a time.
     """
-    return unpack_stream(BytesIO(data), sender)
+    return unpack_dict(decode_dict(data, sender), sender)
+
+def decode_dict(data, sender = None):
+    """Decode the msgpack dict at the start of a byte string, with the limits of
+    unpack_stream. Unlike unpack_stream, which cannot read past the end of a
+    packet, all the bytes are fed at once. [sender] is only given to hooks.
+    Raises: ValueError, TypeError, IOError
+    """
+    if hooks.installed:
+        return hooks.decode(_decode_dict, data, sender)
+    return _decode_dict(data)
+
+def _decode_dict(data):
+    # The whole string is in memory already, so it may exceed max_buffer_size
+    generator = dict_unpacker(make_unpacker(max_buffer_size=max(len(data), 1)))
+    next(generator)
+    unpacked = generator.send(data)
+    if unpacked is None:
+        raise IOError('Data ended in the middle of a packet')
+    return unpacked
 
 def unpack_stream(stream, sender = None):
     """Unpack a stream, and indicate that it was sent from a network address.
     Only unpacks one packet at a time.
     Raises: ValueError, TypeError, KeyError, IOError
     """
-    generator = packet_unpacker()
+    generator = packet_unpacker(sender)
     unpacked = next(generator)
     while unpacked is None:
-        unpacked = generator.send(stream.read(1))
+        data = stream.read(1)
+        if not data:
+            raise IOError('Stream ended in the middle of a packet')
+        unpacked = generator.send(data)
     return unpacked
 
 
-def dict_unpacker():
-    kwargs = {
-        'max_str_len': 512 * 1024,
-        'max_bin_len': 512 * 1024,
-        'max_buffer_size': 512 * 1024,
-        'max_array_len': 4000,
-        'max_map_len': 4000,
-        'max_ext_len': 0,
-    }
-    unpacker = msgpack.Unpacker(**kwargs)
+unpacker_kwargs = {
+    'max_str_len': 512 * 1024,
+    'max_bin_len': 512 * 1024,
+    'max_buffer_size': 512 * 1024,
+    'max_array_len': 4000,
+    'max_map_len': 4000,
+    'max_ext_len': 0,
+}
+
+def make_unpacker(**kwargs):
+    kwargs = dict(unpacker_kwargs, **kwargs)
+    # Keep strings as bytes and allow int keys on msgpack versions that decode
+    # strings and reject int keys by default. Older versions do neither.
+    try:
+        return msgpack.Unpacker(raw=True, strict_map_key=False, **kwargs)
+    except TypeError:
+        return msgpack.Unpacker(**kwargs)
+
+def dict_unpacker(unpacker=None):
+    if unpacker is None:
+        unpacker = make_unpacker()
 
     while True:
-        data = yield
-        unpacker.feed(data)
         try:
             dict_len = unpacker.read_map_header()
-            if dict_len > 10:
-                raise ValueError('Dict len > 10')
+            break
         except OutOfData:
-            pass
+            unpacker.feed((yield))
+    if dict_len > 10:
+        raise ValueError('Dict len > 10')
 
-    iterator = iter(unpacker)
     payload_dict = {}
-
     for i in range(dict_len):
         while True:
-            data = yield
-            unpacker.feed(data)
             try:
-                key = next(iterator)
+                key = unpacker.unpack()
                 break
-            except StopIteration:
-                pass
+            except OutOfData:
+                unpacker.feed((yield))
         while True:
-            data = yield
-            unpacker.feed(data)
             try:
-                value = next(iterator)
+                value = unpacker.unpack()
                 break
-            except StopIteration:
-                pass
+            except OutOfData:
+                unpacker.feed((yield))
         payload_dict[key] = value
 
     yield payload_dict
@@ -85,6 +115,11 @@ def packet_unpacker(sender = None):
 
 @val_types(dict)
 def unpack_dict(packet, sender = None):
+    if hooks.installed:
+        return hooks.parse(_unpack_dict, packet, sender)
+    return _unpack_dict(packet, sender)
+
+def _unpack_dict(packet, sender):
     req_id = packet.get(b'req_id', packet.get(b'to'))
     if not isinstance(req_id, int):
         raise TypeError('Sequence number (req_id) should be an int, not %s' % req_id.__class__.__name__)
@@ -161,21 +196,43 @@ class PrefixIter(object):
     def __len__(self):
         return len(self.prefixes)
 
+    @property
+    def hashfield(self):
+        return HashField.from_prefixes(self.prefixes)
+
 
 #################### ping, pong, ok ####################
 
 class Ping(Packet):
     """Unpacked [ping] packet that checks if the client is still alive."""
-    pass
+
+    def pack(self, recipient):
+        return {'cmd': 'ping', 'req_id': self.req_id, 'params': {}}
 
 class Predicate(Packet):
-    __slots__ = ['ok']
+    """Unpacked response which only tells whether a request succeeded.
+    [error] is the reason given by the peer, or None."""
+    __slots__ = ['ok', 'error']
+
+    def __init__(self, error=None):
+        self.ok = (error is None)
+        self.error = error
 
     def parse(self, params):
         self.ok = (b'ok' in params)
+        error = params.get(b'error')
+        if isinstance(error, bytes):
+            error = error.decode('utf-8', 'replace')
+        self.error = None if self.ok else (error if isinstance(error, str) else '')
+
+    def pack(self, recipient):
+        if self.ok:
+            return {'cmd': 'response', 'to': self.req_id, 'ok': True}
+        return {'cmd': 'response', 'to': self.req_id, 'error': self.error}
 
 class Pong(Packet):
-    pass
+    def pack(self, recipient):
+        return {'cmd': 'response', 'to': self.req_id, 'body': b'Pong!'}
 
 
 #################### get file ####################
@@ -198,6 +255,12 @@ class RespFile(Packet):
             raise ValueError('File offset cannot be negative')
         self.body = body
 
+    def pack(self, recipient):
+        return {
+            'cmd': 'response', 'to': self.req_id, 'body': self.body,
+            'location': self.last_byte_offset, 'size': self.total_size,
+        }
+
     @property
     def next_offset(self):
         return self.last_byte_offset + 1
@@ -261,8 +324,8 @@ class OnionAddress(Address):
         self.init_bytes(b32decode(s))
 
     def init_bytes(self, bstr):
-        if len(b) not in (10, 35):
-            raise ValueError('A packed onion address should be either 10 or 35 bytes long, not %d' % len(b))
+        if len(bstr) not in (10, 35):
+            raise ValueError('A packed onion address should be either 10 or 35 bytes long, not %d' % len(bstr))
         self.readable = b32encode(bstr).decode('ascii').lower() + '.onion'
         self.packed = bstr
 
@@ -272,8 +335,8 @@ class I2PAddress(Address):
         self.init_bytes(b32decode(s + '===='))
 
     def init_bytes(self, bstr):
-        if len(b) != 32:
-            raise ValueError('A packed .b32.i2p address should be 32 bytes long, not %d' % len(b))
+        if len(bstr) != 32:
+            raise ValueError('A packed .b32.i2p address should be 32 bytes long, not %d' % len(bstr))
         self.readable = b32encode(bstr).decode('ascii').lower() + '.b32.i2p'
         self.packed = bstr
 
@@ -285,14 +348,14 @@ def unpack_ip(b):
     elif len(b) == 4 + 2:
         address = IPv4Address(b[0:-2])
     else:
-        raise ValueError('A packed IP address should be either 4 or 16 bytes long, not %d' % len(b) - 2)
-    port = struct.unpack('>H', b[-2:])
+        raise ValueError('A packed IP address should be either 4 or 16 bytes long, not %d' % (len(b) - 2))
+    port = struct.unpack('>H', b[-2:])[0]
     return AddrPort(address, port)
 
 @val_types(bytes)
 def unpack_onion(b):
     address = OnionAddress(b[0:-2])
-    port = struct.unpack('>H', b[-2:])
+    port = struct.unpack('>H', b[-2:])[0]
     return AddrPort(address, port)
 
 @val_types(bytes)
@@ -300,6 +363,30 @@ def unpack_i2p(b):
     address = I2PAddress(b)
     return AddrPort(address, 0)
 
+def unpack_peer_list(raw_list, unpack_func):
+    peers = set()
+    for peer in raw_list:
+        try:
+            peers.add(unpack_func(peer))
+        except (TypeError, ValueError):
+            pass
+    return peers
+
+def pack_dest(dest):
+    """Pack an AddrPort the way unpack_ip, unpack_onion and unpack_i2p expect it."""
+    address, port = dest
+    if isinstance(address, I2PAddress):
+        return address.packed
+    return address.packed + struct.pack('>H', port)
+
+def dest_key(dest):
+    """Return the peer list key for the type of [dest]: 'peers', 'peers_onion' or 'peers_i2p'."""
+    if isinstance(dest.address, OnionAddress):
+        return 'peers_onion'
+    if isinstance(dest.address, I2PAddress):
+        return 'peers_i2p'
+    return 'peers'
+
 
 #################### peer exchange ####################
 
@@ -320,39 +407,52 @@ class PEX(Packet):
     def parse(self, c, params):
         self.site = c.btc('site')
         self.need = c.range(opt('need'), (0, 10000)) or 0
-        self.parse_peers(self, c)
+        self.parse_peers(c)
 
     @staticmethod
     def unpack_peers(c, unpack_func, key):
         raw_list = c.as_type(opt(key), list) or ()
-        peers = set()
-        for peer in raw_list:
-            try:
-                peers.add(unpack_func(peer))
-            except (TypeError, ValueError):
-                pass
-        return peers
+        return unpack_peer_list(raw_list, unpack_func)
 
     def parse_peers(self, c):
-        self.peers = self.__class__.unpack_peers(c, unpack_ip, 'peers')
-        self.onions = self.__class__.unpack_peers(c, unpack_onion, 'peers_onion')
-        self.garlics = self.__class__.unpack_peers(c, unpack_i2p, 'peers_i2p')
+        self.peers = PEX.unpack_peers(c, unpack_ip, 'peers')
+        self.onions = PEX.unpack_peers(c, unpack_onion, 'peers_onion')
+        self.garlics = PEX.unpack_peers(c, unpack_i2p, 'peers_i2p')
 
 
 #################### file update ####################
 
 class Update(Packet):
     """Unpacked [update] packet that pushes a site file update."""
-    __slots__ = ['site', 'inner_path', 'body']
+    __slots__ = ['site', 'inner_path', 'body', 'diffs']
     response_cls = Predicate
 
     @use_condition
     def parse(self, c, params):
         self.site = c.btc('site')
         self.inner_path = c.inner('inner_path')
-        self.body = c.strlen('body', (0, 512*1024))
+        self.body = c.strlen(opt('body'), 512*1024)
+
+        diffs = c.as_type(opt('diffs'), dict) or {}
+        self.diffs = {}
+        for (path, actions) in diffs.items():
+            try:
+                self.diffs[sanitizer.check_path(path)] = patching.check_diff(actions)
+            except (TypeError, ValueError):
+                pass
 
-        # TODO: diff
+        if self.body is None and self.inner_path not in self.diffs:
+            raise KeyError('Update packet has neither body nor diff of %s' % self.inner_path)
+
+    def patch(self, inner_path, old, expect_digest=None, expect_size=None):
+        """Apply the diff of [inner_path] to its local copy [old], a byte string or a binary stream.
+        Returns the patched bytes.
+        Raises: KeyError, ValueError, DigestError"""
+        if inner_path == self.inner_path and self.body is not None:
+            actions = [('+', [self.body])]
+        else:
+            actions = self.diffs[inner_path]
+        return patching.apply_diff(old, actions, expect_digest, expect_size)
 
 
 #################### handshake and response ####################
@@ -365,7 +465,7 @@ class Handshake(Packet):
     def parse(self, c, params):
         crypto_list = c.as_type('crypt_supported', list)
         self.crypto_set = set()
-        for item in crypt_list:
+        for item in crypto_list:
             try:
                 self.crypto_set.add(item.decode('ascii'))
             except (AttributeError, ValueError):
@@ -388,7 +488,7 @@ class Handshake(Packet):
     @property
     def onion(self):
         if self.onion_address and self.port:
-            return AddrPort(self.onion.address, self.port)
+            return AddrPort(self.onion_address, self.port)
         else:
             return None
 
@@ -418,14 +518,14 @@ class RespMod(Packet):
         self.timestamps = {}
         for item in files_dict.items():
             try:
-                path, time = self.parse_item(c, item)
+                path, time = self.parse_item(item)
                 self.timestamps[path] = time
             except (TypeError, ValueError):
                 pass
 
     def parse_item(self, item):
         path, time = item
-        return sanitizer.check_path(path), sanitizer.check_time(time)
+        return sanitizer.check_path(path), sanitizer.check_range(time, sanitizer.range_time)
 
     def __iter__(self):
         return iter(self.timestamps)
@@ -522,16 +622,43 @@ class SetHash(Packet, PrefixIter):
 
 
 class RespHashDict(Packet):
-    __slots__ = ['site']
+    """Response packet of [findHashIds]. Maps each hash ID to the peers known to have the file."""
+    __slots__ = ['site', 'peers', 'onions', 'garlics']
+    max_peers = 1000
 
-    def parse(self, params):
-        raise NotImplementedError()
+    @use_condition
+    def parse(self, c, params):
+        self.peers = self.unpack_peer_dict(c, unpack_ip, 'peers')
+        self.onions = self.unpack_peer_dict(c, unpack_onion, 'peers_onion')
+        self.garlics = self.unpack_peer_dict(c, unpack_i2p, 'peers_i2p')
+
+    @staticmethod
+    def unpack_peer_dict(c, unpack_func, key):
+        raw_dict = c.as_type(opt(key), dict) or {}
+        peer_dict = {}
+        count = 0
+        for (hash_id, raw_list) in raw_dict.items():
+            if not isinstance(hash_id, int) or not (0 <= hash_id <= 0xFFFF) or not isinstance(raw_list, list):
+                continue
+            count += len(raw_list)
+            if count > RespHashDict.max_peers:
+                raise ValueError('Too many peers in response')
+            peer_dict[hash_id] = unpack_peer_list(raw_list, unpack_func)
+        return peer_dict
+
+    def pack(self, recipient):
+        # [peers] is always written, even empty, as it identifies the response
+        packed = {'cmd': 'response', 'to': self.req_id}
+        for (key, peer_dict) in (('peers', self.peers), ('peers_onion', self.onions), ('peers_i2p', self.garlics)):
+            if peer_dict or key != 'peers_i2p':
+                packed[key] = {hash_id: [pack_dest(d) for d in dests] for (hash_id, dests) in peer_dict.items()}
+        return packed
 
 
 class FindHash(Packet, PrefixIter):
     """Unpacked [findHashIds] packet that asks if the client knows any peer that has the said Hash IDs."""
     __slots__ = ['site', 'prefixes']
-    response_cls = RespHashSet
+    response_cls = RespHashDict
     copy_attrs = ['site']
 
     @use_condition
@@ -546,7 +673,7 @@ class FindHash(Packet, PrefixIter):
                     pass
 
         prefix_list = c.as_type('hash_ids', list)
-        self.prefixes = forzenset(generator(prefix_list))
+        self.prefixes = frozenset(generator(prefix_list))
 
 
 #################### check port ####################
@@ -631,6 +758,7 @@ attr_dict = {
     b'hashfield_raw': RespHashSet,
     b'status': RespPort,
     b'piecefields_packed': RespPieceDict,
+    b'body': Pong,
 }
 
 attr_type_dict = {
@@ -647,9 +775,9 @@ for v in request_dict.values():
 
 
 __all__ = [
-    'unpack', 'unpack_stream', 'unpack_dict', 'response_packets',
+    'unpack', 'unpack_stream', 'unpack_dict', 'decode_dict', 'response_packets',
     'dict_unpacker', 'packet_unpacker',
-    'OnionAddress', 'Packet', 'PrefixIter',
+    'OnionAddress', 'I2PAddress', 'AddrPort', 'Packet', 'PrefixIter',
 
     'GetFile', 'PEX', 'Update', 'Ping', 'Handshake', 'ListMod',
     'GetHash', 'SetHash', 'FindHash', 'CheckPort', 'GetPieceStatus',
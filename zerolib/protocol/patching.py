@@ -0,0 +1,118 @@
+from difflib import SequenceMatcher
+from io import BytesIO
+from ..integrity.hashing import verify_digest_bytes
+from .sanitizer import check_types, check_range, range_size
+
+# Line-based edit scripts, as used in the "diffs" field of update packets.
+# An edit script is a list of actions applied to the old file from start to end:
+#   ('=', n)      copy the next n bytes of the old file
+#   ('-', n)      skip the next n bytes of the old file
+#   ('+', lines)  insert the given lines
+
+max_insert_len = 512 * 1024
+max_actions = 4000
+# Copies and skips are read from the old file in pieces of this size
+copy_size = 64 * 1024
+
+
+def split_lines(data):
+    return BytesIO(data).readlines()
+
+def make_diff(old, new, limit=max_insert_len):
+    """Compute the edit script that turns [old] bytes into [new] bytes.
+    Returns None if more than [limit] bytes would have to be inserted."""
+    old_lines, new_lines = split_lines(old), split_lines(new)
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+
+    actions = []
+    inserted = 0
+    for (tag, old_from, old_to, new_from, new_to) in matcher.get_opcodes():
+        if tag == 'equal':
+            actions.append(('=', sum(map(len, old_lines[old_from:old_to]))))
+            continue
+        if tag in ('delete', 'replace'):
+            actions.append(('-', sum(map(len, old_lines[old_from:old_to]))))
+        if tag in ('insert', 'replace'):
+            lines = new_lines[new_from:new_to]
+            actions.append(('+', lines))
+            inserted += sum(map(len, lines))
+        if limit is not None and inserted > limit:
+            return None
+
+    if len(actions) > max_actions:
+        return None
+    return actions
+
+def check_diff(actions, limit=max_insert_len):
+    """Validate an edit script received from the network.
+    Returns the edit script as a list of (str, int) and (str, list of bytes) tuples.
+    Raises: TypeError, ValueError"""
+    check_types(actions, list)
+    if len(actions) > max_actions:
+        raise ValueError('Too many diff actions. %d > %d' % (len(actions), max_actions))
+
+    checked = []
+    inserted = 0
+    for action in actions:
+        check_types(action, (list, tuple))
+        if len(action) != 2:
+            raise ValueError('Diff action should be a pair, not %d items' % len(action))
+        op, param = action
+        if isinstance(op, bytes):
+            op = op.decode('ascii')
+        if op in ('=', '-'):
+            param = check_range(check_types(param, int), range_size)
+        elif op == '+':
+            check_types(param, list)
+            for line in param:
+                inserted += len(check_types(line, bytes))
+            if inserted > limit:
+                raise ValueError('Inserted lines too long. %d > %d' % (inserted, limit))
+        else:
+            raise ValueError('Unknown diff action %r' % op)
+        checked.append((op, param))
+    return checked
+
+def apply_diff(old, actions, expect_digest=None, expect_size=None, algo='sha512'):
+    """Apply the edit script [actions] to [old], a byte string or a binary stream.
+    If [expect_digest] is given, the patched file is verified against it.
+    Returns the patched bytes.
+    Raises: ValueError, DigestError"""
+    if isinstance(old, (bytes, bytearray)):
+        old = BytesIO(old)
+    # Counts come from the network: check them against what is left of the
+    # old file before reading anything
+    remaining = None
+    if old is not None and old.seekable():
+        position = old.tell()
+        remaining = old.seek(0, 2) - position
+        old.seek(position)
+
+    new = BytesIO()
+    for (op, param) in actions:
+        if op in ('=', '-'):
+            if remaining is not None:
+                if param > remaining:
+                    raise ValueError('Diff %s past the end of the old file' % ('copies' if op == '=' else 'skips'))
+                remaining -= param
+            left = param
+            while left > 0:
+                data = old.read(min(left, copy_size))
+                if not data:
+                    raise ValueError('Diff %s past the end of the old file' % ('copies' if op == '=' else 'skips'))
+                if op == '=':
+                    new.write(data)
+                left -= len(data)
+        elif op == '+':
+            for line in param:
+                new.write(line)
+        else:
+            raise ValueError('Unknown diff action %r' % op)
+
+    data = new.getvalue()
+    if expect_digest is not None:
+        verify_digest_bytes(data, expect_digest, expect_size, algo)
+    return data
+
+
+__all__ = ['make_diff', 'check_diff', 'apply_diff']
@@ -0,0 +1,272 @@
+"""Binary snapshots of a peer table, used by Router.save and Router.load.
+A snapshot file is laid out as follows, all integers being big endian:
+    header      magic, generation (16 random bytes), site_count uint32,
+                peer_count uint32, sites_offset uint64, index_offset uint64
+    records     one per peer, sorted by key:
+                    key         address_type uint8, address_len uint8, packed address
+                    port uint16, last_seen float64, score float64, site_count uint16
+                    sites       site_count uint32 indexes into the site table
+    sites       site_count times a uint16 length and a UTF-8 site address
+    index       peer_count uint64 offsets of the records, so that a peer is
+                found by bisecting the index of the memory-mapped file
+Changes made after a snapshot are appended to a journal, [path].journal, in
+batches:
+    header      journal_magic, then the generation of its snapshot
+    batch       uint32 length, uint32 CRC-32, then records prefixed by uint8
+                0 for a put and 1 for a removal. Put records spell out their
+                sites, each as a uint16 length and a UTF-8 site address.
+A batch that was not written completely is ignored, and so is a journal that
+belongs to another snapshot."""
+import mmap
+import os
+import struct
+import zlib
+from ipaddress import IPv4Address, IPv6Address
+from .packets import AddrPort, OnionAddress, I2PAddress
+
+magic = b'ZNPEERS\x01'
+journal_magic = b'ZNPJRNL\x01'
+header_struct = struct.Struct('>8s16sIIQQ')
+journal_header = struct.Struct('>8s16s')
+batch_header = struct.Struct('>II')
+key_head = struct.Struct('>BB')
+record_struct = struct.Struct('>HddH')
+offset_struct = struct.Struct('>Q')
+site_index = struct.Struct('>I')
+length_struct = struct.Struct('>H')
+
+address_types = {IPv4Address: 1, IPv6Address: 2, OnionAddress: 3, I2PAddress: 4}
+address_classes = {v: k for (k, v) in address_types.items()}
+
+PUT = 0
+REMOVE = 1
+
+
+def address_key(address):
+    """Return the key of [address] in a snapshot, which sorts addresses by type then bytes."""
+    packed = address.packed
+    return key_head.pack(address_types[address.__class__], len(packed)) + packed
+
+def unpack_key(data, offset=0):
+    """Returns (address, offset of what follows the key)"""
+    address_type, address_len = key_head.unpack_from(data, offset)
+    start = offset + key_head.size
+    end = start + address_len
+    return (address_classes[address_type](bytes(data[start:end])), end)
+
+def pack_sites(sites):
+    return b''.join(length_struct.pack(len(b)) + b for b in (site.encode('utf-8') for site in sites))
+
+def unpack_sites(data, offset, count):
+    """Returns (list of sites, offset of what follows them)"""
+    sites = []
+    for i in range(count):
+        (length,) = length_struct.unpack_from(data, offset)
+        offset += length_struct.size
+        sites.append(bytes(data[offset:offset + length]).decode('utf-8'))
+        offset += length
+    return (sites, offset)
+
+
+class Snapshot(object):
+    """A memory-mapped snapshot file. Only its header and site table are
+    read when it is opened. Peers are read on demand."""
+    __slots__ = ['path', 'file', 'map', 'generation', 'sites', 'count', 'index_offset', 'size']
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.size = os.fstat(self.file.fileno()).st_size
+            if self.size < header_struct.size:
+                raise ValueError('Not a peer snapshot')
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self.file.close()
+            raise
+        file_magic, self.generation, site_count, self.count, sites_offset, self.index_offset = \
+            header_struct.unpack_from(self.map)
+        if file_magic != magic:
+            self.close()
+            raise ValueError('Not a peer snapshot')
+        if self.index_offset + self.count * offset_struct.size > self.size:
+            self.close()
+            raise IOError('Peer snapshot is truncated')
+        self.sites, _ = unpack_sites(self.map, sites_offset, site_count)
+
+    def __repr__(self):
+        return '<%s %r peers=%d>' % (self.__class__.__name__, self.path, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def offset(self, i):
+        return offset_struct.unpack_from(self.map, self.index_offset + i * offset_struct.size)[0]
+
+    def key(self, i):
+        offset = self.offset(i)
+        return self.map[offset:offset + key_head.size + self.map[offset + 1]]
+
+    def find(self, key):
+        """Return the offset of the record of [key], an address_key, or None."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.key(low) == key:
+            return self.offset(low)
+        return None
+
+    def record(self, offset):
+        """Returns (dest, last_seen, score, sites) of the record at [offset]"""
+        data = self.map
+        address, offset = unpack_key(data, offset)
+        port, last_seen, score, site_count = record_struct.unpack_from(data, offset)
+        offset += record_struct.size
+        site_ids = struct.unpack_from('>%dI' % site_count, data, offset)
+        return (AddrPort(address, port), last_seen, score, frozenset(map(self.sites.__getitem__, site_ids)))
+
+    def entries(self):
+        """Yield (key, offset of the record) of every peer, in key order."""
+        data = self.map
+        for offset in struct.unpack_from('>%dQ' % self.count, data, self.index_offset):
+            yield (data[offset:offset + key_head.size + data[offset + 1]], offset)
+
+    def raw_records(self):
+        """Yield (key, raw record bytes) of every peer, in key order."""
+        data = self.map
+        for offset in struct.unpack_from('>%dQ' % self.count, data, self.index_offset):
+            key_end = offset + key_head.size + data[offset + 1]
+            site_count = length_struct.unpack_from(data, key_end + record_struct.size - length_struct.size)[0]
+            end = key_end + record_struct.size + site_count * site_index.size
+            yield (data[offset:key_end], data[offset:end])
+
+    def close(self):
+        if getattr(self, 'map', None) is not None:
+            self.map.close()
+        self.file.close()
+
+
+def pack_record(key, state, site_ids):
+    dest, last_seen, score, sites = state
+    ids = [site_ids[site] for site in sites]
+    return b''.join((key, record_struct.pack(dest.port, last_seen, score, len(ids)),
+        struct.pack('>%dI' % len(ids), *ids)))
+
+def fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_snapshot(path, states, base=None, skip=frozenset()):
+    """Write a snapshot of [states], a dict of address_key: (dest, last_seen,
+    score, sites), plus the records of [base], a Snapshot, whose keys are
+    neither in [states] nor in [skip]. The file is written next to [path],
+    then atomically moved over it. Returns the generation of the new snapshot."""
+    sites = list(base.sites) if base is not None else []
+    site_ids = {site: i for (i, site) in enumerate(sites)}
+    for state in states.values():
+        for site in state[3]:
+            if site not in site_ids:
+                site_ids[site] = len(sites)
+                sites.append(site)
+
+    records = [(key, pack_record(key, state, site_ids)) for (key, state) in states.items()]
+    if base is not None:
+        records.extend(item for item in base.raw_records() if item[0] not in states and item[0] not in skip)
+    records.sort(key=lambda item: item[0])
+
+    generation = os.urandom(16)
+    offsets = []
+    position = header_struct.size
+    for (key, record) in records:
+        offsets.append(position)
+        position += len(record)
+    sites_data = pack_sites(sites)
+    index_offset = position + len(sites_data)
+
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as f:
+        f.write(header_struct.pack(magic, generation, len(sites), len(records), position, index_offset))
+        f.write(b''.join(record for (key, record) in records))
+        f.write(sites_data)
+        f.write(struct.pack('>%dQ' % len(offsets), *offsets))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+    return generation
+
+
+def journal_path(path):
+    return '%s.journal' % path
+
+def append_journal(path, generation, changes):
+    """Append one batch of [changes], a list of (key, state) with None as the
+    state of a removed peer, to the journal of the snapshot at [path]."""
+    parts = []
+    for (key, state) in changes:
+        if state is None:
+            parts.append(bytes([REMOVE]) + key)
+        else:
+            dest, last_seen, score, sites = state
+            parts.append(b''.join((bytes([PUT]), key, record_struct.pack(dest.port, last_seen, score, len(sites)),
+                pack_sites(sites))))
+    payload = b''.join(parts)
+    jpath = journal_path(path)
+    with open(jpath, 'ab') as f:
+        if f.tell() == 0:
+            f.write(journal_header.pack(journal_magic, generation))
+        f.write(batch_header.pack(len(payload), zlib.crc32(payload)) + payload)
+        f.flush()
+        os.fsync(f.fileno())
+    fsync_dir(jpath)
+
+def read_journal(path, generation):
+    """Read the journal of the snapshot at [path]. Returns (changes, end):
+    [changes] is a list of (key, state) with None as the state of a removed
+    peer, and [end] the size of the complete batches that belong to the
+    snapshot of [generation]. What follows [end] should be cut off."""
+    try:
+        with open(journal_path(path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return ([], 0)
+    if len(data) < journal_header.size or journal_header.unpack_from(data) != (journal_magic, generation):
+        return ([], 0)
+
+    changes = []
+    position = journal_header.size
+    while position + batch_header.size <= len(data):
+        length, crc = batch_header.unpack_from(data, position)
+        start = position + batch_header.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        offset = 0
+        while offset < length:
+            op = payload[offset]
+            address, end = unpack_key(payload, offset + 1)
+            key = payload[offset + 1:end]
+            if op == REMOVE:
+                changes.append((key, None))
+                offset = end
+                continue
+            port, last_seen, score, site_count = record_struct.unpack_from(payload, end)
+            sites, offset = unpack_sites(payload, end + record_struct.size, site_count)
+            changes.append((key, (AddrPort(address, port), last_seen, score, frozenset(sites))))
+        position = start + length
+    return (changes, position)
+
+
+__all__ = []
@@ -1,5 +1,13 @@
+import heapq
+import os
+from . import peertable
+from .packets import Predicate, RespFile
+
 class Peer(object):
-    __slots__ = ['dest', 'last_seen', 'sites', 'dht', 'score']
+    """[rtt], [rate] and [failure_rate] are the moving averages kept by
+    a PeerScorer: the round trip time in seconds, the transfer rate in bytes
+    per second and the part of requests that failed. They are None until measured."""
+    __slots__ = ['dest', 'last_seen', 'sites', 'dht', 'score', 'rtt', 'rate', 'failure_rate']
     default_score = 50
 
     def __init__(self, dest, last_seen, sites = None, dht = None, score = None):
@@ -8,6 +16,9 @@ class Peer(object):
         self.sites = sites or set()
         self.dht = dht
         self.score = score if score is not None else Peer.default_score
+        self.rtt = None
+        self.rate = None
+        self.failure_rate = None
 
     def __eq__(self, other):
         return self.dest == other.dest
@@ -28,41 +39,274 @@ class Peer(object):
 
 
 
+class PeerScorer(object):
+    """Scores peers from how they perform. Round trip times, transfer rates
+    and failures are averaged per peer by exponentially weighted moving
+    averages of weight [alpha], and Peer.score is recomputed from the
+    averages after each sample, in constant time.
+    The score is 100 times the success rate times a speed between 0 and 1,
+    the mean of rtt_ref / (rtt_ref + rtt) and rate / (rate + rate_ref).
+    A peer that never fails, with a round trip of [rtt_ref] seconds and a
+    rate of [rate_ref] bytes per second, keeps the default score of 50.
+    Peers are given as Peer objects, or as AddrPorts looked up in [router]."""
+    __slots__ = ['router', 'alpha', 'rtt_ref', 'rate_ref']
+
+    def __init__(self, router=None, alpha=0.2, rtt_ref=0.5, rate_ref=256 * 1024):
+        self.router = router
+        self.alpha = alpha
+        self.rtt_ref = rtt_ref
+        self.rate_ref = rate_ref
+
+    def __repr__(self):
+        return '<%s alpha=%g>' % (self.__class__.__name__, self.alpha)
+
+    def peer(self, dest):
+        if isinstance(dest, Peer):
+            return dest
+        if dest is None or self.router is None:
+            return None
+        return self.router.get(dest.address)
+
+    def average(self, old, sample):
+        return sample if old is None else old + self.alpha * (sample - old)
+
+    def rtt(self, dest, seconds):
+        """Record a request answered in [seconds]."""
+        peer = self.peer(dest)
+        if peer is not None:
+            peer.rtt = self.average(peer.rtt, seconds)
+            peer.failure_rate = self.average(peer.failure_rate, 0.0)
+            self.update(peer)
+
+    def transfer(self, dest, size, seconds):
+        """Record [size] bytes received in [seconds]."""
+        peer = self.peer(dest)
+        if peer is not None:
+            peer.rate = self.average(peer.rate, size / max(seconds, 1e-6))
+            peer.failure_rate = self.average(peer.failure_rate, 0.0)
+            self.update(peer)
+
+    def failure(self, dest):
+        """Record a request that failed or timed out."""
+        peer = self.peer(dest)
+        if peer is not None:
+            peer.failure_rate = self.average(peer.failure_rate, 1.0)
+            self.update(peer)
+
+    def response(self, packet, seconds):
+        """Record [packet], a response interpreted [seconds] after its request
+        was registered. The body of a RespFile counts as a transfer, an error
+        Predicate as a failure, and anything else as a round trip."""
+        if packet.__class__ is RespFile:
+            self.transfer(packet.sender, len(packet.body), seconds)
+        elif packet.__class__ is Predicate and not packet.ok:
+            self.failure(packet.sender)
+        else:
+            self.rtt(packet.sender, seconds)
+
+    def update(self, peer):
+        speed = 0.0
+        count = 0
+        if peer.rtt is not None:
+            speed += self.rtt_ref / (self.rtt_ref + peer.rtt)
+            count += 1
+        if peer.rate is not None:
+            speed += peer.rate / (peer.rate + self.rate_ref)
+            count += 1
+        speed = speed / count if count else 0.5
+        peer.score = 100 * (1 - (peer.failure_rate or 0.0)) * speed
+
+
 class Router:
+    """Peers by address. A Router saved with save() can be loaded back with
+    load(), which maps the file into memory and only reads the peers asked
+    for. Iterating over the router reads all of them."""
+    # Rewrite the snapshot once its journal is larger than this part of it
+    journal_ratio = 0.5
+
     def __init__(self):
         self.peers = {}
+        # The snapshot last loaded or saved, or None. If [lazy] is True,
+        # some of its peers have not been read yet.
+        self.snapshot = None
+        self.lazy = False
+        # The states of the peers as last saved to self.snapshot and its journal
+        self.saved = {}
+        self.removed = set()
+
+    @staticmethod
+    def state(peer):
+        return (peer.dest, peer.last_seen, peer.score, frozenset(peer.sites))
+
+    def _read(self, key):
+        """Read the peer of [key] from the snapshot."""
+        if key in self.removed:
+            return None
+        offset = self.snapshot.find(peertable.address_key(key))
+        if offset is None:
+            return None
+        state = self.snapshot.record(offset)
+        return self._restore(key, state)
+
+    def _restore(self, key, state):
+        dest, last_seen, score, sites = state
+        peer = self.peers[key] = Peer(dest, last_seen, set(sites), score=score)
+        self.saved[key] = state
+        return peer
+
+    def load_all(self):
+        """Read every peer of the snapshot that has not been read yet."""
+        if not self.lazy:
+            return
+        snapshot = self.snapshot
+        read = {peertable.address_key(key) for key in self.peers}
+        read.update(peertable.address_key(key) for key in self.removed)
+        for (key, offset) in snapshot.entries():
+            if key not in read:
+                state = snapshot.record(offset)
+                self._restore(state[0].address, state)
+        self.lazy = False
 
     def put(self, peer, override=False):
-        if (override) or (peer.address not in self.peers):
-            self.peers[peer.address] = peer
+        if (override) or (peer.address not in self):
+            self[peer.address] = peer
 
     def get(self, key, default = None):
-        return self.peers.get(key, default)
+        peer = self.peers.get(key)
+        if peer is None and self.lazy:
+            peer = self._read(key)
+        return peer if peer is not None else default
 
     def items(self):
+        self.load_all()
         return self.peers.items()
 
     def values(self):
+        self.load_all()
         return self.peers.values()
 
     def __getitem__(self, key):
-        return self.peers[key]
+        peer = self.get(key)
+        if peer is None:
+            raise KeyError(key)
+        return peer
 
     def __setitem__(self, key, value):
+        self.removed.discard(key)
         return self.peers.__setitem__(key, value)
 
     def __delitem__(self, key):
-        return self.peers.__delitem__(key)
+        self[key]
+        del self.peers[key]
+        if self.snapshot is not None:
+            self.removed.add(key)
 
     def __contains__(self, key):
-        return (key in self.peers)
+        return (self.get(key) is not None)
 
     def __iter__(self):
+        self.load_all()
         return iter(self.peers)
 
+    def __len__(self):
+        self.load_all()
+        return len(self.peers)
+
+    @classmethod
+    def load(cls, path):
+        """Load the router saved at [path]. Peers are read from the file when
+        they are asked for, so loading takes the time of reading the site
+        table and the changes journaled since the last full save.
+        Raises: ValueError if the file is not a saved router, IOError if it is truncated"""
+        router = cls()
+        router.snapshot = peertable.Snapshot(path)
+        router.lazy = True
+        changes, end = peertable.read_journal(path, router.snapshot.generation)
+        for (key, state) in changes:
+            address, _ = peertable.unpack_key(key)
+            if state is None:
+                router.peers.pop(address, None)
+                router.saved.pop(address, None)
+                router.removed.add(address)
+            else:
+                router.removed.discard(address)
+                router._restore(address, state)
+        journal = peertable.journal_path(path)
+        if os.path.exists(journal) and os.path.getsize(journal) != end:
+            # Cut off a batch that was not written completely, or a journal
+            # left over from another snapshot
+            os.truncate(journal, end)
+        return router
+
+    def save(self, path):
+        """Save the peers to [path]. If the router was loaded from or saved
+        to [path], only the peers that changed since are appended to a journal,
+        until the journal grows too large compared to the snapshot, which is
+        then rewritten. Either way, a crash leaves the last save intact."""
+        snapshot = self.snapshot
+        if snapshot is not None and os.path.abspath(snapshot.path) == os.path.abspath(path):
+            journal = peertable.journal_path(path)
+            journal_size = os.path.getsize(journal) if os.path.exists(journal) else 0
+            if journal_size <= snapshot.size * self.journal_ratio:
+                self._save_journal(path)
+                return
+        self._save_snapshot(path)
+
+    def _changes(self):
+        saved = self.saved
+        changed = {}
+        for (key, peer) in self.peers.items():
+            state = self.state(peer)
+            if saved.get(key) != state:
+                changed[key] = state
+        return changed
+
+    def _save_journal(self, path):
+        changed = self._changes()
+        # Deleted peers were read first, so those on disk are in self.saved
+        removed = [key for key in self.removed if key in self.saved]
+        changes = [(peertable.address_key(key), state) for (key, state) in changed.items()]
+        changes.extend((peertable.address_key(key), None) for key in removed)
+        if changes:
+            peertable.append_journal(path, self.snapshot.generation, changes)
+        self.saved.update(changed)
+        for key in removed:
+            self.saved.pop(key, None)
+
+    def _save_snapshot(self, path):
+        base = self.snapshot if self.lazy else None
+        states = {key: self.state(peer) for (key, peer) in self.peers.items()}
+        skip = frozenset(peertable.address_key(key) for key in self.removed)
+        peertable.write_snapshot(path, {peertable.address_key(key): state for (key, state) in states.items()}, base, skip)
+        # The journal belongs to the replaced snapshot
+        journal = peertable.journal_path(path)
+        if os.path.exists(journal):
+            os.truncate(journal, 0)
+        snapshot = peertable.Snapshot(path)
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = snapshot
+        self.saved = states
+        self.removed = set()
+
+    def close(self):
+        """Close the file the router was loaded from, reading the peers not read yet first."""
+        self.load_all()
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def fastest(self, n, site=None):
+        """Return the [n] peers with the highest score, best first, out of
+        those hosting [site] if it is given."""
+        peers = self.values()
+        if site is not None:
+            peers = (peer for peer in peers if site in peer.sites)
+        return heapq.nlargest(n, peers, key=lambda peer: peer.score)
+
     @staticmethod
     def distance(hash_a, hash_b):
         return int.from_bytes(hash_a, byteorder='big') ^ int.from_bytes(hash_b, byteorder='big')
 
 
-__all__ = ['Peer', 'Router']
+__all__ = ['Peer', 'PeerScorer', 'Router']
@@ -1,15 +1,22 @@
 from collections import OrderedDict, namedtuple
 from .packets import response_packets, RespFile
 from os import urandom
+from time import monotonic
 
-Info = namedtuple('Info', ['cls', 'attr_dict'])
+# [sent] is the monotonic time when the request was registered
+Info = namedtuple('Info', ['cls', 'attr_dict', 'sent'])
 
 class PacketInterp(object):
-    __slots__ = ['sequence']
+    """Matches responses with the requests registered before them.
+    If [scorer] is given, it is told how long each response took, as
+    scorer.response(response, seconds), and scorer.failure(sender) is
+    called for responses that do not fit their request."""
+    __slots__ = ['sequence', 'scorer']
     capacity = 10
 
-    def __init__(self):
+    def __init__(self, scorer=None):
         self.sequence = OrderedDict()
+        self.scorer = scorer
 
     @staticmethod
     def new_id():
@@ -26,21 +33,28 @@ class PacketInterp(object):
         attr_dict = self.__class__.copy_attrs(packet)
 
         identifier = (packet.sender, packet.req_id)
-        self.sequence[identifier] = Info(packet.response_cls, attr_dict)
+        self.sequence[identifier] = Info(packet.response_cls, attr_dict, monotonic())
 
     def interpret(self, packet):
         if not packet.__class__ in response_packets:
             return
 
-        cls, attr_dict = self.sequence.pop((packet.sender, packet.req_id))
-        if not isinstance(packet, cls):
-            raise TypeError('Sequence number %d: expects a %s packet, not %s' %
-                (packet.req_id, cls.__name__, packet.__class__.__name__))
-        if attr_dict:
-            if isinstance(packet, RespFile):
-                self.__class__.inject_respfile_attrs(packet, attr_dict)
-            else:
-                self.__class__.inject_attrs(packet, attr_dict)
+        cls, attr_dict, sent = self.sequence.pop((packet.sender, packet.req_id))
+        try:
+            if not isinstance(packet, cls):
+                raise TypeError('Sequence number %d: expects a %s packet, not %s' %
+                    (packet.req_id, cls.__name__, packet.__class__.__name__))
+            if attr_dict:
+                if isinstance(packet, RespFile):
+                    self.__class__.inject_respfile_attrs(packet, attr_dict)
+                else:
+                    self.__class__.inject_attrs(packet, attr_dict)
+        except (TypeError, ValueError):
+            if self.scorer is not None:
+                self.scorer.failure(packet.sender)
+            raise
+        if self.scorer is not None:
+            self.scorer.response(packet, monotonic() - sent)
 
     @staticmethod
     def copy_attrs(packet):
@@ -1,31 +1,46 @@
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, ec
 from cryptography import x509
 from cryptography.x509.oid import NameOID
 
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from random import SystemRandom
+from threading import Lock
 from .certdb import make_fields
+import os
 import ssl
+import tempfile
 
 
-def make_cert():
-    """Generate and return a public key PEM and a secret key PEM."""
+def make_secret_key(key_type='rsa'):
+    if key_type == 'rsa':
+        return rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048,
+            backend=default_backend()
+        )
+    elif key_type == 'ec':
+        return ec.generate_private_key(ec.SECP256R1(), default_backend())
+    else:
+        raise ValueError('Unknown key type %r' % key_type)
 
-    secretkey = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048,
-        backend=default_backend()
-    )
+def make_cert(key_type='rsa', fields=None):
+    """Generate and return a public key PEM and a secret key PEM.
+    [key_type] is 'rsa' for a 2048-bit RSA key, or 'ec' for a much faster
+    ECDSA P-256 key. [fields] defaults to random certdb Fields."""
+
+    secretkey = make_secret_key(key_type)
     secretkey_pem = secretkey.private_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PrivateFormat.TraditionalOpenSSL,
         encryption_algorithm=serialization.NoEncryption()
     )
 
-    f = make_fields()
+    f = fields or make_fields()
     attrs = []
     if f.country:
         attrs.append(x509.NameAttribute(NameOID.COUNTRY_NAME, f.country))
@@ -67,6 +82,69 @@ def make_cert():
     return (publickey_pem, secretkey_pem)
 
 
+class CertPool(object):
+    """A pool of pre-generated certificates. Certificates are generated by
+    make_cert on a worker process, so that take() returns at once.
+    Every certificate taken is replaced in the background."""
+    __slots__ = ['size', 'key_type', 'ready', 'pending', 'lock', 'executor', 'own_executor']
+
+    def __init__(self, size=4, key_type='rsa', executor=None):
+        self.size = size
+        self.key_type = key_type
+        self.ready = deque()
+        self.pending = 0
+        self.lock = Lock()
+        self.own_executor = executor is None
+        self.executor = executor if executor is not None else ProcessPoolExecutor(max_workers=1)
+        for i in range(size):
+            self.refill()
+
+    def __repr__(self):
+        return '<%s %s ready=%d pending=%d>' % (
+            self.__class__.__name__, self.key_type, len(self.ready), self.pending)
+
+    def refill(self):
+        with self.lock:
+            self.pending += 1
+        try:
+            future = self.executor.submit(make_cert, self.key_type)
+        except RuntimeError:
+            # The executor has been shut down
+            with self.lock:
+                self.pending -= 1
+            return
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+        if not future.cancelled() and future.exception() is None:
+            self.ready.append(future.result())
+
+    def take(self):
+        """Return a (public_pem, secret_pem) pair. If the pool is empty,
+        a certificate is generated in the calling thread."""
+        try:
+            cert = self.ready.popleft()
+        except IndexError:
+            cert = make_cert(self.key_type)
+        with self.lock:
+            missing = self.size - len(self.ready) - self.pending
+        for i in range(missing):
+            self.refill()
+        return cert
+
+    def close(self):
+        if self.own_executor:
+            self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
 # Mozilla recommendation
 ciphers = ':'.join([
     'ECDHE-ECDSA-AES256-GCM-SHA384', 'ECDHE-RSA-AES256-GCM-SHA384',
@@ -95,6 +173,121 @@ def tweak_context_options(context):
     context.options |= ssl.OP_SINGLE_ECDH_USE
 
 
+def load_cert(context, cert):
+    """Load a (public_pem, secret_pem) pair, as returned by make_cert, into [context]."""
+    # SSLContext only loads certificates from files
+    with tempfile.TemporaryDirectory() as dirname:
+        paths = []
+        for (name, pem) in zip(('public.pem', 'secret.pem'), cert):
+            path = os.path.join(dirname, name)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with open(fd, 'wb') as f:
+                f.write(pem)
+            paths.append(path)
+        context.load_cert_chain(*paths)
+
+
+# Python 3.5 has neither the TLS_SERVER/TLS_CLIENT protocols nor SSLSession.
+# Fall back to PROTOCOL_SSLv23 there, without session resumption.
+server_protocol = getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23)
+client_protocol = getattr(ssl, 'PROTOCOL_TLS_CLIENT', ssl.PROTOCOL_SSLv23)
+resumption = hasattr(ssl, 'SSLSession')
+
+
+class ContextFactory(object):
+    """Builds server and client SSLContexts once per identity, a (public_pem,
+    secret_pem) pair, and caches them. Client sessions are kept per identity and
+    peer AddrPort, as a session only works with the context that created it.
+    At most [session_capacity] of them are kept, so that the next connection to
+    the same peer with the same identity resumes the session instead of doing
+    a full handshake.
+    Peers use self-signed certificates, so client contexts do not verify them.
+    Without session resumption (Python 3.5), every connection does a full handshake."""
+    __slots__ = ['servers', 'clients', 'sessions', 'session_capacity', 'lock']
+
+    def __init__(self, session_capacity=1000):
+        self.servers = {}
+        self.clients = {}
+        self.sessions = OrderedDict()
+        self.session_capacity = session_capacity
+        self.lock = Lock()
+
+    def __repr__(self):
+        return '<%s servers=%d clients=%d sessions=%d>' % (
+            self.__class__.__name__, len(self.servers), len(self.clients), len(self.sessions))
+
+    @staticmethod
+    def new_context(protocol, cert):
+        context = ssl.SSLContext(protocol)
+        tweak_context_options(context)
+        context.set_ciphers(ciphers)
+        if cert is not None:
+            load_cert(context, cert)
+        return context
+
+    def server_context(self, cert):
+        """Return the server context of the identity [cert]."""
+        with self.lock:
+            context = self.servers.get(cert)
+            if context is None:
+                context = self.servers[cert] = self.new_context(server_protocol, cert)
+            return context
+
+    def client_context(self, cert=None):
+        """Return the client context of the identity [cert], or an anonymous one."""
+        with self.lock:
+            context = self.clients.get(cert)
+            if context is None:
+                context = self.new_context(client_protocol, cert)
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                self.clients[cert] = context
+            return context
+
+    def wrap_client(self, sock, dest, cert=None):
+        """Wrap a socket connected to [dest], an AddrPort, and do the handshake,
+        resuming the last session with [dest] if there is one.
+        Returns the SSLSocket."""
+        context = self.client_context(cert)
+        if not resumption:
+            return context.wrap_socket(sock)
+        with self.lock:
+            session = self.sessions.get((context, dest))
+        try:
+            ssl_sock = context.wrap_socket(sock, session=session)
+        except (ssl.SSLError, ValueError):
+            if session is None:
+                raise
+            # The session was rejected outright, or does not fit the context.
+            # Forget it, so that the next connection starts over.
+            self.forget(dest, cert)
+            raise
+        self.save_session(dest, ssl_sock)
+        return ssl_sock
+
+    def save_session(self, dest, ssl_sock):
+        """Remember the session of [ssl_sock] for [dest]. With TLS 1.3, the session
+        ticket arrives after the handshake, so call this again once some data
+        has been read, or before closing the socket."""
+        if not resumption:
+            return
+        session = ssl_sock.session
+        if session is None or not session.has_ticket and not session.id:
+            return
+        key = (ssl_sock.context, dest)
+        with self.lock:
+            self.sessions[key] = session
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.session_capacity:
+                self.sessions.popitem(last=False)
+
+    def forget(self, dest, cert=None):
+        """Forget the session with [dest] of the identity [cert]."""
+        context = self.client_context(cert)
+        with self.lock:
+            self.sessions.pop((context, dest), None)
+
+
 def main():
     public, secret = make_cert()
     with open('public.pem', 'wb') as f:
@@ -108,4 +301,4 @@ if __name__ == '__main__':
     main()
 
 
-__all__ = ['make_cert', 'ciphers', 'tweak_context_options']
+__all__ = ['make_cert', 'CertPool', 'ContextFactory', 'ciphers', 'tweak_context_options']
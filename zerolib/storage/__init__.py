@@ -1 +1,7 @@
-from .locks import *
+from .._lazy import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, {
+    'locks': ['RWLock', 'LockManager'],
+    'asynclocks': ['AsyncRWLock'],
+    'store': ['SiteStore'],
+})
@@ -0,0 +1,120 @@
+"""The asyncio counterpart of locks.RWLock. It lives in its own module, so
+that the thread locks do not import asyncio."""
+import asyncio
+from collections import deque
+try:
+    from asyncio import get_running_loop
+except ImportError:
+    # Python < 3.7, where get_event_loop() returns the running loop in a coroutine
+    from asyncio import get_event_loop as get_running_loop
+
+
+class AsyncRWLock(object):
+    """The asyncio counterpart of RWLock, for coroutines sharing one event loop.
+    Waiting coroutines are served in order. A reader arriving after a waiting
+    writer waits behind it, while consecutive readers at the head of the line
+    are let in together. A cancelled or timed out acquisition leaves the lock
+    as if it had never been attempted. Reads are not reentrant, because the
+    lock cannot tell which task holds them."""
+    __slots__ = ('num_readers', 'writing', 'waiters')
+
+    def __init__(self):
+        self.num_readers = 0
+        self.writing = False
+        self.waiters = deque()
+
+    def __repr__(self):
+        return '<%s readers=%d writing=%r waiters=%d>' % (
+            self.__class__.__name__, self.num_readers, self.writing, len(self.waiters))
+
+    def _grant(self, mode):
+        if mode == 'r':
+            self.num_readers += 1
+        else:
+            self.writing = True
+
+    def _wake(self):
+        waiters = self.waiters
+        while waiters and not self.writing:
+            mode, future = waiters[0]
+            if future.done():
+                waiters.popleft()
+                continue
+            if mode == 'w' and self.num_readers:
+                break
+            waiters.popleft()
+            self._grant(mode)
+            future.set_result(True)
+
+    async def acquire(self, mode, timeout=None):
+        """Acquire the lock for reading ('r') or writing ('w').
+        Returns False if [timeout] seconds pass before the lock is acquired."""
+        if mode not in ('r', 'w'):
+            raise ValueError('Wrong mode')
+        if not self.waiters and not self.writing and (mode == 'r' or not self.num_readers):
+            self._grant(mode)
+            return True
+
+        future = get_running_loop().create_future()
+        self.waiters.append((mode, future))
+        try:
+            await asyncio.wait([future], timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(mode, future)
+            raise
+        if future.done():
+            return True
+        self._abandon(mode, future)
+        return False
+
+    def _abandon(self, mode, future):
+        if future.done() and not future.cancelled():
+            # Granted at the last moment. Give it back.
+            self.release(mode)
+        else:
+            future.cancel()
+            self._wake()
+
+    def release(self, mode):
+        if mode == 'r':
+            if self.num_readers == 0:
+                raise ValueError('Lock released too many times')
+            self.num_readers -= 1
+        elif mode == 'w':
+            if not self.writing:
+                raise ValueError('Lock released too many times')
+            self.writing = False
+        else:
+            raise ValueError('Wrong mode')
+        self._wake()
+
+    def read(self, timeout=None):
+        """Asynchronous context manager holding the lock for reading.
+        Raises: TimeoutError"""
+        return AsyncHold(self, 'r', timeout)
+
+    def write(self, timeout=None):
+        """Asynchronous context manager holding the lock for writing.
+        Raises: TimeoutError"""
+        return AsyncHold(self, 'w', timeout)
+
+
+class AsyncHold(object):
+    """Returned by AsyncRWLock.read() and write(), for use with [async with]."""
+    __slots__ = ('lock', 'mode', 'timeout')
+
+    def __init__(self, lock, mode, timeout):
+        self.lock = lock
+        self.mode = mode
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        if not await self.lock.acquire(self.mode, self.timeout):
+            raise TimeoutError('Cannot acquire the lock in %g seconds' % self.timeout)
+        return self.lock
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.lock.release(self.mode)
+
+
+__all__ = ['AsyncRWLock']
@@ -1,45 +1,94 @@
-from threading import Lock
+from threading import Condition, Lock, get_ident
 from contextlib import contextmanager
 
 class RWLock(object):
-    __slots__ = ('lock_ct', 'lock_r', 'lock_q', 'num_readers')
+    """Readers-writer lock with writer preference.
+    Any number of readers may hold the lock at the same time, while a writer
+    holds it alone. Once a writer is waiting, new readers wait behind it, so
+    that a steady stream of readers cannot starve writers.
+    Reads are reentrant: a thread which already holds a read lock may take
+    it again, even when a writer is waiting. Writes are not reentrant, and
+    a read lock cannot be upgraded to a write lock."""
+    __slots__ = ('cond', 'readers', 'num_readers', 'owner', 'waiting_writers')
 
     def __init__(self):
-        self.lock_ct = Lock()
-        self.lock_r = Lock()
-        self.lock_q = Lock()
+        self.cond = Condition(Lock())
+        self.readers = {}
         self.num_readers = 0
+        self.owner = None
+        self.waiting_writers = 0
 
-    def begin_read(self):
-        with self.lock_q:
-            with self.lock_ct:
-                if self.num_readers == 0:
-                    self.lock_r.acquire()
-                self.num_readers += 1
+    def __repr__(self):
+        return '<%s readers=%d owner=%r waiting_writers=%d>' % (
+            self.__class__.__name__, self.num_readers, self.owner, self.waiting_writers)
 
-    def begin_write(self):
-        with self.lock_q:
-            self.lock_r.acquire()
+    def _can_read(self, me):
+        if self.owner is not None:
+            return False
+        return not self.waiting_writers or me in self.readers
+
+    def _can_write(self):
+        return self.owner is None and not self.num_readers
+
+    def begin_read(self, blocking=True, timeout=-1):
+        me = get_ident()
+        with self.cond:
+            if not self._can_read(me):
+                if not blocking:
+                    return False
+                if not self.cond.wait_for(lambda: self._can_read(me), None if timeout < 0 else timeout):
+                    return False
+            self.readers[me] = self.readers.get(me, 0) + 1
+            self.num_readers += 1
+            return True
+
+    def begin_write(self, blocking=True, timeout=-1):
+        me = get_ident()
+        with self.cond:
+            if not self._can_write():
+                if not blocking:
+                    return False
+                self.waiting_writers += 1
+                try:
+                    acquired = self.cond.wait_for(self._can_write, None if timeout < 0 else timeout)
+                finally:
+                    self.waiting_writers -= 1
+                if not acquired:
+                    # Readers queued behind this writer may go now
+                    self.cond.notify_all()
+                    return False
+            self.owner = me
+            return True
 
     def end_read(self):
-        with self.lock_ct:
-            if self.num_readers == 0:
+        me = get_ident()
+        with self.cond:
+            count = self.readers.get(me, 0)
+            if count == 0:
                 raise ValueError('Lock released too many times')
+            if count == 1:
+                del self.readers[me]
+            else:
+                self.readers[me] = count - 1
             self.num_readers -= 1
             if self.num_readers == 0:
-                self.lock_r.release()
+                self.cond.notify_all()
 
     def end_write(self):
-        self.lock_r.release()
-
+        with self.cond:
+            if self.owner != get_ident():
+                raise ValueError('Write lock not held by this thread')
+            self.owner = None
+            self.cond.notify_all()
 
-    def acquire(self, mode):
+    def acquire(self, mode, blocking=True, timeout=-1):
+        """Acquire the lock for reading ('r') or writing ('w').
+        If [blocking] is False, or [timeout] seconds pass, returns False
+        instead of waiting."""
         if mode == 'r':
-            self.begin_read()
-            return True
+            return self.begin_read(blocking, timeout)
         elif mode == 'w':
-            self.begin_write()
-            return True
+            return self.begin_write(blocking, timeout)
         else:
             raise ValueError('Wrong mode')
 
@@ -52,13 +101,84 @@ class RWLock(object):
             raise ValueError('Wrong mode')
 
     @contextmanager
+    def _hold(self, mode, timeout):
+        if not self.acquire(mode, timeout=timeout):
+            raise TimeoutError('Cannot acquire the lock in %g seconds' % timeout)
+        try:
+            yield self
+        finally:
+            self.release(mode)
+
+    def read(self, timeout=-1):
+        """Context manager holding the lock for reading.
+        Raises: TimeoutError"""
+        return self._hold('r', timeout)
+
+    def write(self, timeout=-1):
+        """Context manager holding the lock for writing.
+        Raises: TimeoutError"""
+        return self._hold('w', timeout)
+
     def reader(self):
-        self.acquire('r')
-        yield self
-        self.release('r')
+        return self.read()
 
-    @contextmanager
     def writer(self):
-        self.acquire('w')
-        yield self
-        self.release('w')
+        return self.write()
+
+
+class LockManager(object):
+    """Per-file locks for site storage, backed by a fixed pool of [num_stripes]
+    RWLocks. A file (site, inner_path) is guarded by the lock at index
+    hash((site, inner_path)) % num_stripes, so unrelated files rarely share a lock
+    and memory use does not grow with the number of files.
+    Files that must change together, like a content.json and its files, should be
+    locked in one call: stripes are then taken once each, in ascending order,
+    so that two callers can never deadlock each other."""
+    __slots__ = ('stripes',)
+
+    def __init__(self, num_stripes=64):
+        if num_stripes < 1:
+            raise ValueError('At least one stripe is needed')
+        self.stripes = tuple(RWLock() for i in range(num_stripes))
+
+    def __repr__(self):
+        return '<%s stripes=%d>' % (self.__class__.__name__, len(self.stripes))
+
+    def stripe(self, site, inner_path):
+        return hash((site, inner_path)) % len(self.stripes)
+
+    def __getitem__(self, key):
+        """Return the RWLock guarding [key], a (site, inner_path) pair."""
+        return self.stripes[self.stripe(*key)]
+
+    def locks_for(self, site, inner_paths):
+        """Return the locks guarding [inner_paths], without duplicates and in
+        the order they must be acquired."""
+        indexes = sorted({self.stripe(site, inner_path) for inner_path in inner_paths})
+        return [self.stripes[i] for i in indexes]
+
+    @contextmanager
+    def _hold(self, mode, site, inner_paths, timeout):
+        held = []
+        try:
+            for lock in self.locks_for(site, inner_paths):
+                if not lock.acquire(mode, timeout=timeout):
+                    raise TimeoutError('Cannot acquire the lock in %g seconds' % timeout)
+                held.append(lock)
+            yield self
+        finally:
+            for lock in reversed(held):
+                lock.release(mode)
+
+    def read(self, site, *inner_paths, timeout=-1):
+        """Context manager holding the locks of [inner_paths] for reading.
+        Raises: TimeoutError"""
+        return self._hold('r', site, inner_paths, timeout)
+
+    def write(self, site, *inner_paths, timeout=-1):
+        """Context manager holding the locks of [inner_paths] for writing.
+        Raises: TimeoutError"""
+        return self._hold('w', site, inner_paths, timeout)
+
+
+__all__ = ['RWLock', 'LockManager']
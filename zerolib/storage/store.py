@@ -0,0 +1,323 @@
+import mmap
+import os
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from threading import Condition, Lock
+from ..integrity.hashing import verify_digest_file
+from ..protocol.packets import RespFile
+from .locks import LockManager
+
+if hasattr(os, 'pread'):
+    def _pread(fd, size, offset):
+        return os.pread(fd, size, offset)
+
+    def _pwrite(fd, data, offset):
+        return os.pwrite(fd, data, offset)
+else:
+    _seek_lock = Lock()
+
+    def _pread(fd, size, offset):
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, size)
+
+    def _pwrite(fd, data, offset):
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.write(fd, data)
+
+
+class Ranges(object):
+    """A set of byte ranges, kept as sorted, merged [start, end) pairs."""
+    __slots__ = ['starts', 'ends']
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, start, end):
+        if start >= end:
+            return
+        starts, ends = self.starts, self.ends
+        # Ranges that overlap or touch [start, end) are merged into it
+        i = bisect_left(ends, start)
+        j = bisect_right(starts, end)
+        if i < j:
+            start = min(start, starts[i])
+            end = max(end, ends[j - 1])
+        starts[i:j] = [start]
+        ends[i:j] = [end]
+
+    def missing(self, total):
+        """Return the [start, end) pairs of range(0, total) that are not in the set."""
+        gaps = []
+        position = 0
+        for (start, end) in zip(self.starts, self.ends):
+            if start > position:
+                gaps.append((position, min(start, total)))
+            position = max(position, end)
+        if position < total:
+            gaps.append((position, total))
+        return gaps
+
+    def __len__(self):
+        """Number of bytes in the set."""
+        return sum(self.ends) - sum(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+
+class PartialFile(object):
+    """A file being downloaded into a preallocated [.part] file.
+    [writers] counts the writes in progress, which must end before [fd] is closed."""
+    __slots__ = ['fd', 'path', 'total_size', 'received', 'writers']
+
+    def __init__(self, fd, path, total_size):
+        self.fd = fd
+        self.path = path
+        self.total_size = total_size
+        self.received = Ranges()
+        self.writers = 0
+
+    def __repr__(self):
+        return '<%s %r %d/%d>' % (self.__class__.__name__, self.path, len(self.received), self.total_size)
+
+    @property
+    def complete(self):
+        return not self.received.missing(self.total_size)
+
+
+class SiteStore(object):
+    """Stores site files under [root], as [root]/[site]/[inner_path].
+    Ranged reads, as requested by [getFile], are served with os.pread, or from
+    a shared mmap for files of at least [mmap_threshold] bytes.
+    Downloaded chunks are written with os.pwrite into a preallocated sparse
+    [.part] file, which replaces the real file once complete and verified.
+    Readers and the final rename are guarded by the locks of [locks],
+    a LockManager."""
+    __slots__ = ['root', 'locks', 'mmap_threshold', 'partial', 'partial_lock', 'maps', 'maps_lock']
+    chunk_size = 512 * 1024
+    mmap_capacity = 64
+
+    def __init__(self, root, locks=None, mmap_threshold=1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.locks = locks if locks is not None else LockManager()
+        self.mmap_threshold = mmap_threshold
+        self.partial = {}
+        # Notified when the last write to a PartialFile ends
+        self.partial_lock = Condition(Lock())
+        self.maps = OrderedDict()
+        self.maps_lock = Lock()
+
+    def __repr__(self):
+        return '<%s %r partial=%d>' % (self.__class__.__name__, self.root, len(self.partial))
+
+    def path(self, site, inner_path):
+        """Return the path of a site file.
+        Raises: ValueError if [site] is not a directory right under the root,
+        or if [inner_path] escapes the site directory"""
+        site_dir = os.path.normpath(os.path.join(self.root, site))
+        if os.path.dirname(site_dir) != self.root:
+            raise ValueError('Site %r escapes the store' % site)
+        path = os.path.normpath(os.path.join(site_dir, inner_path))
+        if not path.startswith(site_dir + os.sep):
+            raise ValueError('Inner path %r escapes the site directory' % inner_path)
+        return path
+
+    ##### Reading #####
+
+    def read_range(self, site, inner_path, offset=0, size=None):
+        """Read at most [size] bytes from [offset]. [size] defaults to chunk_size.
+        Returns (data, total_size)
+        Raises: OSError, ValueError"""
+        size = self.chunk_size if size is None else size
+        path = self.path(site, inner_path)
+        with self.locks.read(site, inner_path):
+            fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                total_size = os.fstat(fd).st_size
+                if offset > total_size:
+                    raise ValueError('Offset out of range. %d > %d' % (offset, total_size))
+                if total_size >= self.mmap_threshold:
+                    data = self._map(path, fd)[offset:offset + size]
+                else:
+                    data = _pread(fd, size, offset)
+            finally:
+                os.close(fd)
+        return (data, total_size)
+
+    def _map(self, path, fd):
+        # Called with the read lock of [path] held, so the file cannot be replaced
+        with self.maps_lock:
+            mapped = self.maps.get(path)
+            if mapped is not None:
+                self.maps.move_to_end(path)
+                return mapped
+            mapped = self.maps[path] = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            while len(self.maps) > self.mmap_capacity:
+                # A reader may still hold an evicted map, which stays valid until collected
+                self.maps.popitem(last=False)
+            return mapped
+
+    def _unmap(self, path):
+        with self.maps_lock:
+            mapped = self.maps.pop(path, None)
+        if mapped is not None:
+            mapped.close()
+
+    def serve(self, request):
+        """Build the RespFile response of a GetFile [request].
+        Raises: OSError, ValueError"""
+        data, total_size = self.read_range(request.site, request.inner_path, request.offset)
+        if request.total_size is not None and request.total_size != total_size:
+            raise ValueError('File size does not match - should be %r, found %r' % (request.total_size, total_size))
+
+        response = RespFile()
+        response.req_id = request.req_id
+        response.sender = request.sender
+        response.site = request.site
+        response.inner_path = request.inner_path
+        response.total_size = total_size
+        response.body = data
+        response.last_byte_offset = request.offset + len(data) - 1
+        return response
+
+    ##### Writing #####
+
+    def begin(self, site, inner_path, total_size):
+        """Start downloading a file of [total_size] bytes. Does nothing if the
+        download has already begun. Returns the PartialFile."""
+        key = (site, inner_path)
+        with self.partial_lock:
+            partial = self.partial.get(key)
+            if partial is not None:
+                if partial.total_size != total_size:
+                    raise ValueError('File size does not match - should be %r, found %r' % (partial.total_size, total_size))
+                return partial
+
+            path = self.path(site, inner_path) + '.part'
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+            try:
+                # Sparse on most file systems, so no data is written here
+                os.ftruncate(fd, total_size)
+            except OSError:
+                os.close(fd)
+                raise
+            partial = self.partial[key] = PartialFile(fd, path, total_size)
+            return partial
+
+    def write_chunk(self, site, inner_path, offset, data):
+        """Write [data] at [offset] of a file being downloaded.
+        Chunks may arrive in any order and from several threads. A download
+        that is aborted or finished meanwhile waits for the write to end.
+        Returns True if the file is now complete.
+        Raises: KeyError if the download has not begun or has ended, ValueError"""
+        end = offset + len(data)
+        with self.partial_lock:
+            partial = self.partial[(site, inner_path)]
+            if offset < 0 or end > partial.total_size:
+                raise ValueError('Chunk out of range. %d > %d' % (end, partial.total_size))
+            partial.writers += 1
+
+        try:
+            view = memoryview(data)
+            while view:
+                written = _pwrite(partial.fd, view, offset)
+                view, offset = view[written:], offset + written
+        except BaseException:
+            with self.partial_lock:
+                self._end_write(partial)
+            raise
+
+        with self.partial_lock:
+            self._end_write(partial)
+            partial.received.add(end - len(data), end)
+            return partial.complete
+
+    def _end_write(self, partial):
+        partial.writers -= 1
+        if not partial.writers:
+            self.partial_lock.notify_all()
+
+    def write_packet(self, response):
+        """Write the body of a RespFile [response], whose [site] and [inner_path]
+        have been filled by PacketInterp. Returns True if the file is now complete."""
+        self.begin(response.site, response.inner_path, response.total_size)
+        return self.write_chunk(response.site, response.inner_path, response.offset, response.body)
+
+    def missing(self, site, inner_path):
+        """Return the [start, end) byte ranges of a download not received yet."""
+        with self.partial_lock:
+            partial = self.partial[(site, inner_path)]
+            return partial.received.missing(partial.total_size)
+
+    def finish(self, site, inner_path, expect_digest=None, algo='sha512'):
+        """Complete a download: verify the [.part] file against [expect_digest]
+        if given, then atomically move it in place of the real file.
+        The download is aborted if verification fails.
+        Returns the path of the file.
+        Raises: ValueError if ranges are missing, DigestError"""
+        key = (site, inner_path)
+        with self.partial_lock:
+            partial = self.partial[key]
+            if not partial.complete:
+                raise ValueError('Download incomplete. %d bytes missing' % (partial.total_size - len(partial.received)))
+            del self.partial[key]
+            self.partial_lock.wait_for(lambda: not partial.writers)
+
+        try:
+            os.fsync(partial.fd)
+        finally:
+            os.close(partial.fd)
+        try:
+            if expect_digest is not None:
+                verify_digest_file(partial.path, expect_digest, partial.total_size, algo)
+        except BaseException:
+            os.unlink(partial.path)
+            raise
+
+        path = self.path(site, inner_path)
+        with self.locks.write(site, inner_path):
+            self._unmap(path)
+            os.replace(partial.path, path)
+        return path
+
+    def abort(self, site, inner_path):
+        """Give up a download and delete its [.part] file, once the writes
+        in progress have ended."""
+        with self.partial_lock:
+            partial = self.partial.pop((site, inner_path), None)
+            if partial is not None:
+                self.partial_lock.wait_for(lambda: not partial.writers)
+        if partial is not None:
+            os.close(partial.fd)
+            try:
+                os.unlink(partial.path)
+            except FileNotFoundError:
+                pass
+
+    def write_file(self, site, inner_path, data):
+        """Atomically replace a whole site file with [data]. Returns the path of the file."""
+        self.begin(site, inner_path, len(data))
+        try:
+            self.write_chunk(site, inner_path, 0, data)
+        except BaseException:
+            self.abort(site, inner_path)
+            raise
+        return self.finish(site, inner_path)
+
+    def close(self):
+        """Abort every download and release the shared maps."""
+        with self.partial_lock:
+            keys = list(self.partial)
+        for (site, inner_path) in keys:
+            self.abort(site, inner_path)
+        with self.maps_lock:
+            maps, self.maps = self.maps, OrderedDict()
+        for mapped in maps.values():
+            mapped.close()
+
+
+__all__ = ['SiteStore']
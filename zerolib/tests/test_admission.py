@@ -0,0 +1,163 @@
+import unittest
+import msgpack
+from zerolib.nettools import Admission, BaseServer, FairQueue, TokenBuckets, packet_cost
+from zerolib.protocol.packets import GetFile, ListMod, Ping, Pong, Predicate, unpack, unpack_dict
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make(cls, sender, req_id=1, **attrs):
+    packet = cls()
+    packet.sender = sender
+    packet.req_id = req_id
+    for (k, v) in attrs.items():
+        setattr(packet, k, v)
+    return packet
+
+
+class TestTokenBuckets(unittest.TestCase):
+    def test_refill(self):
+        buckets = TokenBuckets(rate=10, burst=20, capacity=2)
+        self.assertEqual(buckets.available('a', 0), 20)
+        buckets.take('a', 15, 0)
+        self.assertEqual(buckets.available('a', 0), 5)
+        self.assertEqual(buckets.available('a', 1), 15)
+        self.assertEqual(buckets.available('a', 100), 20)
+        buckets.take('b', 1, 0)
+        buckets.take('c', 1, 0)
+        # The least recently used bucket is forgotten
+        self.assertEqual(len(buckets), 2)
+        self.assertEqual(buckets.available('a', 0), 20)
+
+    def test_cost(self):
+        self.assertEqual(packet_cost(make(Ping, 'a')), 1)
+        self.assertEqual(packet_cost(make(ListMod, 'a')), 4)
+        self.assertEqual(packet_cost(make(GetFile, 'a', offset=0, total_size=None)), 9)
+        self.assertEqual(packet_cost(make(GetFile, 'a', offset=0, total_size=64 * 1024)), 2)
+        self.assertEqual(packet_cost(make(GetFile, 'a', offset=100, total_size=100)), 1)
+
+
+class TestFairQueue(unittest.TestCase):
+    def test_round_robin(self):
+        queue = FairQueue(quantum=1)
+        for i in range(4):
+            queue.push('a', 'a%d' % i, 1)
+        queue.push('b', 'b0', 1)
+        queue.push('b', 'b1', 1)
+        self.assertEqual(len(queue), 6)
+        order = [queue.pop() for i in range(6)]
+        self.assertEqual(order, ['a0', 'b0', 'a1', 'b1', 'a2', 'a3'])
+        self.assertIsNone(queue.pop())
+        self.assertEqual(len(queue), 0)
+
+    def test_costs(self):
+        # Expensive items wait for enough credits, cheap ones go first
+        queue = FairQueue(quantum=2)
+        for i in range(3):
+            queue.push('big', 'big%d' % i, 4)
+        for i in range(6):
+            queue.push('small', 'small%d' % i, 1)
+        order = [queue.pop() for i in range(9)]
+        # Both get the same credits per round: 2 small ones for half a big one
+        self.assertEqual(order, ['small0', 'small1', 'big0', 'small2', 'small3', 'small4', 'small5', 'big1', 'big2'])
+
+    def test_full(self):
+        queue = FairQueue(max_queue=2)
+        queue.push('a', 1, 1)
+        self.assertFalse(queue.full('a'))
+        queue.push('a', 2, 1)
+        self.assertTrue(queue.full('a'))
+        self.assertFalse(queue.full('b'))
+
+
+class TestAdmission(unittest.TestCase):
+    def test_rate_limit(self):
+        clock = Clock()
+        admission = Admission(peer_rate=10, peer_burst=5, max_queue=100, clock=clock)
+        responses = [admission.push(make(Ping, 'flood', i)) for i in range(8)]
+        self.assertEqual(responses[0:5], [None] * 5)
+        refused = responses[5]
+        self.assertIsInstance(refused, Predicate)
+        self.assertEqual((refused.req_id, refused.sender, refused.ok, refused.error), (5, 'flood', False, 'Rate limit exceeded'))
+
+        # Others are not affected, and the bucket refills
+        self.assertIsNone(admission.push(make(Ping, 'other')))
+        clock.now += 0.1
+        self.assertIsNone(admission.push(make(Ping, 'flood')))
+        self.assertIsNotNone(admission.push(make(Ping, 'flood')))
+
+        # ListMod has a tighter limit of its own
+        admission = Admission(peer_burst=100, command_limits={ListMod: (1, 4)}, clock=clock)
+        self.assertIsNone(admission.push(make(ListMod, 'lister')))
+        self.assertEqual(admission.push(make(ListMod, 'lister')).error, 'Rate limit exceeded for ListMod')
+        self.assertIsNone(admission.push(make(Ping, 'lister')))
+
+        # Responses are not rate limited
+        for i in range(10):
+            self.assertIsNone(admission.push(make(Pong, 'flood')))
+
+    def test_response_flood(self):
+        admission = Admission(quantum=1, max_queue=64)
+        results = [admission.push(make(Pong, 'flood', i)) for i in range(1000)]
+        # Responses count against max_queue, and are dropped past it
+        self.assertEqual(results.count(None), 64)
+        self.assertEqual(results.count(False), 1000 - 64)
+        self.assertIsNone(admission.push(make(Ping, 'other')))
+        order = []
+        while True:
+            packet = admission.pop()
+            if packet is None:
+                break
+            order.append(packet.sender)
+        self.assertLess(order.index('other'), 2)
+
+    def test_queue_full(self):
+        admission = Admission(max_queue=2)
+        admission.push(make(Ping, 'a'))
+        admission.push(make(Ping, 'a'))
+        self.assertEqual(admission.push(make(Ping, 'a')).error, 'Too many pending requests')
+        admission.pop()
+        self.assertIsNone(admission.push(make(Ping, 'a')))
+
+    def test_server(self):
+        server = BaseServer(metrics=True, admission=Admission(peer_burst=2, quantum=1))
+        ping = msgpack.packb({'cmd': 'ping', 'req_id': 1, 'params': {}})
+        for i in range(2):
+            self.assertIsNone(server.submit(unpack(ping, 'a')))
+        self.assertIsNone(server.submit(unpack(ping, 'b')))
+        refused = server.submit(unpack(ping, 'a'))
+        self.assertEqual(unpack(bytes(refused)).error, 'Rate limit exceeded')
+        senders = []
+        while True:
+            item = server.handle_next()
+            if item is None:
+                break
+            packet, response = item
+            self.assertIsInstance(response, Pong)
+            senders.append(packet.sender)
+        self.assertEqual(senders, ['a', 'b', 'a'])
+        self.assertEqual(server.metrics.snapshot()['errors'], {'Refused': 1})
+
+        # A response nobody asked for is dropped
+        port = msgpack.packb({'cmd': 'response', 'to': 5, 'status': 'open', 'ip_external': '1.2.3.4'})
+        self.assertIs(server.submit(unpack(port, 'a')), False)
+        self.assertEqual(server.metrics.snapshot()['errors'], {'Refused': 1, 'Dropped': 1})
+
+
+class TestPredicate(unittest.TestCase):
+    def test_pack(self):
+        ok = unpack_dict({b'cmd': b'response', b'to': 1, b'ok': b'Updated'})
+        self.assertEqual((ok.ok, ok.error), (True, None))
+        error = unpack_dict({b'cmd': b'response', b'to': 1, b'error': b'Unknown site'})
+        self.assertEqual((error.ok, error.error), (False, 'Unknown site'))
+
+        response = Predicate()
+        response.req_id = 2
+        response.sender = None
+        self.assertTrue(unpack(bytes(response)).ok)
@@ -0,0 +1,75 @@
+import unittest
+import msgpack
+from zerolib.bench.__main__ import calibration, compare
+from zerolib.bench.corpus import make_packets
+from zerolib.protocol.packets import unpack_dict
+
+
+class TestBench(unittest.TestCase):
+    def test_corpus(self):
+        packets = make_packets()
+        self.assertEqual(msgpack.packb(packets, use_bin_type=True), msgpack.packb(make_packets(), use_bin_type=True))
+        for (name, packet) in packets.items():
+            raw = msgpack.unpackb(msgpack.packb(packet, use_bin_type=True), raw=True, strict_map_key=False)
+            with self.subTest(name=name):
+                unpack_dict(raw)
+
+    def test_compare(self):
+        baseline = {
+            'parse': {'value': 10.0, 'unit': 'us'},
+            'handshakes': {'value': 100.0, 'unit': '/s'},
+            'footprint': {'value': 5.0, 'unit': 'MiB'},
+        }
+        same = {name: dict(entry) for (name, entry) in baseline.items()}
+        self.assertEqual(compare(same, baseline, 0.25), [])
+
+        worse = {
+            'parse': {'value': 13.0, 'unit': 'us'},
+            'handshakes': {'value': 70.0, 'unit': '/s'},
+            'footprint': {'value': 6.0, 'unit': 'MiB'},
+            'new': {'value': 1.0, 'unit': 'us'},
+        }
+        self.assertEqual(compare(worse, baseline, 0.25),
+            [('handshakes', 100.0, 70.0, '/s'), ('parse', 10.0, 13.0, 'us')])
+
+        better = {
+            'parse': {'value': 1.0, 'unit': 'us'},
+            'handshakes': {'value': 1000.0, 'unit': '/s'},
+        }
+        self.assertEqual(compare(better, baseline, 0.25), [])
+
+    def test_calibration(self):
+        baseline = {
+            calibration: {'value': 100.0, 'unit': 'us', 'informational': True},
+            'parse': {'value': 10.0, 'unit': 'us'},
+            'handshakes': {'value': 100.0, 'unit': '/s'},
+            'footprint': {'value': 5.0, 'unit': 'MiB'},
+            'frozenset union': {'value': 1.0, 'unit': 'ms', 'informational': True},
+        }
+        # Twice as slow a machine
+        slower = {
+            calibration: {'value': 200.0, 'unit': 'us', 'informational': True},
+            'parse': {'value': 22.0, 'unit': 'us'},
+            'handshakes': {'value': 45.0, 'unit': '/s'},
+            'footprint': {'value': 5.0, 'unit': 'MiB'},
+            'frozenset union': {'value': 10.0, 'unit': 'ms', 'informational': True},
+        }
+        self.assertEqual(compare(slower, baseline, 0.25), [])
+
+        # Twice as fast a machine, where the same values are regressions
+        faster = dict(slower)
+        faster[calibration] = {'value': 50.0, 'unit': 'us', 'informational': True}
+        self.assertEqual(compare(faster, baseline, 0.25),
+            [('handshakes', 200.0, 45.0, '/s'), ('parse', 5.0, 22.0, 'us')])
+
+    def test_raw(self):
+        baseline = {
+            calibration: {'value': 100.0, 'unit': 'us', 'informational': True},
+            'parse': {'value': 10.0, 'unit': 'us'},
+        }
+        slower = {
+            calibration: {'value': 200.0, 'unit': 'us', 'informational': True},
+            'parse': {'value': 20.0, 'unit': 'us'},
+        }
+        self.assertEqual(compare(slower, baseline, 0.25), [])
+        self.assertEqual(compare(slower, baseline, 0.25, raw=True), [('parse', 10.0, 20.0, 'us')])
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+import msgpack
+from io import BytesIO
+from ipaddress import IPv4Address, IPv6Address
+from zerolib.nettools import BaseServer, CaptureWriter, read_capture, replay
+from zerolib.nettools.capture import main
+from zerolib.protocol.packets import AddrPort, OnionAddress
+
+ping = msgpack.packb({'cmd': 'ping', 'req_id': 1, 'params': {}})
+port = msgpack.packb({'cmd': 'response', 'to': 1, 'status': 'open', 'ip_external': '1.2.3.4'})
+
+
+class TestCapture(unittest.TestCase):
+    def test_round_trip(self):
+        senders = [
+            None, 'peer',
+            AddrPort(IPv4Address('1.2.3.4'), 15441),
+            AddrPort(IPv6Address('::1'), 1),
+            AddrPort(OnionAddress('3g2upl4pq6kufc4m.onion'), 80),
+        ]
+        f = BytesIO()
+        with CaptureWriter(f) as writer:
+            for (i, sender) in enumerate(senders):
+                writer.write(ping, sender, timestamp=1000.0 + i)
+        self.assertEqual(writer.count, len(senders))
+
+        frames = list(read_capture(BytesIO(f.getvalue())))
+        self.assertEqual([frame.sender for frame in frames], senders)
+        self.assertEqual([frame.timestamp for frame in frames], [1000.0 + i for i in range(len(senders))])
+        self.assertTrue(all(frame.data == ping for frame in frames))
+
+        with self.assertRaises(IOError):
+            list(read_capture(BytesIO(f.getvalue()[0:-1])))
+        with self.assertRaises(ValueError):
+            list(read_capture(BytesIO(b'not a capture')))
+
+    def test_other_senders(self):
+        class Peer(object):
+            def __repr__(self):
+                return '<Peer>'
+
+        f = BytesIO()
+        with CaptureWriter(f) as writer:
+            writer.write(ping, ('1.2.3.4', 15441))
+            writer.write(ping, ('::1', 1, 0, 0))
+            writer.write(ping, ('localhost', 80))
+            writer.write(ping, Peer())
+            writer.write(ping, AddrPort('1.2.3.4', 1))
+        frames = list(read_capture(BytesIO(f.getvalue())))
+        self.assertEqual([frame.sender for frame in frames], [
+            AddrPort(IPv4Address('1.2.3.4'), 15441),
+            AddrPort(IPv6Address('::1'), 1),
+            "('localhost', 80)",
+            '<Peer>',
+            "AddrPort(address='1.2.3.4', port=1)",
+        ])
+
+    def test_long_senders(self):
+        class Peer(object):
+            def __repr__(self):
+                return 'p' * 70000
+
+        f = BytesIO()
+        with CaptureWriter(f) as writer:
+            writer.write(ping, 'x' + '\u00e9' * 40000)
+            writer.write(ping, Peer())
+            writer.write(ping, '\ud800')
+        frames = list(read_capture(BytesIO(f.getvalue())))
+        self.assertEqual(frames[0].sender, 'x' + '\u00e9' * 32767)
+        self.assertEqual(frames[1].sender, 'p' * 0xffff)
+        self.assertEqual(frames[2].sender, '\\ud800')
+        self.assertEqual([frame.data for frame in frames], [ping] * 3)
+
+    def test_server_capture(self):
+        f = BytesIO()
+        writer = CaptureWriter(f)
+        server = BaseServer(capture=writer)
+        server.handle_bytes(ping, 'peer')
+        server.handle_bytes(ping)
+        writer.close()
+        frames = list(read_capture(BytesIO(f.getvalue())))
+        self.assertEqual([(frame.sender, frame.data) for frame in frames], [('peer', ping), (None, ping)])
+
+    def test_replay(self):
+        frames = [(1000.0, 'peer', ping), (1000.05, 'peer', port), (1000.1, None, b'\x81')]
+        result = replay(frames)
+        self.assertEqual(result.count, 3)
+        self.assertEqual(result.latency.count, 3)
+        self.assertGreater(result.throughput, 0)
+        # The response answers no request, and the last packet is truncated
+        self.assertEqual(result.errors, {'KeyError': 1, 'OSError': 1})
+        self.assertIn('3 packets', result.report())
+
+        result = replay(frames, paced=True, speed=2)
+        self.assertGreaterEqual(result.elapsed, 0.05)
+
+    def test_main(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            with CaptureWriter(path) as writer:
+                writer.write(ping)
+            main([path, '--repeat', '2'])
+        finally:
+            os.unlink(path)
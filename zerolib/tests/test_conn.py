@@ -0,0 +1,119 @@
+import unittest
+from random import Random
+from zerolib.nettools import Connections
+
+
+class MockSocket(object):
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+
+class TestConnections(unittest.TestCase):
+    def test_lfu(self):
+        pool = Connections(capacity=5)
+        for i in range(5):
+            pool.register(i, MockSocket(i))
+        for i in range(5):
+            for j in range(i):
+                pool[i]
+        self.assertEqual(pool[4].freq, 5)
+        self.assertEqual(tuple(pool[3]), (pool.sessions[3].socket, 4))
+
+        # 0 is the least frequently used
+        pool.register(5, MockSocket(5))
+        self.assertEqual(sorted(pool), [1, 2, 3, 4, 5])
+        self.assertEqual(len(pool), 5)
+
+        # 1 and 6 have been used once, but 1 has been used earlier
+        pool.register(6, MockSocket(6))
+        self.assertEqual(sorted(pool), [1, 2, 3, 4, 6])
+        pool[6]
+        pool.register(7, MockSocket(7))
+        self.assertEqual(sorted(pool), [2, 3, 4, 6, 7])
+
+    def test_delete(self):
+        pool = Connections(capacity=3)
+        for i in range(3):
+            pool.register(i, MockSocket(i))
+        pool[0]
+        pool[1]
+        del pool[2]
+        self.assertNotIn(2, pool)
+        pool.register(3, MockSocket(3))
+        pool.register(4, MockSocket(4))
+        self.assertEqual(sorted(pool), [0, 1, 4])
+
+    def test_clean_func(self):
+        seen = []
+        def clean_func(keys):
+            seen.append(sorted(keys))
+            return [k for k in keys if k % 2]
+
+        pool = Connections(capacity=4, clean_func=clean_func)
+        for i in range(4):
+            pool.register(i, MockSocket(i))
+            pool[i]
+        pool.register(4, MockSocket(4))
+        self.assertEqual(seen, [[0, 1, 2, 3]])
+        self.assertEqual(sorted(pool), [0, 2, 4])
+
+    def test_reap(self):
+        pool = Connections(idle_timeout=10)
+        for i in range(3):
+            pool.register(i, MockSocket(i))
+        pool.sessions[0].last_used -= 100
+        pool.sessions[1].last_used -= 100
+        pool[0]
+        reaped = pool.reap()
+        self.assertEqual([dest for (dest, conn) in reaped], [1])
+        self.assertEqual(sorted(pool), [0, 2])
+        self.assertEqual(pool.reap(), [])
+
+    def test_aging(self):
+        pool = Connections(capacity=3, aging_interval=8)
+        for i in range(3):
+            pool.register(i, MockSocket(i))
+        for j in range(7):
+            pool[0]
+        self.assertEqual(pool.sessions[0].freq, 7)
+        pool[1]
+        self.assertEqual(pool.sessions[0].freq, 3)
+        self.assertEqual(pool.sessions[1].freq, 0)
+        pool.register(3, MockSocket(3))
+        self.assertEqual(sorted(pool), [0, 1, 3])
+
+    def test_min_freq(self):
+        # Against a pool that searches every session, with removals from any bucket
+        rng = Random(0)
+        pool = Connections(capacity=1000, aging_interval=50)
+        order = []
+        for i in range(2000):
+            action = rng.random()
+            if action < 0.3 or not len(pool):
+                pool.register(i, MockSocket(i))
+                order.append(i)
+            elif action < 0.8:
+                key = rng.choice(order)
+                pool[key]
+                order.remove(key)
+                order.append(key)
+            elif action < 0.9:
+                key = rng.choice(order)
+                del pool[key]
+                order.remove(key)
+            else:
+                lowest = min(pool.sessions[dest].freq for dest in order)
+                dest, conn = pool.evict()
+                self.assertEqual(conn.freq, lowest)
+                order.remove(dest)
+            if len(pool):
+                self.assertEqual(pool.min_freq, min(conn.freq for conn in pool.sessions.values()))
+        while len(pool):
+            pool.evict()
+        self.assertIsNone(pool.min_freq)
+        self.assertEqual((pool.buckets, pool.higher, pool.lower), ({}, {}, {}))
+        with self.assertRaises(KeyError):
+            pool.evict()
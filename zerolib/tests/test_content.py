@@ -0,0 +1,98 @@
+import unittest
+import json
+import os
+from zerolib.protocol.content import Manifest, FileInfo
+
+test_data = os.path.dirname(__file__) + '/test_data'
+
+
+def entry(n, size):
+    return {'sha512': '%02x' % n * 32, 'size': size}
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.content = {
+            'modified': 1500000000,
+            'files': {
+                'index.html': entry(1, 100),
+                'js/all.js': entry(2, 200),
+                'js/lib/a.js': entry(3, 300),
+                'js/lib/b.js': entry(4, 400),
+                'jsx.html': entry(5, 500),
+                '../evil': entry(6, 600),
+                'bad/size': {'sha512': 'ab' * 32, 'size': -1},
+                'bad/digest': {'sha512': 'ab', 'size': 1},
+            },
+            'files_optional': {
+                'media/1.mp4': entry(0x12, 1000),
+                'media/2.mp4': entry(0x12, 2000),
+                'media/3.mp4': entry(0x34, 3000),
+            },
+            'includes': {
+                'data/users/content.json': {'signers': ['1TaLkFrMwvbNsooF4ioKAY9EuxTBTjipT'], 'signers_required': 1},
+            },
+        }
+        self.manifest = Manifest(self.content)
+
+    def test_lookup(self):
+        m = self.manifest
+        self.assertEqual(len(m), 8)
+        self.assertEqual(m.lookup('js/all.js'), FileInfo('sha512', b'\x02' * 32, None, 200, False))
+        self.assertEqual(m['media/3.mp4'], FileInfo('sha512', b'\x34' * 32, None, 3000, True))
+        self.assertIsNone(m.lookup('bad/size'))
+        self.assertIsNone(m.lookup('bad/digest'))
+        self.assertIsNone(m.lookup('../evil'))
+        self.assertNotIn('../evil', m)
+        with self.assertRaises(KeyError):
+            m['nothing']
+
+    def test_listdir(self):
+        m = self.manifest
+        self.assertEqual(m.listdir(), ['index.html', 'js/', 'jsx.html', 'media/'])
+        self.assertEqual(m.listdir('js'), ['all.js', 'lib/'])
+        self.assertEqual(m.listdir('js/lib/'), ['a.js', 'b.js'])
+        self.assertEqual(m.listdir('nothing'), [])
+        self.assertEqual(list(m.walk('js/')), ['js/all.js', 'js/lib/a.js', 'js/lib/b.js'])
+
+    def test_hash_index(self):
+        m = self.manifest
+        self.assertEqual(sorted(m.find_hash(b'\x12\x12')), ['media/1.mp4', 'media/2.mp4'])
+        self.assertEqual(m.find_hash(b'\x02\x02'), [])
+        self.assertEqual(m.hash_ids(), frozenset({b'\x12\x12', b'\x34\x34'}))
+
+    def test_includes(self):
+        include = self.manifest.includes['data/users/content.json']
+        self.assertEqual(include.signers, ('1TaLkFrMwvbNsooF4ioKAY9EuxTBTjipT',))
+        self.assertEqual(include.signers_required, 1)
+
+    def test_content_json(self):
+        with open(test_data + '/content.json', 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        m = Manifest(content)
+        self.assertEqual(len(m), len(content['files']) + len(content.get('files_optional', {})))
+        for (path, d) in content['files'].items():
+            self.assertEqual(m[path].digest.hex(), d['sha512'])
+            self.assertEqual(m[path].size, d['size'])
+
+
+class TestManifestDiff(unittest.TestCase):
+    def test_diff(self):
+        old = Manifest({
+            'files': {'a': entry(1, 1), 'b': entry(2, 2), 'c': entry(3, 3), 'd': entry(4, 4)},
+            'files_optional': {'o1': entry(5, 5), 'o2': entry(6, 6)},
+        })
+        new = Manifest({
+            'files': {'e': entry(9, 9), 'd': entry(4, 4), 'c': entry(3, 30), 'a': entry(7, 1), 'aa': entry(8, 8)},
+            'files_optional': {'o1': entry(5, 5), 'o2': entry(0, 6), 'o3': entry(7, 7)},
+        })
+        diff = new.diff(old)
+        self.assertTrue(diff)
+        self.assertEqual(diff.added, ['aa', 'e', 'o3'])
+        self.assertEqual(diff.removed, ['b'])
+        self.assertEqual(diff.changed, ['a', 'c', 'o2'])
+        self.assertEqual([p for (p, info) in diff.downloads()], ['a', 'aa', 'c', 'e'])
+        self.assertEqual([p for (p, info) in diff.downloads(optional=True)], ['a', 'aa', 'c', 'e', 'o2', 'o3'])
+        self.assertEqual(dict(diff.downloads())['c'].size, 30)
+
+        self.assertFalse(new.diff(new))
+        self.assertEqual(old.diff(new).removed, diff.added)
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from zerolib.integrity import digest_bytes, DigestError
+from zerolib.nettools import DownloadScheduler, DownloadError, download
+from zerolib.protocol.routing import Peer, PeerScorer
+from zerolib.storage import SiteStore
+
+
+class TestScheduler(unittest.TestCase):
+    def test_assign(self):
+        scheduler = DownloadScheduler(10, chunk_size=4, max_attempts=2, steal_after=5)
+        self.assertEqual([(c.offset, c.size) for c in scheduler.chunks], [(0, 4), (4, 4), (8, 2)])
+
+        a = scheduler.assign('a', now=0)
+        b = scheduler.assign('b', now=0)
+        c = scheduler.assign('c', now=1)
+        self.assertEqual((a.offset, b.offset, c.offset), (0, 4, 8))
+
+        # Failed chunks go to another peer
+        scheduler.fail('a', a)
+        self.assertIs(scheduler.assign('a', now=2), None)
+        self.assertIs(scheduler.assign('d', now=2), a)
+
+        # Slow chunks are stolen, and the first peer to finish writes them
+        self.assertIs(scheduler.assign('e', now=3), None)
+        self.assertIs(scheduler.assign('e', now=5), b)
+        self.assertTrue(scheduler.claim('e', b))
+        scheduler.complete('e', b)
+        self.assertFalse(scheduler.claim('b', b))
+
+        for (peer, chunk) in (('c', c), ('d', a)):
+            self.assertTrue(scheduler.claim(peer, chunk))
+            scheduler.complete(peer, chunk)
+        self.assertTrue(scheduler.done)
+
+    def test_max_attempts(self):
+        scheduler = DownloadScheduler(4, chunk_size=4, max_attempts=2)
+        scheduler.fail('a', scheduler.assign('a'))
+        scheduler.fail('b', scheduler.assign('b'))
+        self.assertIsInstance(scheduler.error, DownloadError)
+        self.assertIs(scheduler.assign('c'), None)
+
+    def test_wait_stolen(self):
+        class CountingScheduler(DownloadScheduler):
+            __slots__ = ['scans']
+
+            def assign(self, peer, now=None):
+                self.scans += 1
+                return super().assign(peer, now)
+
+        scheduler = CountingScheduler(4, chunk_size=4, steal_after=0)
+        scheduler.scans = 0
+        chunk = scheduler.assign('a')
+        self.assertIs(scheduler.assign('b'), chunk)
+
+        # The only chunk is already stolen, so 'c' waits for it to be done
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(scheduler.wait_assign('c')), daemon=True)
+        waiter.start()
+        time.sleep(0.2)
+        scans = scheduler.scans
+        self.assertTrue(scheduler.claim('b', chunk))
+        scheduler.complete('b', chunk)
+        waiter.join(5)
+        self.assertLessEqual(scans, 3)
+        self.assertEqual(result, [None])
+
+
+class TestDownload(unittest.TestCase):
+    site = '1HeLLo4uzjaLetFx6NH3PMwFP3qbRbTf3D'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = SiteStore(self.root)
+        self.data = os.urandom(100000)
+        self.digest = digest_bytes(self.data)[0]
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root)
+
+    def test_download(self):
+        fetched = {}
+        lock = threading.Lock()
+
+        def fetch(peer, site, inner_path, offset, size):
+            if peer == 'broken':
+                raise ConnectionError('Connection reset')
+            if peer == 'liar':
+                return os.urandom(size)
+            time.sleep(0.5 if peer == 'slow' else 0.001)
+            with lock:
+                fetched[peer] = fetched.get(peer, 0) + 1
+            return self.data[offset:offset + size]
+
+        chunk_size = 4096
+        pieces = [digest_bytes(self.data[i:i + chunk_size])[0] for i in range(0, len(self.data), chunk_size)]
+        path = download(self.store, self.site, 'big.bin', len(self.data), ['broken', 'liar', 'slow', 'a', 'b'], fetch,
+            expect_digest=self.digest, piece_digests=pieces, chunk_size=chunk_size, steal_after=0.1)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        # The chunk of the slow peer has been stolen
+        self.assertEqual(fetched['a'] + fetched['b'], len(pieces))
+        self.assertGreater(min(fetched['a'], fetched['b']), 1)
+
+    def test_failures(self):
+        def fetch(peer, site, inner_path, offset, size):
+            time.sleep(0.001)
+            return self.data[offset:offset + size] if peer == 'good' else os.urandom(size)
+
+        with self.assertRaises(DigestError):
+            download(self.store, self.site, 'big.bin', len(self.data), ['good', 'liar'], fetch,
+                expect_digest=self.digest, chunk_size=4096)
+        with self.assertRaises(DownloadError):
+            download(self.store, self.site, 'big.bin', len(self.data), [], fetch)
+        self.assertEqual(os.listdir(os.path.join(self.root, self.site)), [])
+
+    def test_scorer(self):
+        good, liar = Peer('good', 0), Peer('liar', 0)
+
+        def fetch(peer, site, inner_path, offset, size):
+            time.sleep(0.001)
+            return self.data[offset:offset + size] if peer is good else os.urandom(size)
+
+        chunk_size = 10000
+        pieces = [digest_bytes(self.data[i:i + chunk_size])[0] for i in range(0, len(self.data), chunk_size)]
+        download(self.store, self.site, 'big.bin', len(self.data), [good, liar], fetch,
+            piece_digests=pieces, chunk_size=chunk_size, scorer=PeerScorer())
+        self.assertEqual(good.failure_rate, 0)
+        self.assertGreater(good.score, Peer.default_score)
+        self.assertLess(liar.score, 1)
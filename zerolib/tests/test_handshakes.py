@@ -0,0 +1,108 @@
+import unittest
+import msgpack
+from ipaddress import IPv4Address
+from zerolib.nettools import BaseServer, HandshakeCache
+from zerolib.protocol.packets import AddrPort, OnionAddress, unpack, unpack_dict
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def handshake(peer_id=b'-ZN0001-abc', crypto=(b'tls-rsa', b'tls-ecdsa')):
+    params = {
+        b'crypt_supported': list(crypto), b'protocol': b'v2', b'version': b'0.7.1',
+        b'fileserver_port': 15441, b'rev': 4555,
+    }
+    if peer_id is not None:
+        params[b'peer_id'] = peer_id
+    return unpack_dict({b'cmd': b'handshake', b'req_id': 1, b'params': params})
+
+def ack(crypt):
+    return unpack_dict({
+        b'cmd': b'response', b'to': 1, b'crypt_supported': [b'tls-rsa'], b'crypt': crypt,
+        b'protocol': b'v2', b'version': b'0.7.1', b'fileserver_port': 15441, b'rev': 4555,
+    })
+
+
+class TestHandshake(unittest.TestCase):
+    def test_parse(self):
+        packet = handshake()
+        self.assertEqual(packet.crypto_set, {'tls-rsa', 'tls-ecdsa'})
+        self.assertEqual((packet.peer_id, packet.port, packet.rev), (b'-ZN0001-abc', 15441, 4555))
+        self.assertIsNone(packet.onion)
+
+        packet = unpack_dict({b'cmd': b'handshake', b'req_id': 1, b'params': {
+            b'crypt_supported': [], b'protocol': b'v2', b'version': b'0.7.1',
+            b'fileserver_port': 15441, b'onion': b'3g2upl4pq6kufc4m'}})
+        self.assertEqual(packet.onion, AddrPort(OnionAddress('3g2upl4pq6kufc4m.onion'), 15441))
+        self.assertEqual(ack(b'tls-rsa').preferred_crypto, 'tls-rsa')
+
+
+class TestHandshakeCache(unittest.TestCase):
+    def test_cache(self):
+        clock = Clock()
+        cache = HandshakeCache(ttl=60, capacity=2, clock=clock)
+        self.assertIsNone(cache.lookup('a'))
+        cache.put('a', handshake(), preferred_crypto='tls-ecdsa')
+        info = cache.get('a', b'-ZN0001-abc')
+        self.assertEqual((info.crypto_set, info.version), (frozenset({'tls-rsa', 'tls-ecdsa'}), '0.7.1'))
+        self.assertIsNone(cache.get('a', b'-ZN0001-xyz'))
+        self.assertIs(cache.lookup('a'), info)
+
+        self.assertEqual(cache.choose_crypto('a', ['tls-rsa', 'tls-ecdsa']), 'tls-ecdsa')
+        self.assertEqual(cache.choose_crypto('a', ['tls-rsa']), 'tls-rsa')
+        self.assertIsNone(cache.choose_crypto('a', ['plain']))
+        self.assertIsNone(cache.choose_crypto('b', ['tls-rsa']))
+
+        # Tor peers send no peer ID, and an ACK carries the crypto chosen
+        cache.put('b', ack(b'tls-rsa'))
+        self.assertEqual(cache.choose_crypto('b', ['tls-ecdsa', 'tls-rsa'], None), 'tls-rsa')
+
+        # The oldest entry goes first
+        cache.put('c', handshake(None))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.lookup('a'))
+
+        clock.now += 30
+        cache.put('b', handshake(None))
+        clock.now += 31
+        self.assertIsNone(cache.lookup('c'))
+        self.assertIsNotNone(cache.lookup('b'))
+        clock.now += 30
+        self.assertEqual(cache.reap(), 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_forget(self):
+        cache = HandshakeCache()
+        cache.put('a', handshake(b'old'))
+        cache.put('a', handshake(b'new'))
+        self.assertEqual(cache.lookup('a').peer_id, b'new')
+        cache.forget('a')
+        self.assertIsNone(cache.lookup('a'))
+        self.assertIsNotNone(cache.get('a', b'old'))
+
+    def test_server(self):
+        cache = HandshakeCache()
+        server = BaseServer(handshakes=cache)
+        data = msgpack.packb({'cmd': 'handshake', 'req_id': 7, 'params': {
+            'crypt_supported': ['tls-rsa'], 'protocol': 'v2', 'version': '0.7.1', 'fileserver_port': 1}})
+        server.handle(unpack(data, 'peer'))
+        self.assertEqual(cache.lookup('peer').crypto_set, {'tls-rsa'})
+
+    def test_server_source_ports(self):
+        cache = HandshakeCache()
+        server = BaseServer(handshakes=cache)
+        data = msgpack.packb({'cmd': 'handshake', 'req_id': 7, 'params': {
+            'crypt_supported': ['tls-rsa'], 'protocol': 'v2', 'version': '0.7.1', 'fileserver_port': 15441,
+            'peer_id': '-ZN0001-abc'}})
+        address = IPv4Address('1.2.3.4')
+        server.handle(unpack(data, AddrPort(address, 50001)))
+        server.handle(unpack(data, AddrPort(address, 50002)))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.lookup(AddrPort(address, 15441)).crypto_set, {'tls-rsa'})
+        self.assertIsNone(cache.lookup(AddrPort(address, 50002)))
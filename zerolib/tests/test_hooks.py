@@ -0,0 +1,75 @@
+import time
+import unittest
+import msgpack
+from zerolib.nettools import BaseServer
+from zerolib.protocol.hooks import PacketHooks, SamplingProfiler, install_hooks, remove_hooks
+from zerolib.protocol import hooks
+
+ping = msgpack.packb({'cmd': 'ping', 'req_id': 1, 'params': {}})
+
+
+class Recorder(PacketHooks):
+    __slots__ = ['events']
+
+    def __init__(self):
+        self.events = []
+
+    def on_decode_start(self, sender):
+        self.events.append(('decode_start', sender))
+
+    def on_decode_end(self, sender, payload):
+        self.events.append(('decode_end', payload is not None))
+
+    def on_parse(self, payload, sender):
+        self.events.append(('parse', payload[b'cmd']))
+
+    def on_parse_end(self, packet, sender):
+        self.events.append(('parse_end', packet.__class__.__name__))
+
+    def on_dispatch(self, packet, name):
+        self.events.append(('dispatch', name))
+
+    def on_dispatch_end(self, packet, name):
+        self.events.append(('dispatch_end', name))
+
+
+class SlowServer(BaseServer):
+    def ping(self, packet):
+        end = time.perf_counter() + 0.05
+        while time.perf_counter() < end:
+            pass
+        return super().ping(packet)
+
+
+class TestHooks(unittest.TestCase):
+    def test_events(self):
+        recorder = Recorder()
+        install_hooks(recorder)
+        install_hooks(recorder)
+        try:
+            BaseServer().handle_bytes(ping, 'peer')
+            with self.assertRaises(IOError):
+                BaseServer(metrics=True).handle_bytes(ping[:-1], 'peer')
+            with self.assertRaises(KeyError):
+                BaseServer().handle_bytes(msgpack.packb({'cmd': 'nope', 'req_id': 1, 'params': {}}))
+        finally:
+            remove_hooks(recorder)
+        self.assertEqual(hooks.installed, ())
+        self.assertEqual(recorder.events, [
+            ('decode_start', 'peer'), ('decode_end', True), ('parse', b'ping'), ('parse_end', 'Ping'),
+            ('dispatch', 'ping'), ('dispatch_end', 'ping'),
+            ('decode_start', 'peer'), ('decode_end', False),
+            ('decode_start', None), ('decode_end', True), ('parse', b'nope'), ('parse_end', 'NoneType'),
+        ])
+
+    def test_profiler(self):
+        server = SlowServer()
+        with SamplingProfiler(interval=0.001) as profiler:
+            for i in range(3):
+                server.handle_bytes(ping, 'peer')
+        self.assertEqual(hooks.installed, ())
+        self.assertIsNone(profiler.thread)
+        self.assertGreater(profiler.by_command()['Ping'], 0.05)
+        self.assertEqual(set(profiler.by_sender()), {'peer'})
+        self.assertGreater(profiler.by_stage()['dispatch'], 0.05)
+        self.assertIn('Ping', profiler.report())
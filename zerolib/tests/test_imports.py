@@ -0,0 +1,52 @@
+import importlib
+import subprocess
+import sys
+import unittest
+
+packages = ['zerolib.protocol', 'zerolib.integrity', 'zerolib.nettools', 'zerolib.storage']
+
+def loaded_after(statement):
+    """Run [statement] in a new interpreter and return the names of the loaded modules."""
+    code = 'import sys; %s; print(" ".join(sys.modules))' % statement
+    output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+    return set(output.split())
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_exports(self):
+        for name in packages:
+            package = importlib.import_module(name)
+            exported = set()
+            for submodule in package.__dir__():
+                if submodule in package.__all__:
+                    continue
+                module = importlib.import_module(name + '.' + submodule)
+                for attr in getattr(module, '__all__', ()):
+                    self.assertIs(getattr(package, attr), getattr(module, attr))
+                exported.update(getattr(module, '__all__', ()))
+            self.assertEqual(exported, set(package.__all__))
+            with self.assertRaises(AttributeError):
+                package.no_such_name
+
+    def test_eager(self):
+        # What attach() does before Python 3.7, whatever Python runs the tests
+        modules = loaded_after('sys.version_info = (3, 6); '
+            'import zerolib.protocol, zerolib.integrity, zerolib.nettools, zerolib.storage')
+        for name in packages:
+            package = importlib.import_module(name)
+            for submodule in package.__dir__():
+                if submodule not in package.__all__:
+                    self.assertIn(name + '.' + submodule, modules)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'Modules cannot define __getattr__ before Python 3.7')
+    def test_lazy(self):
+        modules = loaded_after('import zerolib.protocol, zerolib.integrity, zerolib.nettools, zerolib.storage')
+        for heavy in ('cryptography', 'coincurve', 'ssl', 'msgpack'):
+            self.assertNotIn(heavy, modules)
+
+        modules = loaded_after('from zerolib.protocol import unpack, Manifest; from zerolib.integrity import digest_bytes')
+        self.assertIn('msgpack', modules)
+        for heavy in ('cryptography', 'coincurve', 'ssl'):
+            self.assertNotIn(heavy, modules)
+
+        self.assertIn('cryptography', loaded_after('from zerolib.protocol import make_cert'))
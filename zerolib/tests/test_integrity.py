@@ -2,6 +2,8 @@ import hashlib
 import unittest
 import json
 import os
+import random
+from io import BytesIO
 from base64 import b16encode, b16decode, b64encode, b64decode
 from coincurve import PublicKey, PrivateKey
 from zerolib import integrity
@@ -142,3 +144,86 @@ class TestHash(unittest.TestCase):
         with open(self.path_srl, 'r', encoding='utf-8') as f:
             d = json.load(f)
             self.assertTrue(self.size_srl > len(integrity.dumps(d, compact=True)))
+
+
+def random_json(rng, depth=0):
+    kind = rng.randint(0, 9 if depth < 4 else 5)
+    if kind == 0:
+        return None
+    elif kind == 1:
+        return rng.choice((True, False))
+    elif kind == 2:
+        return rng.randint(-2**40, 2**40)
+    elif kind == 3:
+        return rng.choice((rng.random() * 1e6, -0.0, 1e-9, 3.0))
+    elif kind in (4, 5):
+        return ''.join(rng.choice('az09 "\\/\n\té中\U0001f600') for _ in range(rng.randint(0, 12)))
+    elif kind in (6, 7):
+        return [random_json(rng, depth + 1) for _ in range(rng.randint(0, 5))]
+    else:
+        return {str(rng.randint(0, 50)): random_json(rng, depth + 1) for _ in range(rng.randint(0, 6))}
+
+
+class TestCanonical(unittest.TestCase):
+    path_cnt = test_data + '/content.json'
+    path_srl = test_data + '/serialize.json'
+
+    def test_random_documents(self):
+        rng = random.Random(0x5EED)
+        for cache_depth in (0, 1, 2, 3):
+            encoder = integrity.CanonicalEncoder(capacity=64, cache_depth=cache_depth)
+            for i in range(300):
+                d = random_json(rng)
+                expected = integrity.dumps(d)
+                self.assertEqual(encoder.encode(d), expected)
+                # second pass is served from the cache
+                self.assertEqual(encoder.encode(d), expected)
+        self.assertTrue(encoder.hits > 0)
+
+    def test_non_str_keys(self):
+        encoder = integrity.CanonicalEncoder(cache_depth=1)
+        d = {'a': {1: 'x', 2: [1.5, None]}, 'b': {True: 1}, 'c': {None: {}}}
+        self.assertEqual(encoder.encode(d), integrity.dumps(d))
+
+    def test_equal_but_different(self):
+        encoder = integrity.CanonicalEncoder(cache_depth=1)
+        for v in (1, 1.0, True, 0.0, -0.0):
+            for d in ({'a': {'v': v}}, {'a': {v: 'v'}}, {'a': [v]}):
+                self.assertEqual(encoder.encode(d), integrity.dumps(d))
+
+    def test_nested_collisions(self):
+        # Nested containers compare equal across types: (1,) == (True,)
+        encoder = integrity.CanonicalEncoder(cache_depth=1)
+        for (x, y) in ((1, True), (0, False), (0.0, -0.0), (1, 1.0)):
+            for wrap in (lambda v: (v,), lambda v: [v], lambda v: {'v': v}, lambda v: ((v,),)):
+                for v in (x, y):
+                    d = {'a': {'x': wrap(v)}}
+                    self.assertEqual(encoder.encode(d), integrity.dumps(d))
+
+    def test_content_json(self):
+        encoder = integrity.CanonicalEncoder()
+        for path in (self.path_cnt, self.path_srl):
+            with open(path, 'r', encoding='utf-8') as f:
+                d = json.load(f)
+            expected = integrity.dumps(d)
+            self.assertEqual(encoder.encode(d), expected)
+
+            d['files'] = d.get('files', {})
+            d['files']['new/file.txt'] = {'sha512': 'ab' * 32, 'size': len(path)}
+            misses = encoder.misses
+            self.assertEqual(encoder.encode(d), integrity.dumps(d))
+            self.assertEqual(encoder.misses, misses + 1)
+
+    def test_stream(self):
+        with open(self.path_cnt, 'r', encoding='utf-8') as f:
+            d = json.load(f)
+        expected = integrity.dumps(d).encode('ascii')
+
+        class SmallBuffer(integrity.CanonicalEncoder):
+            buffer_size = 100
+
+        encoder = SmallBuffer()
+        stream = BytesIO()
+        self.assertEqual(encoder.write_to(d, stream), len(expected))
+        self.assertEqual(stream.getvalue(), expected)
+        self.assertEqual(encoder.digest(d), integrity.digest_bytes(expected))
@@ -1,5 +1,9 @@
+import random
+import threading
+import time
 import unittest
-from zerolib.storage import RWLock
+import asyncio
+from zerolib.storage import RWLock, AsyncRWLock, LockManager
 try:
     from timeout_decorator import timeout
     from timeout_decorator.timeout_decorator import TimeoutError as ExpectedTimeout
@@ -63,3 +67,185 @@ class TestRWLock(unittest.TestCase):
         with rwlock.writer():
             with rwlock.writer():
                 raise AssertionError('Should not enter')
+
+    @timeout(3)
+    def test_try_acquire(self):
+        rwlock = RWLock()
+
+        with rwlock.read():
+            self.assertFalse(rwlock.acquire('w', blocking=False))
+            self.assertFalse(rwlock.acquire('w', timeout=0.05))
+            self.assertTrue(rwlock.acquire('r', blocking=False))
+            rwlock.release('r')
+        with rwlock.write():
+            self.assertFalse(rwlock.acquire('r', timeout=0.05))
+            with self.assertRaises(TimeoutError):
+                with rwlock.write(timeout=0.05):
+                    raise AssertionError('Should not enter')
+        self.assertTrue(rwlock.acquire('w', blocking=False))
+        rwlock.release('w')
+
+        with self.assertRaises(ValueError):
+            rwlock.release('w')
+        with self.assertRaises(ValueError):
+            rwlock.acquire('x')
+
+    @timeout(3)
+    def test_writer_preference(self):
+        rwlock = RWLock()
+        events = []
+        rwlock.acquire('r')
+
+        writer = threading.Thread(target=lambda: (rwlock.acquire('w'), events.append('w'), rwlock.release('w')))
+        writer.start()
+        while not rwlock.waiting_writers:
+            time.sleep(0.001)
+
+        # A new reader waits behind the writer...
+        reader = threading.Thread(target=lambda: (rwlock.acquire('r'), events.append('r'), rwlock.release('r')))
+        reader.start()
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+        # ...but a thread holding a read lock can take it again
+        self.assertTrue(rwlock.acquire('r', blocking=False))
+        rwlock.release('r')
+
+        rwlock.release('r')
+        writer.join()
+        reader.join()
+        self.assertEqual(events, ['w', 'r'])
+
+    @timeout(3)
+    def test_writer_timeout_lets_readers_in(self):
+        rwlock = RWLock()
+        rwlock.acquire('r')
+        acquired = []
+
+        def write():
+            acquired.append(rwlock.acquire('w', timeout=0.2))
+        writer = threading.Thread(target=write)
+        writer.start()
+        while not rwlock.waiting_writers:
+            time.sleep(0.001)
+
+        reader = threading.Thread(target=lambda: (acquired.append(rwlock.acquire('r')), rwlock.release('r')))
+        reader.start()
+        writer.join()
+        reader.join()
+        self.assertEqual(acquired, [False, True])
+        rwlock.release('r')
+
+
+class TestLockManager(unittest.TestCase):
+    site = '1HeLLo4uzjaLetFx6NH3PMwFP3qbRbTf3D'
+
+    def test_stripes(self):
+        manager = LockManager(num_stripes=8)
+        self.assertIs(manager[(self.site, 'index.html')], manager[(self.site, 'index.html')])
+        self.assertEqual(len(set(manager.stripes)), 8)
+
+        paths = ['content.json'] + ['data/%d.json' % i for i in range(100)]
+        locks = manager.locks_for(self.site, paths)
+        self.assertEqual(len(locks), 8)
+        self.assertEqual(locks, list(manager.stripes))
+
+        with self.assertRaises(ValueError):
+            LockManager(0)
+
+    @timeout(5)
+    def test_multi_path(self):
+        manager = LockManager(num_stripes=16)
+        paths = ['content.json', 'a.txt', 'b.txt', 'c.txt']
+
+        with manager.write(self.site, *paths):
+            for path in paths:
+                self.assertFalse(manager[(self.site, path)].acquire('r', blocking=False))
+            with self.assertRaises(TimeoutError):
+                with manager.read(self.site, 'b.txt', timeout=0.01):
+                    raise AssertionError('Should not enter')
+        with manager.read(self.site, *paths):
+            with manager.read(self.site, 'a.txt'):
+                pass
+
+        for lock in manager.stripes:
+            self.assertEqual((lock.num_readers, lock.owner), (0, None))
+
+    @timeout(10)
+    def test_no_deadlock(self):
+        manager = LockManager(num_stripes=4)
+        paths = ['p%d' % i for i in range(8)]
+        counter = [0]
+
+        def work(seed):
+            rng = random.Random(seed)
+            for i in range(200):
+                with manager.write(self.site, *rng.sample(paths, 3)):
+                    counter[0] += 1
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter[0], 1600)
+
+
+class TestAsyncRWLock(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_order(self):
+        async def main():
+            lock = AsyncRWLock()
+            events = []
+
+            async def hold(mode, name):
+                async with (lock.read() if mode == 'r' else lock.write()):
+                    events.append(name)
+                    await asyncio.sleep(0.01)
+                    events.append('/' + name)
+
+            tasks = [asyncio.ensure_future(hold(m, n)) for (m, n) in
+                [('r', 'r1'), ('r', 'r2'), ('w', 'w1'), ('r', 'r3'), ('r', 'r4'), ('w', 'w2')]]
+            await asyncio.gather(*tasks)
+            return events
+
+        events = self.run_async(main())
+        # Readers share the lock, and r3 and r4 wait behind w1
+        self.assertEqual(events, [
+            'r1', 'r2', '/r1', '/r2', 'w1', '/w1', 'r3', 'r4', '/r3', '/r4', 'w2', '/w2',
+        ])
+
+    def test_cancel_and_timeout(self):
+        async def main():
+            lock = AsyncRWLock()
+            await lock.acquire('r')
+
+            writer = asyncio.ensure_future(lock.acquire('w'))
+            await asyncio.sleep(0)
+            reader = asyncio.ensure_future(lock.acquire('r'))
+            await asyncio.sleep(0)
+            self.assertFalse(reader.done())
+
+            # The reader behind the cancelled writer gets in
+            writer.cancel()
+            self.assertTrue(await reader)
+            self.assertEqual(lock.num_readers, 2)
+
+            self.assertFalse(await lock.acquire('w', timeout=0.01))
+            with self.assertRaises(TimeoutError):
+                async with lock.write(timeout=0.01):
+                    raise AssertionError('Should not enter')
+
+            lock.release('r')
+            lock.release('r')
+            with self.assertRaises(ValueError):
+                lock.release('r')
+            self.assertTrue(await lock.acquire('w', timeout=0))
+            self.assertEqual(len(lock.waiters), 0)
+
+        self.run_async(main())
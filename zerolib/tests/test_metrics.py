@@ -0,0 +1,102 @@
+import threading
+import unittest
+import msgpack
+from urllib.request import urlopen
+from zerolib.nettools import BaseServer, Histogram, serve_prometheus
+from zerolib.protocol.packets import GetFile, unpack
+
+
+class FailingServer(BaseServer):
+    def get_file(self, packet):
+        raise ValueError('No such file')
+
+
+class TestHistogram(unittest.TestCase):
+    def test_buckets(self):
+        previous = -1
+        for ns in list(range(100)) + [1000, 1023, 1024, 10**6, 10**9, 2**63]:
+            index = Histogram.bucket(ns)
+            self.assertGreaterEqual(index, previous)
+            self.assertLessEqual(Histogram.lower_bound(index), ns)
+            self.assertGreater(Histogram.lower_bound(index + 1), ns)
+            # Within 1/8 of the value
+            self.assertLessEqual(Histogram.lower_bound(index + 1) - Histogram.lower_bound(index), max(1, ns / 8))
+            previous = index
+
+    def test_percentile(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for ns in range(1, 1001):
+            histogram.record(ns * 1000)
+        self.assertEqual(histogram.count, 1000)
+        self.assertEqual(histogram.total, 500500000)
+        for percent in (50, 90, 99, 100):
+            value = percent * 10000
+            self.assertGreater(histogram.percentile(percent), value)
+            self.assertLessEqual(histogram.percentile(percent), value * 1.125)
+
+        other = Histogram()
+        other.record(2000)
+        histogram.add(other)
+        self.assertEqual(histogram.count, 1001)
+
+
+class TestServerMetrics(unittest.TestCase):
+    def test_disabled(self):
+        server = BaseServer()
+        self.assertIsNone(server.metrics)
+        server.handle_bytes(msgpack.packb({'cmd': 'ping', 'req_id': 1, 'params': {}}))
+
+    def test_counts(self):
+        server = FailingServer(metrics=True)
+        ping = msgpack.packb({'cmd': 'ping', 'req_id': 1, 'params': {}})
+        server.handle_bytes(ping)
+        server.handle(unpack(ping))
+        with self.assertRaises(ValueError):
+            server.handle_bytes(msgpack.packb({'cmd': 'getFile', 'req_id': 2, 'params': {
+                'site': '1Name2NXVi1RDPDgf5617UoW7xA6YrhM9F', 'inner_path': 'content.json', 'location': 0}}))
+        with self.assertRaises(IOError):
+            server.handle_bytes(ping[:-1])
+
+        request = GetFile()
+        request.req_id = 3
+        request.sender = 'peer'
+        request.site = '1Name2NXVi1RDPDgf5617UoW7xA6YrhM9F'
+        request.inner_path = 'content.json'
+        request.offset = 0
+        request.total_size = None
+        server.send_to(request, 'peer')
+
+        # Recorded from another thread too
+        thread = threading.Thread(target=server.handle_bytes, args=(ping,))
+        thread.start()
+        thread.join()
+
+        snapshot = server.metrics.snapshot()
+        self.assertEqual(snapshot['packets'], {'ping': 3, 'get_file': 1})
+        self.assertEqual(snapshot['errors'], {'ValueError': 1, 'OSError': 1})
+        self.assertEqual(snapshot['handling'], 0)
+        self.assertEqual(snapshot['awaiting'], {'RespFile': 1})
+        self.assertEqual(snapshot['decode'].count, 3)
+        self.assertEqual(snapshot['validation'].count, 3)
+        self.assertEqual(snapshot['handler']['ping'].count, 3)
+
+        text = server.metrics.prometheus()
+        self.assertIn('zerolib_packets_total{handler="ping"} 3\n', text)
+        self.assertIn('zerolib_errors_total{type="ValueError"} 1\n', text)
+        self.assertIn('zerolib_awaiting_responses{response="RespFile"} 1\n', text)
+        self.assertIn('zerolib_decode_seconds_count 3\n', text)
+        self.assertIn('zerolib_handler_seconds_bucket{handler="get_file",le="+Inf"} 1\n', text)
+        self.assertIn('zerolib_handler_seconds_count{handler="ping"} 3\n', text)
+
+    def test_endpoint(self):
+        server = BaseServer(metrics=True)
+        server.handle_bytes(msgpack.packb({'cmd': 'ping', 'req_id': 1, 'params': {}}))
+        http = serve_prometheus(server.metrics, 0)
+        try:
+            with urlopen('http://127.0.0.1:%d/metrics' % http.server_address[1], timeout=5) as response:
+                text = response.read().decode()
+        finally:
+            http.shutdown()
+            http.server_close()
+        self.assertIn('zerolib_packets_total{handler="ping"} 1\n', text)
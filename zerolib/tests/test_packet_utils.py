@@ -1,8 +1,15 @@
+import tempfile
 import unittest
+import msgpack
 from ipaddress import IPv4Address
 from zerolib.protocol.packets import *
-from zerolib.protocol.packets import hash_set
+from zerolib.protocol.packets import hash_set, int_hash_id
+from zerolib.protocol.hashfield import HashField
+from zerolib.protocol.hashindex import HashIndex
 from zerolib.protocol.sequencing import *
+from zerolib.protocol.patching import *
+from zerolib.integrity import digest_bytes, DigestError
+from io import BytesIO
 
 class MockString(bytes):
     def __init__(self, length):
@@ -36,6 +43,19 @@ class TestUnpack(unittest.TestCase):
         self.assertTrue(b'\x10\x11' in packet)
         self.assertFalse(b'\xA0\xB1' in packet)
 
+    def test_unpack_bytes(self):
+        data = msgpack.packb({'cmd': 'getFile', 'req_id': 3, 'params': {
+            'site': '122tqTo5jTsZfF4xFodhM54b5HUkeVQL4E', 'inner_path': 'content.json', 'location': 5}})
+        packet = unpack(data, 'sender')
+        self.assertIsInstance(packet, GetFile)
+        self.assertEqual((packet.req_id, packet.offset, packet.sender), (3, 5, 'sender'))
+
+        stream = BytesIO(data + msgpack.packb({'cmd': 'response', 'to': 3, 'body': b'Pong!'}))
+        self.assertIsInstance(unpack_stream(stream), GetFile)
+        self.assertIsInstance(unpack_stream(stream), Pong)
+        with self.assertRaises(IOError):
+            unpack(data[0:-1])
+
     def test_attr_inject(self):
         request = unpack_dict({b'req_id': 0, b'cmd': b'actionCheckport', b'params': {b'port': 15441}})
         response = unpack_dict({b'cmd': b'response', b'to': 0, b'status': b'open', b'ip_external': b'1.2.3.4'})
@@ -100,3 +120,199 @@ class TestInterpreter(unittest.TestCase):
     @setup_packets('unknown')
     def test_unknown(self, state_machine, request, response):
         pass
+
+
+class TestUpdateDiff(unittest.TestCase):
+    old = b''.join(b'line %d\n' % i for i in range(100))
+    new = old.replace(b'line 5\n', b'line five\n').replace(b'line 50\n', b'') + b'last line'
+
+    def setUp(self):
+        self.params = {b'site': b'122tqTo5jTsZfF4xFodhM54b5HUkeVQL4E', b'inner_path': b'content.json'}
+
+    def unpack_update(self, extra=None):
+        params = dict(self.params)
+        params.update(extra or {})
+        return unpack_dict({b'cmd': b'update', b'req_id': 1, b'params': params})
+
+    def test_roundtrip(self):
+        actions = make_diff(self.old, self.new)
+        self.assertTrue(sum(len(l) for (op, lines) in actions if op == '+' for l in lines) < 30)
+        self.assertEqual(apply_diff(self.old, actions), self.new)
+        self.assertEqual(apply_diff(self.new, make_diff(self.new, self.old)), self.old)
+        self.assertEqual(apply_diff(b'', make_diff(b'', b'')), b'')
+        self.assertIsNone(make_diff(self.old, self.new, limit=5))
+
+    def test_oversized_count(self):
+        huge = [('=', 10), ('=', 2 ** 38)]
+        with tempfile.TemporaryFile() as f:
+            f.write(self.old)
+            f.seek(0)
+            with self.assertRaises(ValueError):
+                apply_diff(f, check_diff(huge))
+        with self.assertRaises(ValueError):
+            apply_diff(self.old, [('-', 2 ** 38)])
+
+        # Streams that cannot seek are read in pieces
+        class Stream(BytesIO):
+            def seekable(self):
+                return False
+        with self.assertRaises(ValueError):
+            apply_diff(Stream(self.old), huge)
+        self.assertEqual(apply_diff(Stream(self.old), make_diff(self.old, self.new)), self.new)
+
+    def test_packet(self):
+        wire = [[op.encode('ascii'), param] for (op, param) in make_diff(self.old, self.new)]
+        digest, size = digest_bytes(self.new)
+
+        packet = self.unpack_update({b'diffs': {b'content.json': wire, b'../x': wire, b'bad': [[b'?', 1]]}})
+        self.assertIsInstance(packet, Update)
+        self.assertIsNone(packet.body)
+        self.assertEqual(list(packet.diffs), ['content.json'])
+        self.assertEqual(packet.patch('content.json', BytesIO(self.old), digest, size), self.new)
+
+        with self.assertRaises(DigestError):
+            packet.patch('content.json', self.old.replace(b'line 1\n', b'line X\n'), digest, size)
+        with self.assertRaises(ValueError):
+            packet.patch('content.json', self.old[0:100])
+
+        packet = self.unpack_update({b'body': self.new})
+        self.assertEqual(packet.patch('content.json', None, digest), self.new)
+
+        with self.assertRaises(KeyError):
+            self.unpack_update()
+
+    def test_check_diff(self):
+        for bad in ([[b'=', -1]], [[b'+', [u'str']]], [[b'=']], [b'='], [[b'+', [b'x' * 10]]]):
+            with self.assertRaises((TypeError, ValueError)):
+                check_diff(bad, limit=5)
+
+
+class TestHashField(unittest.TestCase):
+    def test_raw(self):
+        raw = b'11223344556677889900aaAAbbBBccddCDEFCDCDaaAA1122'
+        field = HashField.from_raw(raw)
+        self.assertEqual(len(field), 18)
+        self.assertEqual(field.prefixes(), hash_set(raw))
+        self.assertEqual(HashField.from_raw(field.to_raw()), field)
+        self.assertEqual(list(field), sorted(int_hash_id(p) for p in hash_set(raw)))
+        self.assertEqual(field.to_raw(), b''.join(sorted(hash_set(raw))))
+        self.assertIn(b'CD', field)
+        self.assertIn(0x4344, field)
+        self.assertNotIn(b'XY', field)
+        self.assertNotIn(b'XYZ', field)
+        self.assertNotIn(0x10000, field)
+        with self.assertRaises(ValueError):
+            HashField.from_raw(b'123')
+
+    def test_set_ops(self):
+        a = HashField([0, 1, 2, 0xFFFF])
+        b = HashField([2, 3, 0xFFFF])
+        self.assertEqual(list(a | b), [0, 1, 2, 3, 0xFFFF])
+        self.assertEqual(list(a & b), [2, 0xFFFF])
+        self.assertEqual(list(a - b), [0, 1])
+        self.assertEqual(list(a ^ b), [0, 1, 3])
+        self.assertEqual(list(HashField.union(a, b, HashField([7]))), [0, 1, 2, 3, 7, 0xFFFF])
+        self.assertEqual(list(HashField.intersection(a, b, HashField([2]))), [2])
+        self.assertFalse(HashField.intersection())
+
+        a.discard(0)
+        a.add(b'\x00\x05')
+        self.assertEqual(list(a), [1, 2, 5, 0xFFFF])
+        self.assertTrue(a)
+        self.assertFalse(HashField())
+
+    def test_packet(self):
+        packet = unpack_dict({b'cmd': b'response', b'to': 0, b'hashfield_raw': b'\x10\x11ABCDef12'})
+        self.assertEqual(packet.hashfield, HashField.from_raw(b'\x10\x11ABCDef12'))
+
+        packet = unpack_dict({b'cmd': b'findHashIds', b'req_id': 0, b'params': {
+            b'site': b'122tqTo5jTsZfF4xFodhM54b5HUkeVQL4E', b'hash_ids': [1, 2, 0x10000, b'x']}})
+        self.assertIsInstance(packet, FindHash)
+        self.assertEqual(list(packet.hashfield), [1, 2])
+
+
+class TestHashIndex(unittest.TestCase):
+    site = b'122tqTo5jTsZfF4xFodhM54b5HUkeVQL4E'
+
+    def setUp(self):
+        self.a = AddrPort(IPv4Address('10.0.0.1'), 15441)
+        self.b = AddrPort(IPv4Address('10.0.0.2'), 15441)
+        self.c = AddrPort(OnionAddress('expyuzz4wqqyqhjn'), 15441)
+
+    def test_update(self):
+        index = HashIndex()
+        index.update(self.a, HashField([1, 2, 3]))
+        index.update(self.b, HashField([2, 3, 4]))
+        self.assertEqual(index[2], {self.a, self.b})
+        self.assertEqual(index[b'\x00\x04'], {self.b})
+
+        index.update(self.a, HashField([3, 5]))
+        self.assertEqual(index[1], frozenset())
+        self.assertEqual(index[2], {self.b})
+        self.assertEqual(index[5], {self.a})
+        self.assertNotIn(1, index.peers_of)
+
+        index.remove(self.b)
+        self.assertEqual(index.find([2, 3, 4, 5]), {3: [self.a], 5: [self.a]})
+        self.assertEqual(len(index), 1)
+
+    def test_packets(self):
+        index = HashIndex()
+        # Announced from an ephemeral port, indexed under the listening one
+        announce = unpack_dict({b'cmd': b'setHashfield', b'req_id': 0,
+            b'params': {b'site': self.site, b'hashfield_raw': b'\x00\x01\x00\x02'}},
+            AddrPort(self.a.address, 50001))
+        with self.assertRaises(ValueError):
+            index.update_packet(announce)
+        index.update_packet(announce, self.a)
+        index.update(self.c, HashField([2]))
+        # A response comes from the peer that was asked
+        reply = unpack_dict({b'cmd': b'response', b'to': 1, b'hashfield_raw': b'\x00\x03'}, self.b)
+        index.update_packet(reply)
+        self.assertEqual(index[3], {self.b})
+        self.assertEqual(index[1], {self.a})
+
+        request = unpack_dict({b'cmd': b'findHashIds', b'req_id': 7,
+            b'params': {b'site': self.site, b'hash_ids': [1, 2, 3]}}, self.b)
+        response = index.respond(request)
+        self.assertEqual(response.peers, {1: {self.a}, 2: {self.a}})
+        self.assertEqual(response.onions, {2: {self.c}})
+
+        packed = response.pack(self.b)
+        self.assertEqual(packed['to'], 7)
+        wire = {k.encode('ascii'): v for (k, v) in packed.items()}
+        wire[b'cmd'] = b'response'
+        parsed = unpack_dict(wire, self.b)
+        self.assertIsInstance(parsed, RespHashDict)
+        self.assertEqual(parsed.peers, response.peers)
+        self.assertEqual(parsed.onions, response.onions)
+
+        state_machine = PacketInterp()
+        state_machine.register(request)
+        state_machine.interpret(parsed)
+        self.assertEqual(parsed.site, self.site.decode('ascii'))
+
+    def test_round_trip(self):
+        index = HashIndex()
+        request = unpack_dict({b'cmd': b'findHashIds', b'req_id': 3,
+            b'params': {b'site': self.site, b'hash_ids': [1, 2]}}, self.b)
+        # Neither an empty response nor one with onion peers only loses its type
+        for (peer, peers, onions) in ((None, {}, {}), (self.c, {}, {1: {self.c}})):
+            if peer is not None:
+                index.update(peer, HashField([1]))
+            parsed = unpack(bytes(index.respond(request)), self.b)
+            self.assertIsInstance(parsed, RespHashDict)
+            self.assertEqual((parsed.peers, parsed.onions), (peers, onions))
+
+    def test_exclude(self):
+        index = HashIndex()
+        for peer in (self.a, self.b):
+            index.update(peer, HashField([1, 2]))
+        index.update(self.c, HashField([2]))
+        # The requester takes no room out of the limit
+        found = index.find([1, 2], limit=1, exclude=self.a)
+        self.assertEqual(found[1], [self.b])
+        self.assertNotIn(self.a, found[2])
+        self.assertEqual(index.find([1], exclude=self.a), {1: [self.b]})
+        index.remove(self.b)
+        self.assertEqual(index.find([1], exclude=self.a), {})
@@ -0,0 +1,191 @@
+import asyncio
+import socket
+import threading
+import unittest
+import msgpack
+from zerolib.nettools import ConnectionPool, AsyncConnectionPool, ping_check
+from zerolib.protocol.packets import Pong
+
+
+class MockConn(object):
+    def __init__(self, dest, n):
+        self.dest = dest
+        self.n = n
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Opener(object):
+    def __init__(self):
+        self.opened = []
+
+    def __call__(self, dest):
+        conn = MockConn(dest, len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_reuse(self):
+        opener = Opener()
+        pool = ConnectionPool(opener, max_per_dest=2)
+        a = pool.checkout('a')
+        pool.checkin('a', a)
+        self.assertIs(pool.checkout('a'), a)
+        b = pool.checkout('a')
+        self.assertIsNot(a, b)
+        self.assertEqual(len(opener.opened), 2)
+
+        with self.assertRaises(TimeoutError):
+            pool.checkout('a', timeout=0.05)
+        self.assertFalse(pool.dests['a'].waiters)
+
+        pool.checkin('a', b, reuse=False)
+        self.assertTrue(b.closed)
+        c = pool.checkout('a', timeout=0)
+        self.assertEqual(c.n, 2)
+
+    def test_waiters(self):
+        pool = ConnectionPool(Opener(), max_per_dest=1)
+        conn = pool.checkout('a')
+        results = []
+        def worker():
+            with pool.connection('a', timeout=5) as c:
+                results.append(c)
+
+        threads = [threading.Thread(target=worker) for i in range(5)]
+        for t in threads:
+            t.start()
+        pool.checkin('a', conn)
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [conn] * 5)
+
+        pool.close()
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.dests, {})
+
+    def test_failed_connect(self):
+        def connect(dest):
+            raise OSError('unreachable')
+        pool = ConnectionPool(connect, max_per_dest=1)
+        for i in range(3):
+            with self.assertRaises(OSError):
+                pool.checkout('a', timeout=0)
+        self.assertEqual(pool.dests, {})
+
+    def test_health_check(self):
+        checked = []
+        def health_check(conn):
+            checked.append(conn)
+            return conn.n != 0
+
+        opener = Opener()
+        pool = ConnectionPool(opener, health_check=health_check, check_after=0)
+        conn = pool.checkout('a')
+        pool.checkin('a', conn)
+        new_conn = pool.checkout('a')
+        self.assertEqual(checked, [conn])
+        self.assertTrue(conn.closed)
+        self.assertEqual(new_conn.n, 1)
+
+    def test_failed_health_check(self):
+        def health_check(conn):
+            raise OSError('reset')
+
+        pool = ConnectionPool(Opener(), max_per_dest=1, health_check=health_check, check_after=0)
+        conn = pool.checkout('a')
+        pool.checkin('a', conn)
+        with self.assertRaises(OSError):
+            pool.checkout('a', timeout=0)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.dests, {})
+
+    def test_ping_check(self):
+        local, remote = socket.socketpair()
+        def serve():
+            unpacker = msgpack.Unpacker(raw=True)
+            unpacker.feed(remote.recv(4096))
+            ping = next(unpacker)
+            pong = Pong()
+            pong.req_id = ping[b'req_id']
+            remote.sendall(msgpack.packb(pong.pack(None)))
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        try:
+            self.assertTrue(ping_check(local, timeout=5))
+            thread.join()
+            remote.close()
+            self.assertFalse(ping_check(local, timeout=5))
+        finally:
+            local.close()
+
+
+class TestAsyncConnectionPool(unittest.TestCase):
+    def run_async(self, coro):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def test_waiters(self):
+        opener = Opener()
+        async def connect(dest):
+            return opener(dest)
+
+        async def main():
+            pool = AsyncConnectionPool(connect, max_per_dest=1)
+            conn = await pool.checkout('a')
+            results = []
+            async def worker(i):
+                async with pool.connection('a', timeout=5) as c:
+                    results.append((i, c))
+                    await asyncio.sleep(0)
+
+            tasks = [asyncio.ensure_future(worker(i)) for i in range(4)]
+            await asyncio.sleep(0)
+            tasks[1].cancel()
+            await asyncio.sleep(0)
+            with self.assertRaises(TimeoutError):
+                await pool.checkout('a', timeout=0.01)
+            pool.checkin('a', conn)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.assertEqual(results, [(0, conn), (2, conn), (3, conn)])
+            self.assertEqual(len(pool.dests['a'].idle), 1)
+            self.assertFalse(pool.dests['a'].waiters)
+
+        self.run_async(main())
+
+    def test_cancelled_health_check(self):
+        opener = Opener()
+        async def connect(dest):
+            return opener(dest)
+
+        started = []
+        async def health_check(conn):
+            started.append(conn)
+            await asyncio.sleep(10)
+            return True
+
+        async def main():
+            pool = AsyncConnectionPool(connect, max_per_dest=1, health_check=health_check, check_after=0)
+            conn = await pool.checkout('a')
+            pool.checkin('a', conn)
+            task = asyncio.ensure_future(pool.checkout('a'))
+            while not started:
+                await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertTrue(conn.closed)
+            self.assertEqual(pool.dests, {})
+
+            pool.health_check = None
+            new_conn = await pool.checkout('a', timeout=0.1)
+            self.assertEqual(new_conn.n, 1)
+
+        self.run_async(main())
@@ -0,0 +1,177 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ipaddress import IPv4Address, IPv6Address
+from zerolib.nettools import BaseServer
+from zerolib.protocol.packets import AddrPort, OnionAddress, I2PAddress, CheckPort, GetFile, unpack_dict
+from zerolib.protocol.routing import Peer, PeerScorer, Router
+from zerolib.protocol import peertable
+
+
+def make_peers():
+    return [
+        Peer(AddrPort(IPv4Address('1.2.3.4'), 15441), 1000.0, {'1Site'}),
+        Peer(AddrPort(IPv4Address('4.3.2.1'), 1), 1001.5, {'1Site', '1Other'}, score=70),
+        Peer(AddrPort(IPv6Address('::1'), 2), 1002.0),
+        Peer(AddrPort(OnionAddress('3g2upl4pq6kufc4m.onion'), 80), 1003.0, {'1Other'}),
+        Peer(AddrPort(I2PAddress('a' * 52 + '.b32.i2p'), 0), 1004.0),
+    ]
+
+
+class TestRouterFile(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.path = os.path.join(self.dirname, 'peers')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def assertSame(self, router, peers):
+        self.assertEqual(len(router), len(peers))
+        for peer in peers:
+            loaded = router[peer.address]
+            self.assertEqual((loaded.dest, loaded.last_seen, loaded.score, loaded.sites),
+                (peer.dest, peer.last_seen, peer.score, peer.sites))
+
+    def test_round_trip(self):
+        peers = make_peers()
+        router = Router()
+        for peer in peers:
+            router.put(peer)
+        router.save(self.path)
+
+        loaded = Router.load(self.path)
+        self.assertEqual(loaded.peers, {})
+        self.assertEqual(loaded[peers[1].address].sites, {'1Site', '1Other'})
+        self.assertIsNone(loaded.get(IPv4Address('9.9.9.9')))
+        self.assertNotIn(IPv4Address('9.9.9.9'), loaded)
+        self.assertEqual(len(loaded.peers), 1)
+        self.assertSame(loaded, peers)
+        loaded.close()
+
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(IOError):
+            Router.load(self.path)
+        with open(self.path, 'wb') as f:
+            f.write(b'\x00' * 100)
+        with self.assertRaises(ValueError):
+            Router.load(self.path)
+
+    def test_journal(self):
+        peers = make_peers()
+        router = Router()
+        for peer in peers:
+            router.put(peer)
+        router.save(self.path)
+        snapshot_size = os.path.getsize(self.path)
+
+        loaded = Router.load(self.path)
+        loaded[peers[0].address].score = 10
+        peers[0].score = 10
+        del loaded[peers[2].address]
+        new = Peer(AddrPort(IPv4Address('5.5.5.5'), 5), 1005.0, {'1New'})
+        loaded.put(new)
+        loaded.save(self.path)
+        # Only the changes were written
+        self.assertEqual(os.path.getsize(self.path), snapshot_size)
+        journal = peertable.journal_path(self.path)
+        journal_size = os.path.getsize(journal)
+        self.assertGreater(journal_size, 0)
+        loaded.save(self.path)
+        self.assertEqual(os.path.getsize(journal), journal_size)
+
+        expected = [peers[0], peers[1], peers[3], peers[4], new]
+        self.assertSame(Router.load(self.path), expected)
+
+        # A batch cut short by a crash is ignored, and cut off
+        loaded[new.address].last_seen = 2000.0
+        loaded.save(self.path)
+        with open(journal, 'r+b') as f:
+            f.truncate(os.path.getsize(journal) - 3)
+        self.assertEqual(Router.load(self.path)[new.address].last_seen, 1005.0)
+        self.assertEqual(os.path.getsize(journal), journal_size)
+
+        # Once the journal grows too large, the snapshot is rewritten
+        loaded.journal_ratio = 0
+        loaded.save(self.path)
+        self.assertEqual(os.path.getsize(journal), 0)
+        self.assertSame(Router.load(self.path), expected)
+
+    def test_stale_journal(self):
+        router = Router()
+        for peer in make_peers():
+            router.put(peer)
+        router.save(self.path)
+        journal = peertable.journal_path(self.path)
+        router[IPv4Address('1.2.3.4')].score = 0
+        router.save(self.path)
+        with open(journal, 'rb') as f:
+            stale = f.read()
+
+        # A crash right after the snapshot was replaced leaves the old journal
+        router.journal_ratio = 0
+        router[IPv4Address('1.2.3.4')].score = 90
+        router.save(self.path)
+        with open(journal, 'wb') as f:
+            f.write(stale)
+        self.assertEqual(Router.load(self.path)[IPv4Address('1.2.3.4')].score, 90)
+        self.assertEqual(os.path.getsize(journal), 0)
+
+
+class TestScorer(unittest.TestCase):
+    def test_scores(self):
+        scorer = PeerScorer(alpha=0.5, rtt_ref=0.5, rate_ref=1000)
+        peer = Peer(AddrPort(IPv4Address('1.2.3.4'), 1), 0)
+        scorer.rtt(peer, 0.5)
+        self.assertEqual((peer.rtt, peer.failure_rate, peer.score), (0.5, 0.0, 50))
+        scorer.rtt(peer, 0.1)
+        self.assertAlmostEqual(peer.rtt, 0.3)
+        self.assertAlmostEqual(peer.score, 100 * 0.5 / 0.8)
+        scorer.transfer(peer, 3000, 1)
+        self.assertAlmostEqual(peer.score, 100 * (0.5 / 0.8 + 0.75) / 2)
+        scorer.failure(peer)
+        self.assertEqual(peer.failure_rate, 0.5)
+        self.assertAlmostEqual(peer.score, 50 * (0.5 / 0.8 + 0.75) / 2)
+
+    def test_fastest(self):
+        router = Router()
+        scorer = PeerScorer(router)
+        for (i, rtt) in enumerate((0.9, 0.1, 2.0, 0.3)):
+            dest = AddrPort(IPv4Address(i + 1), 1)
+            router.put(Peer(dest, 0, {'1Site'} if i % 2 else {'1Other'}))
+            scorer.rtt(dest, rtt)
+        scorer.failure(AddrPort(IPv4Address('9.9.9.9'), 1))
+        self.assertEqual([peer.dest.address for peer in router.fastest(3)],
+            [IPv4Address(2), IPv4Address(4), IPv4Address(1)])
+        self.assertEqual([peer.dest.address for peer in router.fastest(5, '1Other')],
+            [IPv4Address(1), IPv4Address(3)])
+
+    def test_interp(self):
+        router = Router()
+        dest = AddrPort(IPv4Address('1.2.3.4'), 1)
+        peer = Peer(dest, 0)
+        router.put(peer)
+        server = BaseServer(scorer=PeerScorer(router))
+
+        check = CheckPort()
+        (check.req_id, check.sender, check.port) = (1, dest, 1)
+        server.send_to(check, dest)
+        server.handle(unpack_dict({b'cmd': b'response', b'to': 1, b'status': b'open', b'ip_external': b'1.2.3.4'}, dest))
+        self.assertIsNotNone(peer.rtt)
+        self.assertEqual(peer.failure_rate, 0)
+
+        request = GetFile()
+        request.req_id = 2
+        request.sender = dest
+        (request.site, request.inner_path, request.offset, request.total_size) = ('1Site', 'a', 0, 10)
+        server.send_to(request, dest)
+        response = unpack_dict({b'cmd': b'response', b'to': 2, b'body': b'x' * 10, b'location': 9, b'size': 10}, dest)
+        server.handle(response)
+        self.assertIsNotNone(peer.rate)
+
+        server.send_to(request, dest)
+        with self.assertRaises(TypeError):
+            server.handle(unpack_dict({b'cmd': b'response', b'to': 2, b'status': b'closed', b'ip_external': b'1.2.3.4'}, dest))
+        self.assertGreater(peer.failure_rate, 0)
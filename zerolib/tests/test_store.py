@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from zerolib.integrity import digest_bytes, DigestError
+from zerolib.protocol.packets import GetFile, RespFile, unpack, unpack_dict
+from zerolib.storage import SiteStore
+from zerolib.storage import store as store_module
+from zerolib.storage.store import Ranges
+
+
+class TestRanges(unittest.TestCase):
+    def test_merge(self):
+        ranges = Ranges()
+        for (start, end) in [(10, 20), (30, 40), (0, 5), (20, 25), (35, 50), (60, 60)]:
+            ranges.add(start, end)
+        self.assertEqual(list(ranges), [(0, 5), (10, 25), (30, 50)])
+        self.assertEqual(len(ranges), 40)
+        self.assertEqual(ranges.missing(70), [(5, 10), (25, 30), (50, 70)])
+
+        ranges.add(3, 31)
+        self.assertEqual(list(ranges), [(0, 50)])
+        self.assertEqual(ranges.missing(50), [])
+
+
+class TestSiteStore(unittest.TestCase):
+    site = '1HeLLo4uzjaLetFx6NH3PMwFP3qbRbTf3D'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = SiteStore(self.root)
+        self.data = os.urandom(3 * 1024 * 1024 + 5)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root)
+
+    def test_path(self):
+        self.assertEqual(self.store.path(self.site, 'js/all.js'), os.path.join(self.root, self.site, 'js', 'all.js'))
+        for evil in ('../evil', 'a/../../evil', '/etc/passwd', ''):
+            with self.assertRaises(ValueError):
+                self.store.path(self.site, evil)
+        for evil in ('..', '.', '', '/etc', '../' + self.site, self.site + '/..', 'a/b', self.root):
+            with self.assertRaises(ValueError):
+                self.store.path(evil, 'content.json')
+
+    def test_download(self):
+        store = self.store
+        digest, size = digest_bytes(self.data)
+        chunk = 256 * 1024
+        offsets = list(range(0, size, chunk))
+
+        # Chunks arrive out of order, from several threads
+        def write(part):
+            for offset in part:
+                store.write_chunk(self.site, 'big.bin', offset, self.data[offset:offset + chunk])
+        store.begin(self.site, 'big.bin', size)
+        threads = [threading.Thread(target=write, args=(offsets[i::4],)) for i in range(3, -1, -1)]
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads[1:]:
+            thread.join()
+        missing = [(offset, min(offset + chunk, size)) for offset in offsets[3::4]]
+        self.assertEqual(store.missing(self.site, 'big.bin'), missing)
+        with self.assertRaises(ValueError):
+            store.finish(self.site, 'big.bin', digest)
+        self.assertFalse(os.path.exists(store.path(self.site, 'big.bin')))
+
+        threads[0].run()
+        path = store.finish(self.site, 'big.bin', digest)
+        self.assertFalse(os.path.exists(path + '.part'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+        self.assertEqual(store.read_range(self.site, 'big.bin', size - 10, 100), (self.data[-10:], size))
+        self.assertEqual(store.read_range(self.site, 'big.bin', 100, 10)[0], self.data[100:110])
+
+        # The shared map follows the file when it is replaced
+        store.write_file(self.site, 'big.bin', self.data[::-1])
+        self.assertEqual(store.read_range(self.site, 'big.bin', 0, 10)[0], self.data[::-1][0:10])
+
+    def test_bad_digest(self):
+        store = self.store
+        store.begin(self.site, 'a.txt', 5)
+        self.assertTrue(store.write_chunk(self.site, 'a.txt', 0, b'hello'))
+        with self.assertRaises(DigestError):
+            store.finish(self.site, 'a.txt', digest_bytes(b'world')[0])
+        self.assertEqual(os.listdir(os.path.join(self.root, self.site)), [])
+        with self.assertRaises(KeyError):
+            store.write_chunk(self.site, 'a.txt', 0, b'hello')
+
+        store.begin(self.site, 'a.txt', 5)
+        with self.assertRaises(ValueError):
+            store.write_chunk(self.site, 'a.txt', 3, b'hello')
+        store.abort(self.site, 'a.txt')
+        self.assertEqual(os.listdir(os.path.join(self.root, self.site)), [])
+
+    def test_abort_during_write(self):
+        store = self.store
+        store.begin(self.site, 'a.txt', 5)
+        writing, resume = threading.Event(), threading.Event()
+        pwrite = store_module._pwrite
+
+        def slow_pwrite(fd, data, offset):
+            writing.set()
+            resume.wait(10)
+            return pwrite(fd, data, offset)
+
+        errors = []
+        def write():
+            try:
+                store.write_chunk(self.site, 'a.txt', 0, b'hello')
+            except Exception as e:
+                errors.append(e)
+
+        store_module._pwrite = slow_pwrite
+        try:
+            writer = threading.Thread(target=write)
+            writer.start()
+            self.assertTrue(writing.wait(10))
+            aborter = threading.Thread(target=store.abort, args=(self.site, 'a.txt'))
+            aborter.start()
+            aborter.join(0.1)
+            # The file stays open until the write ends
+            self.assertTrue(aborter.is_alive())
+            resume.set()
+            writer.join(10)
+            aborter.join(10)
+        finally:
+            store_module._pwrite = pwrite
+        self.assertFalse(aborter.is_alive())
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(os.path.join(self.root, self.site)), [])
+        with self.assertRaises(KeyError):
+            store.write_chunk(self.site, 'a.txt', 0, b'hello')
+
+    def test_serve(self):
+        store = self.store
+        store.write_file(self.site, 'index.html', b'<html>' * 1000)
+
+        request = unpack_dict({
+            b'cmd': b'getFile', b'req_id': 1,
+            b'params': {b'site': self.site.encode(), b'inner_path': b'index.html', b'location': 10},
+        }, 'peer')
+        self.assertIsInstance(request, GetFile)
+        response = store.serve(request)
+        self.assertEqual(response.body, (b'<html>' * 1000)[10:])
+        self.assertEqual((response.offset, response.next_offset, response.total_size), (10, 6000, 6000))
+
+        # Round trip through the wire format, then into another store
+        received = unpack(bytes(response), sender='peer')
+        self.assertIsInstance(received, RespFile)
+        received.site, received.inner_path = self.site, 'copy.html'
+        store.begin(self.site, 'copy.html', 6000)
+        store.write_chunk(self.site, 'copy.html', 0, b'<html><htm')
+        self.assertTrue(store.write_packet(received))
+        store.finish(self.site, 'copy.html')
+        self.assertEqual(store.read_range(self.site, 'copy.html'), store.read_range(self.site, 'index.html'))
@@ -0,0 +1,201 @@
+import socket
+import ssl
+import tempfile
+import threading
+import os
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ec
+from zerolib.protocol.packets import AddrPort
+from zerolib.protocol import certdb, tls
+from zerolib.protocol.tls import make_cert, CertPool, ContextFactory, server_protocol, resumption
+from random import Random
+
+
+class TestCert(unittest.TestCase):
+    def check_cert(self, cert, key_cls):
+        public_pem, secret_pem = cert
+        certificate = x509.load_pem_x509_certificate(public_pem, default_backend())
+        secret = serialization.load_pem_private_key(secret_pem, None, default_backend())
+        self.assertIsInstance(secret, key_cls)
+        self.assertEqual(
+            certificate.public_key().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo),
+            secret.public_key().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo))
+
+        # Usable by the ssl module
+        with tempfile.TemporaryDirectory() as d:
+            for (name, pem) in (('public.pem', public_pem), ('secret.pem', secret_pem)):
+                with open(os.path.join(d, name), 'wb') as f:
+                    f.write(pem)
+            context = ssl.SSLContext(server_protocol)
+            context.load_cert_chain(os.path.join(d, 'public.pem'), os.path.join(d, 'secret.pem'))
+
+    def test_make_cert(self):
+        self.check_cert(make_cert(), rsa.RSAPrivateKey)
+        self.check_cert(make_cert('ec'), ec.EllipticCurvePrivateKey)
+        with self.assertRaises(ValueError):
+            make_cert('dsa')
+
+    def test_pool(self):
+        with CertPool(size=3, key_type='ec') as pool:
+            certs = [pool.take() for i in range(5)]
+            for cert in certs:
+                self.check_cert(cert, ec.EllipticCurvePrivateKey)
+            self.assertEqual(len(set(certs)), 5)
+            self.assertLessEqual(len(pool.ready) + pool.pending, 3)
+
+        with ThreadPoolExecutor(1) as executor:
+            pool = CertPool(size=2, key_type='ec', executor=executor)
+            executor.shutdown(wait=True)
+            self.assertEqual((len(pool.ready), pool.pending), (2, 0))
+            pool.take()
+            self.assertEqual(len(pool.ready), 1)
+
+
+class TestCertdb(unittest.TestCase):
+    def test_catalog(self):
+        # catalog.json must be regenerated when the .list files change
+        catalog = certdb.catalog_from_json(certdb.compile_catalog())
+        self.assertEqual(certdb.load_catalog(), catalog)
+        self.assertEqual(len(catalog.defaults), 7)
+        self.assertIn('localhost', catalog.defaults[0].dns_names)
+
+    def test_load_once(self):
+        certdb.catalog = None
+        loaded = []
+        threads = [threading.Thread(target=lambda: loaded.append(certdb.load_catalog())) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(c) for c in loaded}), 1)
+
+    def test_bulk(self):
+        fields = certdb.make_fields_bulk(1000, Random(42))
+        self.assertEqual(fields, certdb.make_fields_bulk(1000, Random(42)))
+        self.assertGreater(len(set(fields)), 300)
+        for f in fields:
+            self.assertIn(f.delta, certdb.list_delta)
+            self.assertTrue(f.dns_names)
+
+        TestCert.check_cert(self, make_cert('ec', fields[0]), ec.EllipticCurvePrivateKey)
+
+
+class TestContextFactory(unittest.TestCase):
+    @unittest.skipUnless(resumption, 'session resumption needs Python 3.6')
+    def test_resumption(self):
+        factory = ContextFactory(session_capacity=1)
+        cert = make_cert('ec')
+        server = factory.server_context(cert)
+        self.assertIs(factory.server_context(cert), server)
+        self.assertIs(factory.client_context(), factory.client_context())
+        self.assertIsNot(factory.client_context(cert), factory.client_context())
+
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+
+        def serve(count):
+            for i in range(count):
+                conn, _ = listener.accept()
+                with server.wrap_socket(conn, server_side=True) as ssl_sock:
+                    ssl_sock.sendall(b'!')
+                    ssl_sock.recv(1)
+        thread = threading.Thread(target=serve, args=(4,))
+        thread.start()
+
+        reused = []
+        dests = [AddrPort('127.0.0.1', port), AddrPort('127.0.0.1', port), AddrPort('localhost', port), AddrPort('127.0.0.1', port)]
+        try:
+            for dest in dests:
+                with factory.wrap_client(socket.create_connection(('127.0.0.1', port)), dest) as ssl_sock:
+                    self.assertEqual(ssl_sock.recv(1), b'!')
+                    factory.save_session(dest, ssl_sock)
+                    reused.append(ssl_sock.session_reused)
+                    ssl_sock.sendall(b'!')
+        finally:
+            thread.join()
+            listener.close()
+        # Only one session is kept, so the last connection starts over
+        self.assertEqual(reused, [False, True, False, False])
+        self.assertEqual(list(factory.sessions), [(factory.client_context(), dests[-1])])
+
+    @unittest.skipUnless(resumption, 'session resumption needs Python 3.6')
+    def test_switch_identity(self):
+        factory = ContextFactory()
+        server = factory.server_context(make_cert('ec'))
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        dest = AddrPort('127.0.0.1', port)
+        certs = [None, make_cert('ec'), None, make_cert('ec')]
+
+        # A failed client must not leave the server waiting forever
+        listener.settimeout(10)
+
+        def serve(count):
+            for i in range(count):
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                try:
+                    with server.wrap_socket(conn, server_side=True) as ssl_sock:
+                        ssl_sock.sendall(b'!')
+                        ssl_sock.recv(1)
+                except (OSError, ValueError):
+                    pass
+        thread = threading.Thread(target=serve, args=(len(certs),))
+        thread.start()
+
+        reused = []
+        try:
+            # Each identity resumes its own session only
+            for cert in certs:
+                with factory.wrap_client(socket.create_connection(('127.0.0.1', port)), dest, cert) as ssl_sock:
+                    self.assertEqual(ssl_sock.recv(1), b'!')
+                    factory.save_session(dest, ssl_sock)
+                    reused.append(ssl_sock.session_reused)
+                    ssl_sock.sendall(b'!')
+        finally:
+            thread.join()
+            listener.close()
+        self.assertEqual(reused, [False, False, True, False])
+        self.assertEqual(len(factory.sessions), 3)
+
+        factory.forget(dest, certs[1])
+        self.assertEqual(len(factory.sessions), 2)
+
+    def test_no_resumption(self):
+        # What Python 3.5 gets: full handshakes and no sessions kept
+        with mock.patch.object(tls, 'resumption', False):
+            factory = ContextFactory()
+            server = factory.server_context(make_cert('ec'))
+            listener = socket.socket()
+            listener.bind(('127.0.0.1', 0))
+            listener.listen()
+            port = listener.getsockname()[1]
+            dest = AddrPort('127.0.0.1', port)
+
+            def serve():
+                conn, _ = listener.accept()
+                with server.wrap_socket(conn, server_side=True) as ssl_sock:
+                    ssl_sock.sendall(b'!')
+                    ssl_sock.recv(1)
+            thread = threading.Thread(target=serve)
+            thread.start()
+            try:
+                with factory.wrap_client(socket.create_connection(('127.0.0.1', port)), dest) as ssl_sock:
+                    self.assertEqual(ssl_sock.recv(1), b'!')
+                    factory.save_session(dest, ssl_sock)
+                    ssl_sock.sendall(b'!')
+            finally:
+                thread.join()
+                listener.close()
+            self.assertEqual(len(factory.sessions), 0)